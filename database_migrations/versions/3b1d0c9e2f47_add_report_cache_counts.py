@@ -0,0 +1,25 @@
+"""
+Add metric cache hit and miss counts to reports
+
+Revision ID: 3b1d0c9e2f47
+Revises: 1a5740750a28
+Create Date: 2026-10-17 10:12:45.118230
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '3b1d0c9e2f47'
+down_revision = '1a5740750a28'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('report', sa.Column('cache_hits', sa.Integer(), nullable=True))
+    op.add_column('report', sa.Column('cache_misses', sa.Integer(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('report', 'cache_misses')
+    op.drop_column('report', 'cache_hits')
@@ -0,0 +1,37 @@
+"""
+Add partial aggregates for incremental recurrent reports
+
+Revision ID: 4c2e1a7b9d30
+Revises: 3b1d0c9e2f47
+Create Date: 2026-10-17 11:02:19.403811
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '4c2e1a7b9d30'
+down_revision = '3b1d0c9e2f47'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table(
+        'report_partial_aggregate',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('report_id', sa.Integer(), nullable=False),
+        sa.Column('submetric', sa.String(length=255), nullable=False),
+        sa.Column('slice', sa.DateTime(), nullable=False),
+        sa.Column('count', sa.Integer(), nullable=False),
+        sa.Column('sum', sa.Numeric(precision=40, scale=10), nullable=False),
+        sa.Column('sum_of_squares', sa.Numeric(precision=40, scale=10), nullable=False),
+        sa.ForeignKeyConstraint(['report_id'], ['report.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint(
+            'report_id', 'submetric', 'slice', name='uix_partial_aggregate'
+        ),
+    )
+
+
+def downgrade():
+    op.drop_table('report_partial_aggregate')
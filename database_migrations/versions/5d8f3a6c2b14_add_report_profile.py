@@ -0,0 +1,26 @@
+"""
+Add the profile of each report's queries and phases
+
+Revision ID: 5d8f3a6c2b14
+Revises: 4c2e1a7b9d30
+Create Date: 2026-10-17 20:31:07.582214
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '5d8f3a6c2b14'
+down_revision = '4c2e1a7b9d30'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column(
+        'report',
+        sa.Column('profile', sa.Text(length=2 ** 24 - 1), nullable=True)
+    )
+
+
+def downgrade():
+    op.drop_column('report', 'profile')
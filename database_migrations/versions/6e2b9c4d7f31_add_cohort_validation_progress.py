@@ -0,0 +1,27 @@
+"""
+Add the progress of each cohort's validation
+
+Revision ID: 6e2b9c4d7f31
+Revises: 5d8f3a6c2b14
+Create Date: 2026-10-17 21:12:40.925361
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '6e2b9c4d7f31'
+down_revision = '5d8f3a6c2b14'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('cohort', sa.Column('validation_total', sa.Integer(), nullable=True))
+    op.add_column('cohort', sa.Column('validation_valid', sa.Integer(), nullable=True))
+    op.add_column('cohort', sa.Column('validation_invalid', sa.Integer(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('cohort', 'validation_invalid')
+    op.drop_column('cohort', 'validation_valid')
+    op.drop_column('cohort', 'validation_total')
@@ -0,0 +1,23 @@
+"""
+Add when each wiki user was last validated
+
+Revision ID: 7a4c1e8b5d92
+Revises: 6e2b9c4d7f31
+Create Date: 2026-10-17 21:48:03.117482
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '7a4c1e8b5d92'
+down_revision = '6e2b9c4d7f31'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('wiki_user', sa.Column('last_validated', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('wiki_user', 'last_validated')
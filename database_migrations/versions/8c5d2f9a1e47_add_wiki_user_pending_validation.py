@@ -0,0 +1,40 @@
+"""
+Add the pending results of an incremental validation to wiki users
+
+Revision ID: 8c5d2f9a1e47
+Revises: 7a4c1e8b5d92
+Create Date: 2026-10-17 23:12:41.508236
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '8c5d2f9a1e47'
+down_revision = '7a4c1e8b5d92'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('wiki_user', sa.Column('pending_valid', sa.Boolean(), nullable=True))
+    op.add_column(
+        'wiki_user',
+        sa.Column('pending_reason', sa.String(length=200), nullable=True),
+    )
+    op.add_column(
+        'wiki_user',
+        sa.Column('pending_username', sa.String(length=255), nullable=True),
+    )
+    op.add_column('wiki_user', sa.Column('pending_userid', sa.Integer(), nullable=True))
+    op.add_column(
+        'wiki_user',
+        sa.Column('pending_project', sa.String(length=45), nullable=True),
+    )
+
+
+def downgrade():
+    op.drop_column('wiki_user', 'pending_project')
+    op.drop_column('wiki_user', 'pending_userid')
+    op.drop_column('wiki_user', 'pending_username')
+    op.drop_column('wiki_user', 'pending_reason')
+    op.drop_column('wiki_user', 'pending_valid')
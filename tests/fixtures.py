@@ -54,6 +54,7 @@ from wikimetrics.models import (
     CohortUserRole,
     CohortUser,
     PersistentReport,
+    PartialAggregate,
     Revision,
     Page,
     MediawikiUser,
@@ -433,6 +434,7 @@ class DatabaseTest(unittest.TestCase):
         self.session.query(WikiUser).delete()
         self.session.query(Cohort).delete()
         self.session.query(User).delete()
+        self.session.query(PartialAggregate).delete()
         self.session.query(PersistentReport).delete()
         self.session.commit()
         self.session.close()
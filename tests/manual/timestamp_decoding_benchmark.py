@@ -0,0 +1,73 @@
+"""
+Compares the ways a MediaWiki timestamp can be read from a result row:
+    strptime        : what parse_date used to do
+    parse_date      : slicing the 14 digits
+    decode          : parse_date, remembering recent values like MediawikiTimestamp
+    raw             : the integer raw_timestamp gives, plus its slice for a daily
+                      timeseries, which skips datetime creation entirely
+
+Run with:
+    python -m tests.manual.timestamp_decoding_benchmark
+"""
+from datetime import datetime, timedelta
+from timeit import timeit
+
+from wikimetrics.utils import parse_date, format_date, MEDIAWIKI_TIMESTAMP
+from wikimetrics.models.mediawiki.custom_columns import decode_timestamp
+from wikimetrics.metrics import NamespaceEdits, TimeseriesChoices
+
+
+ROWS = 100000
+# a revision every 17 seconds, with some timestamps repeated like in real rows
+start = datetime(2013, 1, 1)
+timestamps = [
+    format_date(start + timedelta(seconds=17 * (i // 2)))
+    for i in range(ROWS)
+]
+integers = [int(t) for t in timestamps]
+metric = NamespaceEdits(
+    start_date=start,
+    end_date=start + timedelta(seconds=17 * ROWS),
+    timeseries=TimeseriesChoices.DAY,
+)
+
+
+def strptime():
+    for t in timestamps:
+        datetime.strptime(t, MEDIAWIKI_TIMESTAMP)
+
+
+def sliced():
+    for t in timestamps:
+        parse_date(t)
+
+
+def decode():
+    for t in timestamps:
+        decode_timestamp(t)
+
+
+def raw():
+    for t in integers:
+        metric.raw_date_slice(t)
+
+
+def slice_from_datetime():
+    for t in timestamps:
+        metric.date_slice(parse_date(t))
+
+
+if __name__ == '__main__':
+    baseline = None
+    for name, run in [
+        ('strptime', strptime),
+        ('parse_date', sliced),
+        ('decode', decode),
+        ('date_slice(parse_date)', slice_from_datetime),
+        ('raw_date_slice', raw),
+    ]:
+        seconds = timeit(run, number=3) / 3
+        baseline = baseline or seconds
+        print('{0:>24}: {1:.3f}s for {2} rows, {3:.1f}x'.format(
+            name, seconds, ROWS, baseline / seconds
+        ))
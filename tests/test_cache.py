@@ -0,0 +1,69 @@
+import unittest
+from time import sleep
+from nose.tools import assert_equals, assert_true, assert_false
+from wikimetrics.metrics import metric_classes
+from wikimetrics.api import MetricResultCache, LocalCacheStore
+
+
+class LocalCacheStoreTest(unittest.TestCase):
+
+    def test_get_many(self):
+        store = LocalCacheStore(10, 60)
+        store.set_many({'a': 1, 'b': 2})
+        assert_equals(store.get_many(['a', 'b', 'c']), {'a': 1, 'b': 2})
+    
+    def test_evicts_least_recently_used(self):
+        store = LocalCacheStore(2, 60)
+        store.set_many({'a': 1})
+        store.set_many({'b': 2})
+        store.get_many(['a'])
+        store.set_many({'c': 3})
+        assert_equals(store.get_many(['a', 'b', 'c']), {'a': 1, 'c': 3})
+    
+    def test_expires(self):
+        store = LocalCacheStore(10, 0.01)
+        store.set_many({'a': 1})
+        sleep(0.02)
+        assert_equals(store.get_many(['a']), {})
+
+
+class MetricResultCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = MetricResultCache(LocalCacheStore(10, 60))
+    
+    def metric(self, **kwargs):
+        parameters = {
+            'name': 'NamespaceEdits',
+            'namespaces': [0, 1, 2],
+            'start_date': '2013-01-01 00:00:00',
+            'end_date': '2013-01-02 00:00:00',
+        }
+        parameters.update(kwargs)
+        return metric_classes['NamespaceEdits'](**parameters)
+    
+    def test_round_trip(self):
+        results = {1: {'edits': 2}, 2: {'edits': 0}}
+        self.cache.set_many('wiki', self.metric(), results)
+        found = self.cache.get_many('wiki', self.metric(), [1, 2, 3])
+        assert_equals(found, results)
+    
+    def test_keyed_by_parameters_and_project(self):
+        self.cache.set_many('wiki', self.metric(), {1: {'edits': 2}})
+        other_window = self.metric(end_date='2013-01-03 00:00:00')
+        assert_equals(self.cache.get_many('wiki', other_window, [1]), {})
+        assert_equals(self.cache.get_many('dewiki', self.metric(), [1]), {})
+    
+    def test_cacheable(self):
+        assert_true(self.cache.cacheable(self.metric()))
+        assert_false(self.cache.cacheable(self.metric(end_date='2100-01-01 00:00:00')))
+        assert_false(self.cache.cacheable(metric_classes['Threshold']()))
+    
+    def test_from_config(self):
+        assert_equals(MetricResultCache.from_config({'METRIC_CACHE': None}), None)
+        cache = MetricResultCache.from_config({
+            'METRIC_CACHE': 'local',
+            'METRIC_CACHE_TTL': 60,
+            'METRIC_CACHE_SIZE': 10,
+        })
+        assert_true(isinstance(cache.store, LocalCacheStore))
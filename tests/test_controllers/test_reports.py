@@ -119,6 +119,14 @@ class ReportsControllerTest(WebTest):
         # Check the json result
         response = self.client.get('/reports/result/{0}.json'.format(result_key))
         assert_true(response.data.find('Average') >= 0)
+        assert_true(response.data.find('Individual Results') >= 0)
+        
+        # Check the json result without individual results
+        response = self.client.get(
+            '/reports/result/{0}.json?aggregates_only=true'.format(result_key)
+        )
+        assert_true(response.data.find('Average') >= 0)
+        assert_true(response.data.find('Individual Results') < 0)
     
     def test_index(self):
         response = self.client.get('/reports/', follow_redirects=True)
@@ -157,6 +165,23 @@ class ReportsControllerTest(WebTest):
             'but instead returned:\n{0}'.format(response.data)
         )
     
+    def test_report_profile(self):
+        report = PersistentReport(
+            user_id=self.owner_user_id,
+            status=celery.states.SUCCESS,
+            show_in_ui=True,
+            profile=json.dumps({'name': '<RunReport("1")>', 'children': []}),
+        )
+        self.session.add(report)
+        self.session.commit()
+        
+        response = self.client.get('/reports/profile/{0}'.format(report.id))
+        parsed = json.loads(response.data)
+        assert_equal(parsed['profile']['name'], '<RunReport("1")>')
+        
+        response = self.client.get('/reports/profile/{0}'.format(report.id + 1))
+        assert_true(response.data.find('isError') >= 0)
+    
     def test_report_request_get(self):
         response = self.client.get('/reports/create/')
         assert_equal(response.status_code, 200)
@@ -296,6 +321,50 @@ class ReportsControllerTest(WebTest):
         response = self.client.get('/reports/result/{0}.csv'.format(result_key))
         assert_true(response.data.find('Standard Deviation') >= 0)
     
+    def test_report_result_quantiles_csv(self):
+        # Make the request
+        desired_responses = [{
+            'name': 'Edits - test',
+            'cohort': {
+                'id': self.cohort.id,
+                'name': self.cohort.name,
+            },
+            'metric': {
+                'name': 'NamespaceEdits',
+                'namespaces': [0, 1, 2],
+                'start_date': '2013-01-01 00:00:00',
+                'end_date': '2013-04-01 00:00:00',
+                'individualResults': False,
+                'aggregateResults': True,
+                'aggregateSum': False,
+                'aggregateAverage': False,
+                'aggregateStandardDeviation': False,
+                'aggregateMedian': True,
+                'aggregatePercentiles': '99, 90',
+            },
+        }]
+        json_to_post = json.dumps(desired_responses)
+        
+        response = self.client.post('/reports/create/', data=dict(
+            responses=json_to_post
+        ))
+        
+        # Wait a second for the task to get processed
+        time.sleep(1)
+        
+        # Check that the task has been created
+        response = self.client.get('/reports/list/')
+        parsed = json.loads(response.data)
+        result_key = parsed['reports'][-1]['result_key']
+        task, report = get_celery_task(result_key)
+        
+        # Check the csv result, percentiles come after the median, lowest first
+        response = self.client.get('/reports/result/{0}.csv'.format(result_key))
+        median = response.data.find('Median')
+        p90 = response.data.find('Percentile 90')
+        p99 = response.data.find('Percentile 99')
+        assert_true(0 <= median < p90 < p99)
+    
     def test_save_public_report(self):
         fake_path = "fake_path"
         file_manager = PublicReportFileManager(self.logger, '/some/fake/absolute/path')
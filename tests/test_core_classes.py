@@ -1,6 +1,9 @@
 import os
+from time import sleep
+from threading import Lock
+from multiprocessing import TimeoutError
 from unittest import TestCase
-from nose.tools import assert_equals, assert_true
+from nose.tools import assert_equals, assert_true, raises
 from wikimetrics.configurables import db, parse_db_connection_string, queue
 from wikimetrics.database import get_host_projects, get_host_projects_map
 
@@ -30,6 +33,44 @@ class DatabaseSetupTest(TestCase):
         assert_equals(host, 'localhost')
         assert_equals(dbName, 'wikimetrics')
     
+    def test_run_by_host_keeps_order(self):
+        work = [
+            ('wiki', lambda: sleep(0.02) or 'first'),
+            ('dewiki', lambda: 'second'),
+            ('enwiki', lambda: 'third'),
+        ]
+        assert_equals(db.run_by_host(work, 2), ['first', 'second', 'third'])
+    
+    def test_run_by_host_nothing_to_do(self):
+        assert_equals(db.run_by_host([], 2), [])
+    
+    @raises(TimeoutError)
+    def test_run_by_host_timeout(self):
+        db.run_by_host([('wiki', lambda: sleep(1))], 1, timeout=0.1)
+    
+    def test_run_by_host_nested_pools_share_the_cap(self):
+        running = []
+        most = []
+        lock = Lock()
+        
+        def leaf():
+            with lock:
+                running.append(1)
+                most.append(len(running))
+            sleep(0.05)
+            with lock:
+                running.pop()
+            return 'leaf'
+        
+        def node():
+            return db.run_by_host([('wiki', leaf), ('dewiki', leaf)], 2)
+        
+        results = db.run_by_host([('wiki', node), ('wiki', node)], 2)
+        
+        assert_equals(results, [['leaf', 'leaf'], ['leaf', 'leaf']])
+        assert_true(max(most) <= 2)
+        assert_equals(db.get_held_slots(), [])
+    
     #def test_get_fresh_project_host_map(self):
         #project_host_map_cache_file = 'project_host_map.json'
         ## make sure any cached file is deleted
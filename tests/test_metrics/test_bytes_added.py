@@ -1,5 +1,8 @@
+from mock import patch
 from nose.tools import assert_true, assert_equal, assert_false
 from tests.fixtures import DatabaseTest
+from wikimetrics.configurables import db
+from wikimetrics.api import get_revision_length_cache
 from wikimetrics.metrics import BytesAdded, TimeseriesChoices
 
 
@@ -202,3 +205,32 @@ class BytesAddedTimeseriesTest(DatabaseTest):
             }
         }
         assert_equal(results[self.editors[0].user_id], expected1)
+    
+    def test_engines_agree(self):
+        for timeseries in [TimeseriesChoices.NONE, TimeseriesChoices.DAY]:
+            for net_sum in [True, False]:
+                metric = BytesAdded(
+                    namespaces=[0],
+                    start_date='2012-12-31 00:00:00',
+                    end_date='2013-01-14 00:00:00',
+                    net_sum=net_sum,
+                    timeseries=timeseries,
+                )
+                assert_equal(
+                    metric.parent_lookup(list(self.cohort), self.mwSession),
+                    metric.derived_table(list(self.cohort), self.mwSession),
+                )
+    
+    @patch('wikimetrics.api.cache.revision_length_cache', None)
+    def test_parent_lengths_are_cached(self):
+        # the cache is off by default, every worker process would have a copy
+        with patch.dict(db.config, {'REVISION_LENGTH_CACHE_SIZE': 100}):
+            metric = BytesAdded(namespaces=[0])
+            parent_ids = set(r.rev_id for r in self.revisions)
+            lengths = metric.parent_lengths(self.mwSession, parent_ids)
+            assert_equal(lengths, {r.rev_id: r.rev_len for r in self.revisions})
+            
+            cache = get_revision_length_cache(db.config)
+            database = self.mwSession.bind.url.database
+            key = '{0}:{1}'.format(database, self.revisions[0].rev_id)
+            assert_equal(cache.get_many([key]), {key: self.revisions[0].rev_len})
@@ -0,0 +1,113 @@
+import pickle
+from threading import Thread, Event
+from mock import patch
+from nose.tools import assert_equal, assert_true, assert_false
+from tests.fixtures import DatabaseTest
+from wikimetrics.metrics import (
+    FusedRevisionScan, NamespaceEdits, PagesCreated, BytesAdded, Threshold,
+    TimeseriesChoices,
+)
+
+
+class FusedRevisionScanTest(DatabaseTest):
+    
+    def setUp(self):
+        DatabaseTest.setUp(self)
+        self.common_cohort_2()
+    
+    def metrics(self, **parameters):
+        return [
+            NamespaceEdits(**parameters),
+            PagesCreated(**parameters),
+            BytesAdded(**parameters),
+        ]
+    
+    def test_fused_results_match_separate_results(self):
+        for timeseries in [TimeseriesChoices.NONE, TimeseriesChoices.DAY]:
+            parameters = dict(
+                namespaces=[0],
+                start_date='2012-12-31 00:00:00',
+                end_date='2013-01-14 00:00:00',
+                timeseries=timeseries,
+            )
+            expected = [
+                metric(list(self.cohort), self.mwSession)
+                for metric in self.metrics(**parameters)
+            ]
+            
+            fused = self.metrics(**parameters)
+            scans = FusedRevisionScan.fuse(fused)
+            assert_equal(len(scans), 1)
+            assert_equal(
+                [metric(list(self.cohort), self.mwSession) for metric in fused],
+                expected,
+            )
+            # every metric took its results, so nothing is left in memory
+            assert_equal(scans[0].pending, {})
+    
+    def test_only_metrics_with_the_same_filters_are_fused(self):
+        parameters = dict(
+            start_date='2012-12-31 00:00:00',
+            end_date='2013-01-14 00:00:00',
+        )
+        edits = NamespaceEdits(namespaces=[0], **parameters)
+        pages = PagesCreated(namespaces=[0], **parameters)
+        other_namespace = BytesAdded(namespaces=[1], **parameters)
+        threshold = Threshold(namespaces=[0])
+        
+        scans = FusedRevisionScan.fuse([edits, pages, other_namespace, threshold])
+        assert_equal(len(scans), 1)
+        assert_true(edits.fused_scan is pages.fused_scan)
+        assert_true(other_namespace.fused_scan is None)
+        assert_false(FusedRevisionScan.fusion_key(threshold))
+    
+    def test_survives_pickling(self):
+        fused = self.metrics(namespaces=[0])
+        FusedRevisionScan.fuse(fused)
+        fused = pickle.loads(pickle.dumps(fused))
+        assert_true(fused[0].fused_scan is fused[2].fused_scan)
+        
+        results = fused[0](list(self.cohort), self.mwSession)
+        assert_equal(results, NamespaceEdits(namespaces=[0])(
+            list(self.cohort), self.mwSession
+        ))
+    
+    def test_scans_run_outside_the_lock(self):
+        fused = self.metrics(namespaces=[0])
+        scan = FusedRevisionScan.fuse(fused)[0]
+        user_ids = list(self.cohort)
+        started = Event()
+        release = Event()
+        scans = []
+        
+        def blocking_scan(user_ids, session):
+            scans.append(user_ids)
+            # another chunk can be scanned while this one is
+            assert_true(scan.lock.acquire(False))
+            scan.lock.release()
+            if len(scans) == 1:
+                started.set()
+                release.wait(10)
+            return dict((id(metric), len(user_ids)) for metric in fused)
+        
+        with patch.object(scan, 'scan', side_effect=blocking_scan):
+            results = {}
+            
+            def run(metric, user_ids):
+                results[id(metric)] = metric.fused_scan(metric, user_ids, self.mwSession)
+            
+            first = Thread(target=run, args=(fused[0], user_ids))
+            first.start()
+            started.wait(10)
+            # the same chunk waits for the scan that is running
+            second = Thread(target=run, args=(fused[1], user_ids))
+            second.start()
+            # a different chunk does not
+            assert_equal(scan(fused[2], user_ids[:1], self.mwSession), 1)
+            release.set()
+            first.join(10)
+            second.join(10)
+        
+        assert_equal(len(scans), 2)
+        assert_equal(results[id(fused[0])], len(user_ids))
+        assert_equal(results[id(fused[1])], len(user_ids))
@@ -5,6 +5,7 @@ from tests.fixtures import QueueDatabaseTest, DatabaseTest, mediawiki_project
 from wikimetrics.configurables import db
 from wikimetrics.metrics import NamespaceEdits, TimeseriesChoices
 from wikimetrics.models import Cohort, MetricReport
+from wikimetrics.utils import parse_pretty_date
 
 
 class NamespaceEditsDatabaseTest(DatabaseTest):
@@ -206,6 +207,46 @@ class NamespaceEditsTimeseriesTest(DatabaseTest):
             }
         )
     
+    def test_timeseries_week(self):
+        parameters = dict(
+            namespaces=[0],
+            start_date='2012-12-31 00:00:00',
+            end_date='2013-01-14 00:00:00',
+        )
+        days = NamespaceEdits(timeseries=TimeseriesChoices.DAY, **parameters)
+        weeks = NamespaceEdits(timeseries=TimeseriesChoices.WEEK, **parameters)
+        day_results = days(list(self.cohort), self.mwSession)
+        week_results = weeks(list(self.cohort), self.mwSession)
+        
+        for editor in self.editors:
+            expected = {'2012-12-31 00:00:00': 0, '2013-01-07 00:00:00': 0}
+            for day, edits in day_results[editor.user_id]['edits'].items():
+                week = weeks.date_slice(parse_pretty_date(day))
+                expected[week] = expected.get(week, 0) + edits
+            assert_equal(week_results[editor.user_id]['edits'], expected)
+    
+    def test_bucket_engine_matches_date_parts(self):
+        engine = db.config.get('TIMESERIES_ENGINE')
+        try:
+            for timeseries in [
+                TimeseriesChoices.HOUR,
+                TimeseriesChoices.DAY,
+                TimeseriesChoices.MONTH,
+                TimeseriesChoices.YEAR,
+            ]:
+                metric = NamespaceEdits(
+                    namespaces=[0],
+                    start_date='2012-12-31 10:00:00',
+                    end_date='2014-01-02 00:00:00',
+                    timeseries=timeseries,
+                )
+                db.config['TIMESERIES_ENGINE'] = 'bucket'
+                buckets = metric(list(self.cohort), self.mwSession)
+                db.config['TIMESERIES_ENGINE'] = 'date_parts'
+                assert_equal(buckets, metric(list(self.cohort), self.mwSession))
+        finally:
+            db.config['TIMESERIES_ENGINE'] = engine
+    
     def test_timeseries_hour(self):
         metric = NamespaceEdits(
             namespaces=[0],
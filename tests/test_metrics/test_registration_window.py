@@ -0,0 +1,90 @@
+from datetime import datetime
+from unittest import TestCase
+from mock import patch
+from nose.tools import assert_equal, assert_true, assert_false
+
+from wikimetrics.metrics.registration_window import RegistrationWindows
+
+
+class RegistrationWindowsTest(TestCase):
+
+    def setUp(self):
+        self.windows = RegistrationWindows(
+            {
+                1: datetime(2013, 1, 1),
+                2: datetime(2013, 1, 1, 12),
+                3: datetime(2013, 3, 1),
+                4: None,
+            },
+            start_seconds=3600,
+            end_seconds=7200,
+        )
+    
+    def test_no_registrations(self):
+        windows = RegistrationWindows({1: None}, 0, 3600)
+        assert_equal(windows.filter(), None)
+        assert_equal(windows.inner(), None)
+        assert_equal(windows.edges(), None)
+        assert_equal(RegistrationWindows({}, 0, 3600).filter(), None)
+    
+    def test_users_registered_the_same_day_share_a_range(self):
+        compiled = self.windows.filter().compile()
+        
+        assert_equal(str(compiled).count(' IN ('), 2)
+        values = compiled.params.values()
+        assert_true(datetime(2013, 1, 1, 1) in values)
+        assert_true(datetime(2013, 1, 1, 14) in values)
+        assert_true(datetime(2013, 3, 1, 1) in values)
+        assert_true(datetime(2013, 3, 1, 2) in values)
+        assert_false(4 in values)
+    
+    def test_inner_and_edges(self):
+        # the first bucket is wider than the windows, so all of it is an edge
+        inner = self.windows.inner().compile()
+        assert_equal(str(inner).count(' IN ('), 1)
+        assert_true(datetime(2013, 3, 1, 1) in inner.params.values())
+        
+        edges = self.windows.edges().compile()
+        assert_equal(str(edges).count(' IN ('), 1)
+        assert_true(datetime(2013, 1, 1, 14) in edges.params.values())
+    
+    def test_wider_buckets_when_there_are_too_many(self):
+        with patch.object(RegistrationWindows, 'MAX_BUCKETS', 1):
+            windows = RegistrationWindows(
+                {1: datetime(2013, 1, 1), 2: datetime(2014, 1, 1)}, 0, 3600
+            )
+        assert_equal(len(windows.buckets), 1)
+        assert_equal(str(windows.filter().compile()).count(' IN ('), 1)
+    
+    def test_contains_only_each_users_own_window(self):
+        windows = self.windows
+        assert_true(windows.contains(1, datetime(2013, 1, 1, 1)))
+        assert_true(windows.contains(1, datetime(2013, 1, 1, 2)))
+        assert_false(windows.contains(1, datetime(2013, 1, 1, 2, 0, 1)))
+        assert_false(windows.contains(1, datetime(2013, 1, 1, 13, 30)))
+        assert_true(windows.contains(2, datetime(2013, 1, 1, 13, 30)))
+        assert_false(windows.contains(4, datetime(2013, 1, 1, 1, 30)))
+        assert_false(windows.contains(5, datetime(2013, 1, 1, 1, 30)))
+    
+    def test_each_user_is_bounded_by_their_own_bucket(self):
+        # like Threshold, which reads revisions up to the end of the window
+        windows = RegistrationWindows(
+            {1: datetime(2010, 1, 1), 2: datetime(2013, 1, 1)}, end_seconds=86400
+        )
+        compiled = windows.filter().compile()
+        
+        assert_equal(str(compiled).count(' IN ('), 2)
+        assert_equal(str(compiled).count('>='), 0)
+        assert_equal(
+            sorted(v for v in compiled.params.values() if isinstance(v, datetime)),
+            [datetime(2010, 1, 2), datetime(2013, 1, 2)],
+        )
+    
+    def test_open_ended(self):
+        windows = RegistrationWindows({1: datetime(2013, 1, 1)}, start_seconds=0)
+        
+        compiled = str(windows.filter().compile())
+        assert_equal(compiled.count('>='), 1)
+        assert_equal(compiled.count('<='), 0)
+        assert_equal(windows.edges(), None)
+        assert_true(windows.contains(1, datetime(2030, 1, 1)))
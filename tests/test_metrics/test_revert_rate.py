@@ -1,8 +1,10 @@
 from datetime import datetime
-from nose.tools import assert_true, assert_equal, nottest
+from mock import patch
+from nose.tools import assert_true, assert_equal
 from tests.fixtures import QueueDatabaseTest, DatabaseTest
 from wikimetrics.metrics import RevertRate, TimeseriesChoices
 from wikimetrics.models import Cohort, MetricReport
+from wikimetrics.utils import r
 
 
 class RevertRateTest(DatabaseTest):
@@ -21,40 +23,81 @@ class RevertRateTest(DatabaseTest):
                 [2, 4, 5],  # User B reverts user A's edit #3 back to edit #2.
             ],
         )
+        # the content of each revision is identified by its length here
+        for revision in self.revisions:
+            revision.rev_sha1 = 'content-{0}'.format(revision.rev_len)
+        self.mwSession.commit()
 
-    @nottest
     def test_single_revert(self):
         metric = RevertRate(
-            # namespaces=[0],
+            namespaces=[0],
             start_date='2012-12-31 00:00:00',
             end_date='2014-01-02 00:00:00',
+        )
+        results = metric(list(self.cohort), self.mwSession)
+
+        # User A had one revert
+        assert_equal(results[self.editors[0].user_id], {
+            'edits': 3,
+            'reverts': 1,
+            'revert_rate': r(1.0 / 3),
+        })
+        # User B had no reverts
+        assert_equal(results[self.editors[1].user_id], {
+            'edits': 3,
+            'reverts': 0,
+            'revert_rate': r(0),
+        })
+
+    def test_pages_in_chunks(self):
+        metric = RevertRate(
+            namespaces=[0],
+            start_date='2012-12-31 00:00:00',
+            end_date='2014-01-02 00:00:00',
+        )
+        with patch.object(RevertRate, 'PAGES_PER_QUERY', 1):
+            results = metric(list(self.cohort), self.mwSession)
+
+        assert_equal(results[self.editors[0].user_id]['reverts'], 1)
+        assert_equal(results[self.editors[1].user_id]['edits'], 3)
+
+    def test_single_revert_timeseries(self):
+        metric = RevertRate(
+            namespaces=[0],
+            start_date='2012-12-31 00:00:00',
+            end_date='2013-01-03 00:00:00',
             timeseries=TimeseriesChoices.DAY,
         )
         results = metric(list(self.cohort), self.mwSession)
 
-        results_should_be = {
-            # User A had one revert
-            self.editors[0].user_id: {
-                'edits': 3,
-                'reverts': 1,
-                'revert_rate': float(1) / float(3),
-            },
-            # User B had no reverts
-            self.editors[1].user_id: {
-                'edits': 3,
-                'reverts': 0,
-                'revert_rate': 0,
-            },
-        }
-
-        # check user A's results
-        assert_equal(
-            results[self.editors[0].user_id],
-            results_should_be[self.editors[0].user_id]
+        user_a = results[self.editors[0].user_id]
+        assert_equal(user_a['edits']['2012-12-31 00:00:00'], 1)
+        assert_equal(user_a['edits']['2013-01-01 00:00:00'], 2)
+        assert_equal(user_a['reverts']['2012-12-31 00:00:00'], 0)
+        assert_equal(user_a['reverts']['2013-01-01 00:00:00'], 1)
+        assert_equal(user_a['revert_rate']['2013-01-01 00:00:00'], r(0.5))
+        user_b = results[self.editors[1].user_id]
+        assert_equal(user_b['reverts']['2013-01-02 00:00:00'], 0)
+
+    def test_reverted_to_outside_window(self):
+        metric = RevertRate(
+            namespaces=[0],
+            start_date='2013-01-01 00:45:00',
+            end_date='2014-01-02 00:00:00',
         )
+        results = metric(list(self.cohort), self.mwSession)
+
+        # the revision that was restored is before start_date
+        assert_equal(results[self.editors[0].user_id]['reverts'], 0)
+        assert_equal(results[self.editors[0].user_id]['edits'], 1)
 
-        # check user B's results
-        assert_equal(
-            results[self.editors[1].user_id],
-            results_should_be[self.editors[0].user_id]
+    def test_other_namespace(self):
+        metric = RevertRate(
+            namespaces=[1],
+            start_date='2012-12-31 00:00:00',
+            end_date='2014-01-02 00:00:00',
         )
+        results = metric(list(self.cohort), self.mwSession)
+
+        assert_equal(results[self.editors[0].user_id]['edits'], 0)
+        assert_equal(results[self.editors[0].user_id]['revert_rate'], r(0))
@@ -80,6 +80,18 @@ class SurvivalTest(DatabaseTest):
         assert_equal(results[self.e2][Survival.id], False)
         assert_equal(results[self.e3][Survival.id] , True)
     
+    def test_window_bounds_are_inclusive(self):
+        m = Survival(
+            namespaces=[0],
+            survival_hours=25,
+            sunset_in_hours=15,
+        )
+        results = m(list(self.cohort), self.mwSession)
+        
+        assert_equal(results[self.e1][Survival.id], True)
+        assert_equal(results[self.e2][Survival.id], True)
+        assert_equal(results[self.e3][Survival.id], True)
+    
     def test_default(self):
         m = Survival(
             namespaces=[0],
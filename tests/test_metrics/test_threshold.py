@@ -98,3 +98,59 @@ class ThresholdTest(DatabaseTest):
         
         assert_equal(results[self.e1][Threshold.time_to_threshold_id], 25, tz_note)
         assert_equal(results[self.e2][Threshold.time_to_threshold_id], None, tz_note)
+    
+    def test_engines_agree(self):
+        for number_of_edits in [1, 2, 3]:
+            for threshold_hours in [1, 24, 72]:
+                m = Threshold(
+                    namespaces=[0],
+                    threshold_hours=threshold_hours,
+                    number_of_edits=number_of_edits,
+                )
+                assert_equal(
+                    m.stream(list(self.cohort), self.mwSession),
+                    m.self_join(list(self.cohort), self.mwSession),
+                )
+
+
+class ThresholdEnginesTest(DatabaseTest):
+    
+    def setUp(self):
+        one_hour = timedelta(hours=1)
+        reg = datetime.now() - one_hour * 48
+        recent = datetime.now() - one_hour
+        
+        DatabaseTest.setUp(self)
+        self.create_test_cohort(
+            editor_count=3,
+            revisions_per_editor=3,
+            user_registrations=[i(reg), i(reg), i(recent)],
+            revision_timestamps=[
+                # two revisions at the same time are counted like the self join does
+                [i(reg + one_hour), i(reg + one_hour), i(reg + one_hour * 2)],
+                [i(reg + one_hour), i(reg + one_hour * 3), i(reg + one_hour * 50)],
+                [i(recent), i(recent), i(recent)],
+            ],
+            revision_lengths=10
+        )
+    
+    def test_engines_agree(self):
+        for number_of_edits in [1, 2, 3, 4, 6, 9]:
+            for threshold_hours in [1, 2, 24, 72]:
+                m = Threshold(
+                    namespaces=[0],
+                    threshold_hours=threshold_hours,
+                    number_of_edits=number_of_edits,
+                )
+                assert_equal(
+                    m.stream(list(self.cohort), self.mwSession),
+                    m.self_join(list(self.cohort), self.mwSession),
+                    tz_note
+                )
+    
+    def test_other_namespace(self):
+        m = Threshold(namespaces=[1], threshold_hours=72)
+        stream = m.stream(list(self.cohort), self.mwSession)
+        
+        assert_equal(stream, m.self_join(list(self.cohort), self.mwSession))
+        assert_equal(set(r[Threshold.id] for r in stream.values()), set([0]))
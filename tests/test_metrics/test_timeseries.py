@@ -1,10 +1,14 @@
+import json
+import pickle
 from collections import OrderedDict
 from datetime import datetime
-from nose.tools import assert_equals
+from nose.tools import assert_equals, assert_true
 from wikimetrics.metrics.timeseries_metric import (
     TimeseriesMetric,
     TimeseriesChoices,
 )
+from wikimetrics.metrics.timeseries_results import TimeseriesView
+from wikimetrics.utils import BetterEncoder, format_pretty_date
 from tests.fixtures import DatabaseTest
 
 
@@ -215,3 +219,104 @@ class TimeseriesTest(DatabaseTest):
         expected['2013-03-01 00:00:00'] = 1
         
         assert_equals(r, {1: {'test': expected}})
+    
+    def test_normalized_results_share_one_column(self):
+        m = TimeseriesMetric(
+            start_date='2013-01-01 00:00:00',
+            end_date='2013-01-03 00:00:00',
+            timeseries=TimeseriesChoices.DAY,
+        )
+        
+        results = {
+            1: {'test': {'2013-01-02 00:00:00': 3}},
+            2: {'test': {'2013-01-03 00:00:00': 4}},
+        }
+        r = m.normalize_datetime_slices(results, [('test', 1, 0)])
+        
+        assert_true(isinstance(r[1]['test'], TimeseriesView))
+        assert_true(r[1]['test'].column is r[2]['test'].column)
+        # a slice at end_date is kept after the others, like before
+        assert_equals(r[2]['test'].items(), [
+            ('2013-01-01 00:00:00', 0),
+            ('2013-01-02 00:00:00', 0),
+            ('2013-01-03 00:00:00', 4),
+        ])
+        
+        # views leave the worker as plain dictionaries
+        unpickled = pickle.loads(pickle.dumps(r))
+        assert_equals(type(unpickled[1]['test']), OrderedDict)
+        assert_equals(unpickled[1]['test'], r[1]['test'])
+        assert_equals(
+            json.loads(json.dumps(r[1], cls=BetterEncoder)),
+            {'test': {'2013-01-01 00:00:00': 0, '2013-01-02 00:00:00': 3}},
+        )
+    
+    def test_buckets_map_back_to_their_slices(self):
+        for timeseries in [
+            TimeseriesChoices.HOUR,
+            TimeseriesChoices.DAY,
+            TimeseriesChoices.WEEK,
+            TimeseriesChoices.MONTH,
+            TimeseriesChoices.QUARTER,
+            TimeseriesChoices.YEAR,
+        ]:
+            m = TimeseriesMetric(
+                start_date='2013-02-20 05:30:00',
+                end_date='2013-09-01 00:00:00',
+                timeseries=timeseries,
+            )
+            d = datetime(2013, 8, 15, 17, 45)
+            slice_start = m.truncate_to_slice(d)
+            assert_equals(m.bucket_start(m.bucket_of(d)), slice_start)
+            assert_equals(
+                m.slice_lookup()[m.bucket_of(d)],
+                format_pretty_date(slice_start),
+            )
+    
+    def test_week_and_quarter_slices(self):
+        m = TimeseriesMetric(
+            start_date='2013-01-01 00:00:00',
+            end_date='2013-01-15 00:00:00',
+            timeseries=TimeseriesChoices.WEEK,
+        )
+        # weeks start on monday, the first one is cut at start_date
+        assert_equals(m.slice_index().keys, [
+            '2013-01-01 00:00:00',
+            '2013-01-07 00:00:00',
+            '2013-01-14 00:00:00',
+        ])
+        
+        m = TimeseriesMetric(
+            start_date='2013-02-01 00:00:00',
+            end_date='2013-12-31 00:00:00',
+            timeseries=TimeseriesChoices.QUARTER,
+        )
+        assert_equals(m.slice_index().keys, [
+            '2013-02-01 00:00:00',
+            '2013-04-01 00:00:00',
+            '2013-07-01 00:00:00',
+            '2013-10-01 00:00:00',
+        ])
+    
+    def test_raw_date_slice(self):
+        d = datetime(2013, 8, 15, 17, 45, 12)
+        for timeseries in [
+            TimeseriesChoices.NONE,
+            TimeseriesChoices.HOUR,
+            TimeseriesChoices.DAY,
+            TimeseriesChoices.WEEK,
+            TimeseriesChoices.MONTH,
+            TimeseriesChoices.QUARTER,
+            TimeseriesChoices.YEAR,
+        ]:
+            m = TimeseriesMetric(
+                start_date='2013-02-20 05:30:00',
+                end_date='2013-09-01 00:00:00',
+                timeseries=timeseries,
+            )
+            assert_equals(m.raw_date_slice(20130815174512), m.date_slice(d))
+            # outside the window, the slice is still found
+            assert_equals(
+                m.raw_date_slice(20150101000000),
+                m.date_slice(datetime(2015, 1, 1)),
+            )
@@ -1,12 +1,17 @@
 from nose.tools import assert_equals, assert_true
+from nose.plugins.skip import SkipTest
 
-from wikimetrics.utils import r
+from wikimetrics.utils import r, CENSORED
 from wikimetrics.metrics import (
     metric_classes, NamespaceEdits, TimeseriesChoices,
 )
 from wikimetrics.models import (
     Aggregation, AggregateReport, PersistentReport, Cohort,
 )
+from wikimetrics.models.report_nodes.quantile_sketch import ResultSketches
+from wikimetrics.models.report_nodes.vector_aggregation import (
+    vector_aggregation_available, aggregate_vectors,
+)
 from ..fixtures import QueueDatabaseTest, DatabaseTest
 
 
@@ -156,6 +161,110 @@ class AggregateReportWithoutQueueTest(DatabaseTest):
             2
         )
     
+    def test_finish_quantiles(self):
+        metric = metric_classes['NamespaceEdits'](
+            name='NamespaceEdits',
+        )
+        options = {
+            'aggregateResults': True,
+            'aggregateSum': False,
+            'aggregateMedian': True,
+            'aggregatePercentiles': '90, 25, bogus, 100',
+        }
+        ar = AggregateReport(
+            metric,
+            self.cohort,
+            options,
+            user_id=self.owner_user_id,
+        )
+        
+        finished = ar.finish([
+            {
+                1: {'edits': 2, 'series': {'a': 1, 'b': None}},
+                2: {'edits': 30, 'series': {'a': 3, 'b': None}},
+                3: {'edits': 0, 'series': {'a': 2, 'b': None}},
+                4: {'edits': 7, 'series': {'a': 5, 'b': None}},
+                5: {'edits': 1000, 'series': {'a': 4, 'b': None}, CENSORED: 1},
+            },
+        ])
+        
+        assert_equals(ar.percentiles, [25.0, 90.0])
+        assert_equals(
+            sorted(finished.keys()),
+            [Aggregation.MED, 'Percentile 25', 'Percentile 90'],
+        )
+        assert_equals(finished[Aggregation.MED]['edits'], r('4.5'))
+        assert_equals(finished['Percentile 25']['edits'], r('1.5'))
+        assert_equals(finished['Percentile 90']['edits'], r('23.1'))
+        assert_equals(finished[Aggregation.MED]['series']['a'], r('2.5'))
+        assert_equals(finished[Aggregation.MED]['series']['b'], None)
+    
+    def test_finish_quantiles_from_child_sketches(self):
+        metric = metric_classes['NamespaceEdits'](
+            name='NamespaceEdits',
+        )
+        options = {
+            'aggregateResults': True,
+            'aggregateSum': True,
+            'aggregateMedian': True,
+        }
+        ar = AggregateReport(
+            metric,
+            self.cohort,
+            options,
+            user_id=self.owner_user_id,
+        )
+        assert_true(all(report.sketch_quantiles for report in ar.children[0].tree()))
+        mr = ar.children[0]
+        for child in mr.children:
+            child.sketches = ResultSketches()
+            child.sketches.add_results({1: {'edits': 10}, 2: {'edits': 20}})
+        
+        results_by_user = mr.finish([{1: {'edits': 2}}])
+        finished = ar.finish([results_by_user])
+        
+        # the median comes from the merged sketches of the MetricReports
+        assert_equals(finished[Aggregation.MED]['edits'], r(15))
+        assert_equals(finished[Aggregation.SUM]['edits'], r(2))
+    
+    def test_vector_aggregation_matches_calculate(self):
+        if not vector_aggregation_available():
+            raise SkipTest('numpy is not installed')
+        
+        metric = metric_classes['Threshold'](
+            name='Threshold',
+        )
+        options = {
+            'aggregateResults': True,
+            'aggregateSum': True,
+            'aggregateAverage': True,
+            'aggregateStandardDeviation': True,
+        }
+        ar = AggregateReport(
+            metric,
+            self.cohort,
+            options,
+            user_id=self.owner_user_id,
+        )
+        results_by_user = {
+            1: {'edits': 2, 'time': r(1.2345), CENSORED: 0},
+            2: {'edits': 3, 'time': r(29.8028), CENSORED: 0},
+            3: {'edits': 0, 'time': None, CENSORED: 0},
+            4: {'edits': 7, 'time': r(5), CENSORED: 1},
+        }
+        
+        sums, averages, std_deviations = aggregate_vectors(results_by_user)
+        
+        average = ar.calculate(results_by_user, Aggregation.AVG)
+        assert_equals(sums, ar.calculate(results_by_user, Aggregation.SUM))
+        assert_equals(averages, average)
+        assert_equals(
+            std_deviations,
+            ar.calculate(results_by_user, Aggregation.STD, average=average)
+        )
+        # exactly halfway between two rounded values, rounds like Decimal does
+        assert_equals(averages['time'], r('15.5187'))
+    
     def test_repr(self):
         metric = metric_classes['NamespaceEdits'](
             name='NamespaceEdits',
@@ -310,6 +419,109 @@ class AggregateReportTimeseriesTest(QueueDatabaseTest):
             finished[Aggregation.STD]['other_sub_metric'],
             {'date3': r(1.15), 'date4': r(1.7)}
         )
+    
+    def test_finish_incremental(self):
+        metric = NamespaceEdits(
+            namespaces=[0],
+            start_date='2012-12-31 00:00:00',
+            end_date='2013-01-01 00:00:00',
+            timeseries=TimeseriesChoices.DAY,
+        )
+        options = {
+            'individualResults': True,
+            'aggregateResults': True,
+            'aggregateSum': True,
+            'aggregateAverage': True,
+            'aggregateStandardDeviation': True,
+        }
+        ar = AggregateReport(
+            metric,
+            self.cohort,
+            options,
+            user_id=self.owner_user_id,
+        )
+        assert_true(AggregateReport.can_be_incremental(metric))
+        ar.series_id = ar.persistent_id
+        
+        ar.finish([
+            {
+                1: {'edits': {'2012-12-31 00:00:00': 1}},
+                2: {'edits': {'2012-12-31 00:00:00': 0}},
+                3: {'edits': {'2012-12-31 00:00:00': 0}},
+                None: {'edits': {'2012-12-31 00:00:00': None}}
+            },
+        ])
+        finished = ar.finish([
+            {
+                1: {'edits': {'2013-01-01 00:00:00': 2}},
+                2: {'edits': {'2013-01-01 00:00:00': 1}},
+                3: {'edits': {'2013-01-01 00:00:00': 0}},
+                None: {'edits': {'2013-01-01 00:00:00': None}}
+            },
+        ])
+        
+        assert_equals(
+            finished[Aggregation.SUM]['edits'],
+            {'2012-12-31 00:00:00': 1, '2013-01-01 00:00:00': 3}
+        )
+        assert_equals(
+            finished[Aggregation.AVG]['edits'],
+            {'2012-12-31 00:00:00': r(0.3333), '2013-01-01 00:00:00': r(1.0)}
+        )
+        assert_equals(
+            finished[Aggregation.STD]['edits'],
+            {'2012-12-31 00:00:00': r(0.4714), '2013-01-01 00:00:00': r(0.8165)}
+        )
+        assert_equals(
+            finished[Aggregation.IND][1]['edits'],
+            {'2013-01-01 00:00:00': 2}
+        )
+    
+    def test_finish_incremental_large_close_values(self):
+        metric = NamespaceEdits(
+            namespaces=[0],
+            start_date='2012-12-31 00:00:00',
+            end_date='2013-01-01 00:00:00',
+            timeseries=TimeseriesChoices.DAY,
+        )
+        options = {
+            'aggregateResults': True,
+            'aggregateAverage': True,
+            'aggregateStandardDeviation': True,
+        }
+        ar = AggregateReport(
+            metric,
+            self.cohort,
+            options,
+            user_id=self.owner_user_id,
+        )
+        ar.series_id = ar.persistent_id
+        
+        finished = ar.finish([
+            {
+                1: {'edits': {'2012-12-31 00:00:00': 10000,
+                              '2013-01-01 00:00:00': 1000000}},
+                2: {'edits': {'2012-12-31 00:00:00': 10000,
+                              '2013-01-01 00:00:00': 1000000}},
+                3: {'edits': {'2012-12-31 00:00:00': 10001,
+                              '2013-01-01 00:00:00': 1000001}},
+            },
+        ])
+        
+        assert_equals(
+            finished[Aggregation.AVG]['edits'],
+            {'2012-12-31 00:00:00': r('10000.3333'),
+             '2013-01-01 00:00:00': r('1000000.3333')}
+        )
+        assert_equals(
+            finished[Aggregation.STD]['edits'],
+            {'2012-12-31 00:00:00': r(0.4714), '2013-01-01 00:00:00': r(0.4714)}
+        )
+    
+    def test_cannot_be_incremental(self):
+        metric = NamespaceEdits(timeseries=TimeseriesChoices.MONTH)
+        assert_true(not AggregateReport.can_be_incremental(metric))
+        assert_true(not AggregateReport.can_be_incremental(metric_classes['Threshold']()))
 
 """
 NOTE: a sample output of AggregateReport:
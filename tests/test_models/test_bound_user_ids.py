@@ -0,0 +1,88 @@
+from mock import patch
+from MySQLdb.cursors import SSCursor
+from nose.tools import assert_equals, assert_true
+from wikimetrics.configurables import db
+from wikimetrics.profiling import Profile
+from wikimetrics.models import MediawikiUser, BoundUserIds, in_user_ids, stream
+from ..fixtures import DatabaseTest
+
+
+class BoundUserIdsTest(DatabaseTest):
+    def setUp(self):
+        DatabaseTest.setUp(self)
+        self.common_cohort_1()
+    
+    def test_filter(self):
+        user_ids = [e.user_id for e in self.editors[0:2]]
+        with BoundUserIds(user_ids, self.mwSession) as bound:
+            assert_equals(bound, user_ids)
+            found = self.mwSession.query(MediawikiUser.user_id)\
+                .filter(in_user_ids(MediawikiUser.user_id, bound))\
+                .all()
+        
+        assert_equals(sorted(u[0] for u in found), sorted(user_ids))
+    
+    def test_filter_twice_in_one_statement(self):
+        user_ids = [e.user_id for e in self.editors]
+        with BoundUserIds(user_ids + [None, user_ids[0]], self.mwSession) as bound:
+            inner = self.mwSession.query(MediawikiUser.user_id)\
+                .filter(in_user_ids(MediawikiUser.user_id, bound))\
+                .subquery()
+            found = self.mwSession.query(MediawikiUser.user_id)\
+                .filter(in_user_ids(MediawikiUser.user_id, bound, reference=1))\
+                .filter(MediawikiUser.user_id.in_(inner))\
+                .all()
+            assert_equals(len(bound.tables), 2)
+        
+        assert_equals(sorted(u[0] for u in found), sorted(user_ids))
+        assert_equals(bound.tables, [])
+    
+    def test_in_user_ids_plain_list(self):
+        clause = in_user_ids(MediawikiUser.user_id, [1, 2])
+        assert_true('IN' in str(clause))
+    
+    def test_stream_reads_every_row(self):
+        user_ids = [e.user_id for e in self.editors]
+        query = self.mwSession.query(MediawikiUser.user_id)\
+            .filter(in_user_ids(MediawikiUser.user_id, user_ids))
+        dbapi_connection = self.mwSession.connection().connection.connection
+        cursorclass = dbapi_connection.cursorclass
+        
+        with patch.dict(db.config, {'QUERY_YIELD_PER': 1}), \
+                patch('wikimetrics.models.mediawiki.stream.SSCursor', FetchCounter):
+            FetchCounter.fetches = []
+            streamed = stream(query)
+            assert_equals(dbapi_connection.cursorclass, cursorclass)
+            assert_equals(sorted(u[0] for u in streamed), sorted(user_ids))
+        
+        # the rows came from the unbuffered cursor, one at a time
+        assert_equals(max(FetchCounter.fetches), 1)
+        assert_equals(sum(FetchCounter.fetches), len(user_ids))
+    
+    def test_stream_is_profiled_once_read(self):
+        user_ids = [e.user_id for e in self.editors]
+        query = self.mwSession.query(MediawikiUser.user_id)\
+            .filter(in_user_ids(MediawikiUser.user_id, user_ids))
+        profile = Profile()
+        
+        with profile.active(), patch.dict(db.config, {'QUERY_EXPLAIN_SECONDS': 1e-6}):
+            streamed = stream(query)
+            streamed.next()
+            assert_equals(profile.query_count, 0)
+            list(streamed)
+        
+        assert_equals(profile.query_count, 1)
+        assert_equals(profile.query_rows, len(user_ids))
+        assert_true(len(profile.queries[0]['explain']) >= 1)
+
+
+class FetchCounter(SSCursor):
+    """
+    An unbuffered cursor that records the size of each batch of rows fetched
+    """
+    fetches = []
+    
+    def fetchmany(self, size=None):
+        rows = SSCursor.fetchmany(self, size)
+        FetchCounter.fetches.append(len(rows))
+        return rows
@@ -1,7 +1,11 @@
+import unittest
+from array import array
+from mock import patch
 from nose.tools import assert_equal, raises
 from sqlalchemy.orm.exc import NoResultFound
 
-from wikimetrics.models import Cohort, WikiUser
+from wikimetrics.configurables import db
+from wikimetrics.models import Cohort, CohortSnapshot, WikiUser
 from ..fixtures import DatabaseTest
 
 
@@ -51,6 +55,36 @@ class CohortTest(DatabaseTest):
         assert_equal(wikiusers[3].mediawiki_userid in user_ids, True)
         assert_equal(len(user_ids), 2)
     
+    def test_snapshot(self):
+        snapshot = self.cohort.snapshot()
+        
+        assert_equal(len(snapshot), len(self.editors))
+        assert_equal(sorted(snapshot), sorted(e.user_id for e in self.editors))
+        assert_equal(
+            [(project, list(uids)) for project, uids in snapshot.group_by_project()],
+            [(project, list(uids)) for project, uids in self.cohort.group_by_project()],
+        )
+    
+    def test_snapshot_truncated_user_ids(self):
+        # the smallest length MySQL allows, which cuts the list of user ids short
+        with patch('wikimetrics.models.cohort.GROUP_CONCAT_MAX_LEN', 4):
+            snapshot = self.cohort.snapshot()
+        
+        assert_equal(sorted(snapshot), sorted(e.user_id for e in self.editors))
+    
+    def test_snapshot_cache(self):
+        cache_size = db.config.get('COHORT_SNAPSHOT_CACHE_SIZE')
+        db.config['COHORT_SNAPSHOT_CACHE_SIZE'] = 10
+        try:
+            snapshot = self.cohort.snapshot()
+            assert_equal(self.cohort.snapshot() is snapshot, True)
+            
+            self.cohort.validated = False
+            self.session.commit()
+            assert_equal(list(self.cohort.snapshot()), [])
+        finally:
+            db.config['COHORT_SNAPSHOT_CACHE_SIZE'] = cache_size
+    
     def test_get_safely(self):
         c = Cohort.get_safely(self.session, self.owner_user_id, by_id=self.cohort.id)
         assert_equal(c.name, self.cohort.name)
@@ -66,3 +100,27 @@ class CohortTest(DatabaseTest):
     def test_get_safely_raises_exception_for_not_found_by_name(self):
         c = Cohort.get_safely(self.session, self.owner_user_id, by_name='')
         assert_equal(c, None)
+
+
+class CohortSnapshotTest(unittest.TestCase):
+    
+    def test_group_by_project(self):
+        snapshot = CohortSnapshot(True, 'enwiki', [
+            (None, array('l', [1])),
+            ('dewiki', array('l', [2, 3])),
+            ('wiki', array('l', [4])),
+        ])
+        
+        assert_equal(len(snapshot), 4)
+        assert_equal(list(snapshot), [1, 2, 3, 4])
+        assert_equal(
+            [(project, list(uids)) for project, uids in snapshot.group_by_project()],
+            [('enwiki', [1]), ('dewiki', [2, 3]), ('wiki', [4])],
+        )
+    
+    def test_not_validated(self):
+        snapshot = CohortSnapshot(False, 'enwiki', [('wiki', array('l', [1, 2]))])
+        
+        assert_equal(len(snapshot), 2)
+        assert_equal(list(snapshot), [])
+        assert_equal(list(snapshot.group_by_project()), [])
@@ -1,7 +1,11 @@
+import json
+from mock import patch
 from nose.tools import assert_equals, assert_true
+from wikimetrics.configurables import db, queue
 from wikimetrics.metrics import metric_classes
+from wikimetrics.api import MetricResultCache, LocalCacheStore
 from wikimetrics.models import (
-    MetricReport
+    MetricReport, PersistentReport
 )
 from ..fixtures import DatabaseTest
 
@@ -31,6 +35,126 @@ class MetricReportTest(DatabaseTest):
         result = mr.run()
         assert_equals(result[self.editors[0].user_id]['edits'], 2)
     
+    def test_chunks(self):
+        metric = metric_classes['NamespaceEdits'](
+            name='NamespaceEdits',
+            namespaces=[0, 1, 2],
+            start_date='2013-01-01 00:00:00',
+            end_date='2013-01-02 00:00:00',
+        )
+        user_ids = [e.user_id for e in self.editors]
+        mr = MetricReport(metric, user_ids, 'wiki', chunk_size=3)
+        
+        assert_equals(mr.chunks(), [user_ids[0:3], user_ids[3:4]])
+    
+    def test_chunked_response(self):
+        metric = metric_classes['NamespaceEdits'](
+            name='NamespaceEdits',
+            namespaces=[0, 1, 2],
+            start_date='2013-01-01 00:00:00',
+            end_date='2013-01-02 00:00:00',
+        )
+        user_ids = [e.user_id for e in self.editors]
+        whole = MetricReport(metric, user_ids, 'wiki', chunk_size=0).run()
+        chunked = MetricReport(metric, user_ids, 'wiki', chunk_size=1).run()
+        
+        assert_equals(chunked, whole)
+        assert_equals(chunked[self.editors[0].user_id]['edits'], 2)
+    
+    def test_chunked_response_in_parallel(self):
+        metric = metric_classes['NamespaceEdits'](
+            name='NamespaceEdits',
+            namespaces=[0, 1, 2],
+            start_date='2013-01-01 00:00:00',
+            end_date='2013-01-02 00:00:00',
+        )
+        user_ids = [e.user_id for e in self.editors]
+        mr = MetricReport(metric, user_ids, 'wiki', chunk_size=1)
+        
+        queue.conf['METRIC_REPORT_CHUNK_THREADS'] = 2
+        try:
+            result = mr.run()
+        finally:
+            queue.conf['METRIC_REPORT_CHUNK_THREADS'] = 1
+        
+        assert_equals(len(result), len(user_ids))
+        assert_equals(result[self.editors[0].user_id]['edits'], 2)
+    
+    def test_bound_user_ids_response(self):
+        metric = metric_classes['NamespaceEdits'](
+            name='NamespaceEdits',
+            namespaces=[0, 1, 2],
+            start_date='2013-01-01 00:00:00',
+            end_date='2013-01-02 00:00:00',
+        )
+        user_ids = [e.user_id for e in self.editors]
+        unbound = MetricReport(metric, user_ids, 'wiki').run()
+        
+        min_size = db.config.get('COHORT_TABLE_MIN_SIZE')
+        db.config['COHORT_TABLE_MIN_SIZE'] = 1
+        try:
+            bound = MetricReport(metric, user_ids, 'wiki').run()
+        finally:
+            db.config['COHORT_TABLE_MIN_SIZE'] = min_size
+        
+        assert_equals(bound, unbound)
+        assert_equals(bound[self.editors[0].user_id]['edits'], 2)
+    
+    def test_cached_response(self):
+        metric = metric_classes['NamespaceEdits'](
+            name='NamespaceEdits',
+            namespaces=[0, 1, 2],
+            start_date='2013-01-01 00:00:00',
+            end_date='2013-01-02 00:00:00',
+        )
+        user_ids = [e.user_id for e in self.editors]
+        cache = MetricResultCache(LocalCacheStore(100, 60))
+        
+        with patch(
+            'wikimetrics.models.report_nodes.metric_report.get_metric_cache',
+            return_value=cache,
+        ):
+            first = MetricReport(metric, user_ids[0:2], 'wiki').run()
+            mr = MetricReport(metric, user_ids, 'wiki')
+            result = mr.run()
+        
+        assert_equals(result, MetricReport(metric, user_ids, 'wiki').run())
+        assert_equals(result[self.editors[0].user_id], first[self.editors[0].user_id])
+        pj = self.session.query(PersistentReport).get(mr.persistent_id)
+        assert_equals(pj.cache_hits, 2)
+        assert_equals(pj.cache_misses, len(user_ids) - 2)
+    
+    def test_profiled_response(self):
+        metric = metric_classes['NamespaceEdits'](
+            name='NamespaceEdits',
+            namespaces=[0, 1, 2],
+            start_date='2013-01-01 00:00:00',
+            end_date='2013-01-02 00:00:00',
+            timeseries='day',
+        )
+        user_ids = [e.user_id for e in self.editors]
+        mr = MetricReport(metric, user_ids, 'wiki')
+        
+        explain_seconds = db.config.get('QUERY_EXPLAIN_SECONDS')
+        db.config['QUERY_EXPLAIN_SECONDS'] = 0.000001
+        try:
+            mr.run()
+        finally:
+            db.config['QUERY_EXPLAIN_SECONDS'] = explain_seconds
+        
+        profile = mr.profile.as_dict()
+        assert_true(profile['query_count'] >= 1)
+        assert_true(profile['query_rows'] >= 1)
+        # streamed queries count the rows read, not an unknown rowcount
+        assert_true(profile['query_rows'] < 1000)
+        assert_true('metric' in profile['phases'])
+        assert_true('normalize' in profile['phases'])
+        assert_true('revision' in profile['queries'][0]['sql'])
+        assert_true(len(profile['queries'][0]['explain']) >= 1)
+        
+        pj = self.session.query(PersistentReport).get(mr.persistent_id)
+        assert_equals(json.loads(pj.profile)['query_count'], profile['query_count'])
+    
     def test_repr(self):
         metric = metric_classes['NamespaceEdits'](
             name='NamespaceEdits',
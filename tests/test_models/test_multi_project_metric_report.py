@@ -1,4 +1,5 @@
 from nose.tools import assert_equals, assert_true
+from wikimetrics.configurables import queue
 from wikimetrics.metrics import metric_classes
 from wikimetrics.models import (
     MultiProjectMetricReport, PersistentReport, Cohort,
@@ -51,6 +52,25 @@ class MultiProjectMetricReportWithoutQueueTest(DatabaseTest):
         assert_equals(finished[1]['edits'], 2)
         assert_equals(finished[2]['edits'], 3)
     
+    def test_run_children_concurrently(self):
+        metric = metric_classes['NamespaceEdits'](
+            name='NamespaceEdits',
+            namespaces=[0, 1, 2],
+            start_date='2013-01-01 00:00:00',
+            end_date='2013-01-02 00:00:00',
+        )
+        mr = MultiProjectMetricReport(self.cohort, metric)
+        
+        queue.conf['REPORT_CHILDREN_PER_HOST'] = 2
+        try:
+            child_results = mr.run_children()
+        finally:
+            queue.conf['REPORT_CHILDREN_PER_HOST'] = 0
+        
+        assert_equals(len(child_results), len(mr.children))
+        finished = mr.finish(child_results)
+        assert_equals(finished[self.editors[0].user_id]['edits'], 2)
+    
     def test_repr(self):
         metric = metric_classes['NamespaceEdits'](
             name='NamespaceEdits',
@@ -0,0 +1,93 @@
+from random import Random
+from decimal import Decimal
+from unittest import TestCase
+from nose.tools import assert_equals, assert_true
+from wikimetrics.utils import CENSORED
+from wikimetrics.models.report_nodes.quantile_sketch import (
+    QuantileSketch, ResultSketches,
+)
+
+
+class QuantileSketchTest(TestCase):
+    
+    def rank_error(self, values, estimate, fraction):
+        below = len([v for v in values if v <= estimate])
+        return abs(float(below) / len(values) - fraction)
+    
+    def test_exact_for_small_streams(self):
+        sketch = QuantileSketch()
+        for value in [5, 1, 4, 2, 3, None]:
+            sketch.add(value)
+        
+        assert_equals(len(sketch), 5)
+        assert_equals(sketch.quantile(0.5), 3)
+        assert_equals(
+            sketch.quantiles([0, 0.2, 0.9, 1]),
+            [1, Decimal('1.8'), Decimal('4.6'), 5]
+        )
+    
+    def test_even_count_median_is_interpolated(self):
+        sketch = QuantileSketch()
+        for value in [4, 1, 3, 2]:
+            sketch.add(value)
+        
+        assert_equals(sketch.quantile(0.5), Decimal('2.5'))
+    
+    def test_empty(self):
+        assert_equals(QuantileSketch().quantiles([0.5, 0.9]), [None, None])
+    
+    def test_bounded_and_accurate(self):
+        values = range(100000)
+        Random(7).shuffle(values)
+        sketch = QuantileSketch(k=200)
+        for value in values:
+            sketch.add(value)
+        
+        assert_true(sketch.size() < 1000)
+        for fraction in [0.1, 0.5, 0.9, 0.99]:
+            estimate = sketch.quantile(fraction)
+            assert_true(self.rank_error(values, estimate, fraction) < 0.01)
+    
+    def test_deterministic(self):
+        values = range(10000)
+        Random(3).shuffle(values)
+        first, second = QuantileSketch(k=50), QuantileSketch(k=50)
+        for value in values:
+            first.add(value)
+            second.add(value)
+        
+        assert_equals(first.quantiles([0.5, 0.9]), second.quantiles([0.5, 0.9]))
+    
+    def test_merge(self):
+        values = range(50000)
+        Random(5).shuffle(values)
+        left, right = QuantileSketch(), QuantileSketch()
+        for value in values[:20000]:
+            left.add(value)
+        for value in values[20000:]:
+            right.add(value)
+        left.merge(right)
+        
+        assert_equals(len(left), 50000)
+        assert_true(left.size() < left.max_size())
+        for fraction in [0.5, 0.9]:
+            estimate = left.quantile(fraction)
+            assert_true(self.rank_error(values, estimate, fraction) < 0.01)
+    
+    def test_merge_result_sketches(self):
+        left, right = ResultSketches(), ResultSketches()
+        left.add_results({
+            1: {'edits': 2, 'series': {'a': 1}},
+            2: {'edits': 30, 'series': {'a': 3}},
+        })
+        right.add_results({
+            3: {'edits': 0, 'series': {'a': 2, 'b': 2}},
+            4: {'edits': 1000, 'series': {'a': 4, 'b': 4}, CENSORED: 1},
+        })
+        left.merge(right)
+        
+        assert_equals(len(left.sketches['edits']), 3)
+        assert_equals(left.sketches['edits'].quantile(0.5), 2)
+        assert_equals(left.sketches['series']['a'].quantile(0.5), 2)
+        assert_equals(left.sketches['series']['b'].quantile(0.5), 2)
+        assert_equals(left.sketches['series'].keys(), ['a', 'b'])
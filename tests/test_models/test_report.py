@@ -50,6 +50,23 @@ class ReportWithoutQueueTest(DatabaseTest):
     def test_repr(self):
         r = Report()
         assert_true(str(r).find('Report') >= 0)
+    
+    def test_store_tree(self):
+        children = [Report(store=False), Report(name='child', store=False)]
+        r = ReportNode(name='parent', children=children, store=False)
+        assert_equals([report.persistent_id for report in r.tree()], [None] * 3)
+        
+        r.store()
+        ids = [report.persistent_id for report in r.tree()]
+        stored = self.session.query(PersistentReport)\
+            .filter(PersistentReport.id.in_(ids))\
+            .all()
+        names = dict((pj.id, pj.name) for pj in stored)
+        
+        assert_equals(len(stored), 3)
+        assert_equals(names[r.persistent_id], 'parent')
+        assert_equals(names[children[0].persistent_id], str(children[0]))
+        assert_equals(names[children[1].persistent_id], 'child')
 
 
 class QueueTaskTest(QueueDatabaseTest):
@@ -1,4 +1,6 @@
 import time
+import celery
+from mock import patch
 from datetime import timedelta, datetime
 from sqlalchemy import func
 from nose.tools import assert_equals, assert_true, raises
@@ -6,7 +8,7 @@ from celery.exceptions import SoftTimeLimitExceeded
 
 from tests.fixtures import QueueDatabaseTest, DatabaseTest
 from wikimetrics.models import (
-    RunReport, Aggregation, PersistentReport
+    RunReport, Aggregation, PersistentReport, queue_run_reports
 )
 from wikimetrics.metrics import TimeseriesChoices, metric_classes
 from wikimetrics.utils import diff_datewise, stringify, strip_time
@@ -188,6 +190,33 @@ class RunReportTest(QueueDatabaseTest):
             2,
         )
     
+    def test_stores_whole_tree(self):
+        parameters = {
+            'name': 'Edits - test',
+            'cohort': {
+                'id': self.cohort.id,
+                'name': self.cohort.name,
+            },
+            'metric': {
+                'name': 'NamespaceEdits',
+                'namespaces': [0, 1, 2],
+                'start_date': '2013-01-01 00:00:00',
+                'end_date': '2013-01-02 00:00:00',
+            },
+        }
+        jr = RunReport(parameters, user_id=self.owner_user_id)
+        reports = jr.tree()
+        ids = [r.persistent_id for r in reports]
+        
+        assert_true(None not in ids)
+        # the ValidateReport is not stored when the report is valid
+        assert_equals(self.session.query(PersistentReport).count(), len(reports))
+        assert_equals(
+            self.session.query(PersistentReport.name).filter_by(id=jr.persistent_id)
+            .one()[0],
+            'Edits - test',
+        )
+    
     def test_does_not_run_invalid_cohort_for_any_metric(self):
         self.cohort.validated = False
         self.session.commit()
@@ -329,6 +358,71 @@ class RunReportTest(QueueDatabaseTest):
         assert_true(
             results[result_key]['FAILURE'].find('Edits was incorrectly configured') >= 0,
         )
+    
+    def test_fused_reports_run_in_one_task(self):
+        reports = []
+        for name in ['NamespaceEdits', 'PagesCreated', 'BytesAdded', 'Threshold']:
+            parameters = {
+                'name': '{0} - test'.format(name),
+                'cohort': {
+                    'id': self.cohort.id,
+                    'name': self.cohort.name,
+                },
+                'metric': {
+                    'name': name,
+                    'namespaces': [0, 1, 2],
+                    'start_date': '2013-01-01 00:00:00',
+                    'end_date': '2013-01-02 00:00:00',
+                    'individualResults': True,
+                    'aggregateResults': False,
+                    'aggregateSum': False,
+                    'aggregateAverage': False,
+                    'aggregateStandardDeviation': False,
+                },
+            }
+            reports.append(RunReport(parameters, user_id=self.owner_user_id))
+        
+        groups = RunReport.fuse(reports)
+        assert_equals([len(group) for group in groups], [3, 1])
+        
+        results = queue_run_reports.delay(groups[0]).get()
+        self.session.commit()
+        edits, pages_created, bytes_added = [
+            results[self.session.query(PersistentReport)
+                    .get(jr.persistent_id).result_key][Aggregation.IND]
+            for jr in groups[0]
+        ]
+        assert_equals(edits[self.editors[0].user_id]['edits'], 2)
+        assert_true('pages_created' in pages_created[self.editors[0].user_id])
+        assert_true('net_sum' in bytes_added[self.editors[0].user_id])
+    
+    def test_timed_out_reports_are_marked_failed(self):
+        reports = []
+        for name in ['NamespaceEdits', 'PagesCreated']:
+            parameters = {
+                'name': '{0} - test'.format(name),
+                'cohort': {
+                    'id': self.cohort.id,
+                    'name': self.cohort.name,
+                },
+                'metric': {
+                    'name': name,
+                    'namespaces': [0, 1, 2],
+                    'start_date': '2013-01-01 00:00:00',
+                    'end_date': '2013-01-02 00:00:00',
+                },
+            }
+            reports.append(RunReport(parameters, user_id=self.owner_user_id))
+        
+        with patch.object(RunReport, 'run', side_effect=SoftTimeLimitExceeded()):
+            result = queue_run_reports.apply(args=[reports])
+        
+        assert_true(result.failed())
+        self.session.commit()
+        for report in reports:
+            persistent = self.session.query(PersistentReport).get(report.persistent_id)
+            assert_equals(persistent.status, celery.states.FAILURE)
+            assert_equals(persistent.queue_result_key, result.id)
 
 
 class RunReportBasicTest(DatabaseTest):
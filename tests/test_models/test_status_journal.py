@@ -0,0 +1,50 @@
+import celery
+from nose.tools import assert_equals
+from wikimetrics.models import Report, PersistentReport, StatusJournal
+from ..fixtures import DatabaseTest
+
+
+class StatusJournalTest(DatabaseTest):
+
+    def get_row(self, report):
+        self.session.expire_all()
+        return self.session.query(PersistentReport).get(report.persistent_id)
+    
+    def test_record_waits_for_flush(self):
+        report = Report()
+        report.journal = StatusJournal()
+        report.set_status(celery.states.STARTED, task_id='abc')
+        
+        assert_equals(self.get_row(report).status, celery.states.PENDING)
+        
+        report.journal.flush()
+        row = self.get_row(report)
+        assert_equals(row.status, celery.states.STARTED)
+        assert_equals(row.queue_result_key, 'abc')
+    
+    def test_flush_many_reports(self):
+        journal = StatusJournal()
+        reports = [Report(), Report(), Report()]
+        journal.record(reports[0].persistent_id, status=celery.states.STARTED)
+        journal.record(reports[0].persistent_id, status=celery.states.SUCCESS)
+        journal.record(reports[1].persistent_id, result_key='key')
+        journal.flush()
+        
+        assert_equals(self.get_row(reports[0]).status, celery.states.SUCCESS)
+        assert_equals(self.get_row(reports[1]).status, celery.states.PENDING)
+        assert_equals(self.get_row(reports[1]).result_key, 'key')
+        assert_equals(self.get_row(reports[2]).result_key, None)
+        assert_equals(journal.pending, {})
+    
+    def test_failure_is_written_right_away(self):
+        report = Report()
+        report.journal = StatusJournal()
+        report.set_status(celery.states.FAILURE)
+        
+        assert_equals(self.get_row(report).status, celery.states.FAILURE)
+    
+    def test_without_journal(self):
+        report = Report()
+        report.set_status(celery.states.STARTED)
+        
+        assert_equals(self.get_row(report).status, celery.states.STARTED)
@@ -1,12 +1,16 @@
 import unittest
+from datetime import datetime
+from mock import patch
 from nose.tools import assert_equal, raises, assert_true, assert_false
-from wikimetrics.configurables import app
+from wikimetrics.configurables import app, queue
+from wikimetrics.controllers.cohorts import populate_cohort_validation_status
 from tests.fixtures import WebTest, QueueDatabaseTest, mediawiki_project
 from wikimetrics.controllers.forms import CohortUpload
 from wikimetrics.models import (
     MediawikiUser, Cohort, WikiUser, ValidateCohort, User,
     normalize_project,
 )
+from wikimetrics.models.validate_cohort import validate_users
 
 
 class ValidateCohortTest(WebTest):
@@ -61,6 +65,144 @@ class ValidateCohortTest(WebTest):
                 .filter(WikiUser.valid.in_([False]))
                 .all()
         ), 2)
+    
+    def test_validate_cohorts_in_chunks_with_duplicates(self):
+        self.helper_reset_validation()
+        self.cohort.validate_as_user_ids = False
+        wikiuser = self.session.query(WikiUser).first()
+        self.session.add(WikiUser(
+            mediawiki_username=wikiuser.mediawiki_username,
+            project=wikiuser.project.upper(),
+            validating_cohort=self.cohort.id,
+        ))
+        self.session.commit()
+        v = ValidateCohort(self.cohort)
+        with patch('wikimetrics.models.validate_cohort.VALIDATE_CHUNK_SIZE', 1):
+            v.validate_records(self.session, self.cohort)
+        
+        assert_equal(self.cohort.validated, True)
+        wikiusers = self.session.query(WikiUser)\
+            .filter(WikiUser.validating_cohort == self.cohort.id)\
+            .all()
+        assert_equal(len(wikiusers), 4)
+        assert_true(all(wu.valid for wu in wikiusers))
+        assert_equal(len(self.cohort.snapshot()), 4)
+    
+    def test_validate_cohorts_concurrently(self):
+        self.helper_reset_validation()
+        self.cohort.validate_as_user_ids = False
+        wikiusers = self.session.query(WikiUser).all()
+        wikiusers[0].project = 'blah'
+        wikiusers[1].mediawiki_username = 'blah'
+        self.session.commit()
+        v = ValidateCohort(self.cohort)
+        queue.conf['VALIDATE_PROJECTS_PER_HOST'] = 2
+        try:
+            v.validate_records(self.session, self.cohort)
+        finally:
+            queue.conf['VALIDATE_PROJECTS_PER_HOST'] = 0
+        
+        self.session.refresh(self.cohort)
+        assert_equal(self.cohort.validated, True)
+        assert_equal(self.cohort.validation_total, 4)
+        assert_equal(self.cohort.validation_valid, 2)
+        assert_equal(self.cohort.validation_invalid, 2)
+        
+        status = populate_cohort_validation_status(dict(
+            self.cohort._asdict(), validation_queue_key='unknown', wikiusers=[]
+        ))
+        assert_equal(status['validated_count'], 4)
+        assert_equal(status['valid_count'], 2)
+        assert_equal(status['total_count'], 4)
+    
+    def test_validate_cohorts_incrementally(self):
+        self.helper_reset_validation()
+        self.cohort.validate_as_user_ids = False
+        self.session.commit()
+        ValidateCohort(self.cohort).validate_records(self.session, self.cohort)
+        
+        wikiusers = self.session.query(WikiUser)\
+            .filter(WikiUser.validating_cohort == self.cohort.id)\
+            .order_by(WikiUser.id)\
+            .all()
+        wikiusers[0].last_validated = datetime(2000, 1, 1)
+        wikiusers[1].valid = False
+        recent = wikiusers[2].last_validated
+        self.session.commit()
+        v = ValidateCohort(self.cohort, incremental=True)
+        v.validate_records(self.session, self.cohort)
+        
+        self.session.refresh(self.cohort)
+        assert_equal(self.cohort.validated, True)
+        # the counts are of the whole cohort, not only of the records validated
+        assert_equal(self.cohort.validation_total, 4)
+        assert_equal(self.cohort.validation_valid, 4)
+        assert_equal(self.cohort.validation_invalid, 0)
+        for wikiuser in wikiusers:
+            self.session.refresh(wikiuser)
+        assert_true(all(wu.valid for wu in wikiusers))
+        assert_true(wikiusers[0].last_validated > datetime(2000, 1, 1))
+        assert_equal(wikiusers[2].last_validated, recent)
+        assert_equal(len(self.cohort.snapshot()), 4)
+    
+    def test_validate_cohorts_incrementally_with_nothing_stale(self):
+        self.helper_reset_validation()
+        self.cohort.validate_as_user_ids = False
+        self.session.commit()
+        ValidateCohort(self.cohort).validate_records(self.session, self.cohort)
+        
+        v = ValidateCohort(self.cohort, incremental=True)
+        with patch('wikimetrics.models.validate_cohort.validate_users') as validate:
+            v.validate_records(self.session, self.cohort)
+            assert_false(validate.called)
+        
+        self.session.refresh(self.cohort)
+        assert_equal(self.cohort.validated, True)
+        status = populate_cohort_validation_status(dict(
+            self.cohort._asdict(), validation_queue_key='unknown', wikiusers=[]
+        ))
+        assert_equal(status['total_count'], 4)
+        assert_equal(status['validated_count'], 4)
+        assert_equal(status['valid_count'], 4)
+    
+    def test_validate_cohorts_incrementally_keeps_members_until_done(self):
+        self.helper_reset_validation()
+        self.cohort.validate_as_user_ids = False
+        self.session.commit()
+        ValidateCohort(self.cohort).validate_records(self.session, self.cohort)
+        
+        wikiusers = self.session.query(WikiUser)\
+            .filter(WikiUser.validating_cohort == self.cohort.id)\
+            .order_by(WikiUser.id)\
+            .all()
+        members = sorted(self.cohort.snapshot())
+        for wikiuser in wikiusers[:3]:
+            wikiuser.last_validated = datetime(2000, 1, 1)
+        wikiusers[1].mediawiki_username = 'blah'
+        self.session.commit()
+        
+        seen = []
+        
+        def snapshot_between_chunks(*args):
+            seen.append(sorted(self.cohort.snapshot()))
+            return validate_users(*args)
+        
+        v = ValidateCohort(self.cohort, incremental=True)
+        with patch('wikimetrics.models.validate_cohort.VALIDATE_CHUNK_SIZE', 1), \
+                patch('wikimetrics.models.validate_cohort.validate_users',
+                      side_effect=snapshot_between_chunks):
+            v.validate_records(self.session, self.cohort)
+        
+        # reports started while the chunks were validated saw the old members
+        assert_equal(seen, [members] * 3)
+        self.session.refresh(self.cohort)
+        assert_equal(self.cohort.validation_total, 4)
+        assert_equal(self.cohort.validation_valid, 3)
+        assert_equal(self.cohort.validation_invalid, 1)
+        assert_equal(
+            sorted(self.cohort.snapshot()),
+            sorted(wu.mediawiki_userid for wu in wikiusers if wu is not wikiusers[1]),
+        )
 
 
 class ValidateCohortQueueTest(QueueDatabaseTest):
@@ -0,0 +1,64 @@
+import pickle
+import unittest
+from nose.tools import assert_equals, assert_true
+from wikimetrics.profiling import Profile, current_profile, phase
+
+
+class ProfileTest(unittest.TestCase):
+    
+    def test_active(self):
+        outer = Profile('outer')
+        inner = Profile('inner')
+        assert_equals(current_profile(), None)
+        with outer.active():
+            with inner.active():
+                assert_true(current_profile() is inner)
+            assert_true(current_profile() is outer)
+        assert_equals(current_profile(), None)
+    
+    def test_phase(self):
+        profile = Profile()
+        with phase('normalize'):
+            pass
+        assert_equals(profile.phases, {})
+        
+        with profile.active():
+            with phase('normalize'):
+                pass
+            with phase('normalize'):
+                pass
+        assert_equals(profile.phases.keys(), ['normalize'])
+        assert_true(profile.phases['normalize'] >= 0)
+    
+    def test_keeps_slowest_queries(self):
+        profile = Profile()
+        profile.SLOWEST_QUERIES = 2
+        profile.query('wiki', 'SELECT 1', 0.1, 1)
+        profile.query('wiki', 'SELECT 2', 0.3, 2)
+        profile.query('wiki', 'SELECT 3', 0.2, -1)
+        profile.query('wiki', 'SELECT 4', 0.05, 4)
+        
+        result = profile.as_dict()
+        assert_equals(result['query_count'], 4)
+        assert_equals(result['query_seconds'], 0.65)
+        assert_equals(result['query_rows'], 7)
+        assert_equals([q['sql'] for q in result['queries']], ['SELECT 2', 'SELECT 3'])
+    
+    def test_children(self):
+        parent = Profile('parent')
+        child = Profile('child')
+        child.query('wiki', 'SELECT 1', 0.1, 1, explain=[{'table': 'revision'}])
+        parent.children = [child]
+        
+        result = parent.as_dict()
+        assert_equals(result['children'][0]['name'], 'child')
+        assert_equals(
+            result['children'][0]['queries'][0]['explain'],
+            [{'table': 'revision'}]
+        )
+    
+    def test_pickle(self):
+        profile = Profile('report')
+        profile.query('wiki', 'SELECT 1', 0.1, 1)
+        unpickled = pickle.loads(pickle.dumps(profile))
+        assert_equals(unpickled.as_dict(), profile.as_dict())
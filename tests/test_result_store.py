@@ -0,0 +1,46 @@
+import os
+import unittest
+from shutil import rmtree
+from tempfile import mkdtemp
+from decimal import Decimal
+from collections import OrderedDict
+from nose.tools import assert_equals, assert_true
+
+from wikimetrics.api import ReportResultStore
+
+
+class ReportResultStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root_dir = mkdtemp()
+        self.store = ReportResultStore(self.root_dir, 'Individual Results')
+        self.result = {
+            'Sum': {'edits': Decimal('3.0000')},
+            'Individual Results': {
+                1: OrderedDict([('edits', 2)]),
+                2: OrderedDict([('edits', 1)]),
+            },
+        }
+    
+    def tearDown(self):
+        rmtree(self.root_dir)
+    
+    def test_round_trip(self):
+        self.store.write('abcdef', self.result)
+        assert_equals(self.store.read('abcdef'), self.result)
+    
+    def test_read_aggregates_only(self):
+        self.store.write('abcdef', self.result)
+        assert_equals(
+            self.store.read('abcdef', individual=False),
+            {'Sum': {'edits': Decimal('3.0000')}},
+        )
+    
+    def test_read_missing(self):
+        assert_equals(self.store.read('missing'), None)
+    
+    def test_compressed(self):
+        self.store.write('abcdef', self.result)
+        path = self.store.path('abcdef', ReportResultStore.INDIVIDUAL)
+        assert_true(os.path.exists(path))
+        assert_true(open(path, 'rb').read(2) == '\x1f\x8b')
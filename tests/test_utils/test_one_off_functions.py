@@ -11,6 +11,8 @@ from wikimetrics.utils import (
     link_to_user_page,
     parse_pretty_date,
     format_pretty_date,
+    parse_date,
+    format_date,
     diff_datewise,
     timestamps_to_now,
 )
@@ -92,6 +94,19 @@ class UtilsTest(TestCase):
     def test_parse_pretty_date(self):
         date = datetime(2012, 2, 3, 4, 5)
         assert_equal(date, parse_pretty_date(format_pretty_date(date)))
+    
+    def test_parse_date(self):
+        date = datetime(2012, 2, 3, 4, 5, 6)
+        assert_equal(date, parse_date(format_date(date)))
+        assert_equal(date, parse_date(u'20120203040506'))
+        # other forms strptime accepts still parse
+        assert_equal(datetime(2012, 2, 3), parse_date('2012020300000'))
+        for invalid in ['20121303040506', '2012020304050x', '201202030405067']:
+            try:
+                parse_date(invalid)
+                assert_true(False, invalid)
+            except ValueError:
+                pass
 
 
 class TestUtil(TestCase):
@@ -1,4 +1,6 @@
 from file_manager import *
+from cache import *
+from result_store import *
 
 # ignore flake8 because of F403 violation
 # flake8: noqa
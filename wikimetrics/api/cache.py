@@ -0,0 +1,244 @@
+import json
+import cPickle as pickle
+from time import time
+from hashlib import sha1
+from datetime import datetime
+from threading import RLock
+from collections import OrderedDict
+from wikimetrics.utils import BetterEncoder
+
+
+__all__ = [
+    'MetricResultCache',
+    'LocalCacheStore',
+    'RedisCacheStore',
+    'get_metric_cache',
+    'get_revision_length_cache',
+]
+
+
+class LocalCacheStore(object):
+    """
+    Keeps values in this process, evicting the least recently used ones when
+    there are more than max_size, and the ones older than ttl seconds when read.
+    """
+    
+    def __init__(self, max_size, ttl):
+        """
+        Parameters
+            max_size    : the most values to keep
+            ttl         : how many seconds a value stays valid, None for ever
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.lock = RLock()
+        self.values = OrderedDict()
+    
+    def get_many(self, keys):
+        """
+        Returns
+            a dictionary with the keys that were found and their values
+        """
+        found = {}
+        now = time()
+        with self.lock:
+            for key in keys:
+                if key not in self.values:
+                    continue
+                expires, value = self.values.pop(key)
+                if expires > now:
+                    # re-insert to mark it as the most recently used
+                    self.values[key] = (expires, value)
+                    found[key] = value
+        return found
+    
+    def set_many(self, values):
+        """
+        Parameters
+            values  : dictionary of keys to the values to store
+        """
+        expires = float('inf') if self.ttl is None else time() + self.ttl
+        with self.lock:
+            for key, value in values.items():
+                self.values.pop(key, None)
+                self.values[key] = (expires, value)
+            while len(self.values) > self.max_size:
+                self.values.popitem(last=False)
+
+
+class RedisCacheStore(object):
+    """
+    Keeps values in Redis, so they are shared by all the queue workers.
+    Redis takes care of expiring them, and of evicting them if it's
+    configured with an LRU maxmemory-policy.
+    """
+    
+    def __init__(self, url, ttl):
+        """
+        Parameters
+            url     : redis connection url, like redis://localhost:6379/1
+            ttl     : how many seconds a value stays valid
+        """
+        import redis
+        self.redis = redis.StrictRedis.from_url(url)
+        self.ttl = ttl
+    
+    def get_many(self, keys):
+        if not keys:
+            return {}
+        values = self.redis.mget(keys)
+        return {
+            key: value
+            for key, value in zip(keys, values)
+            if value is not None
+        }
+    
+    def set_many(self, values):
+        pipeline = self.redis.pipeline(transaction=False)
+        for key, value in values.items():
+            pipeline.setex(key, self.ttl, value)
+        pipeline.execute()
+
+
+class MetricResultCache(object):
+    """
+    Caches the results of metrics per user, so that running the same metric with
+    the same parameters on overlapping cohorts only computes the users it has
+    not seen yet.  Results are keyed by project, metric class, metric parameters
+    (which include the date window) and user id.
+    
+    Only metrics whose window ended in the past are cached, since the results
+    of an open window keep changing as people edit.
+    """
+    
+    def __init__(self, store):
+        """
+        Parameters
+            store   : a LocalCacheStore or RedisCacheStore
+        """
+        self.store = store
+    
+    @classmethod
+    def from_config(cls, config):
+        """
+        Parameters
+            config  : dictionary with METRIC_CACHE set to 'local', 'redis' or None,
+                      and the matching METRIC_CACHE_* settings
+        
+        Returns
+            a MetricResultCache, or None if caching is turned off
+        """
+        kind = config.get('METRIC_CACHE')
+        ttl = config.get('METRIC_CACHE_TTL')
+        if kind == 'local':
+            return cls(LocalCacheStore(config.get('METRIC_CACHE_SIZE'), ttl))
+        if kind == 'redis':
+            return cls(RedisCacheStore(config.get('METRIC_CACHE_URL'), ttl))
+        return None
+    
+    def cacheable(self, metric):
+        """
+        Returns
+            True if the metric has a date window that ended in the past
+        """
+        end_date = getattr(metric, 'end_date', None)
+        if end_date is None or end_date.data is None:
+            return False
+        return end_date.data <= datetime.now()
+    
+    def parameters(self, metric):
+        """
+        Returns
+            the metric's parameters as a canonical string, without the csrf token
+        """
+        return json.dumps(
+            {
+                name: field.data
+                for name, field in metric._fields.items()
+                if name != 'csrf_token'
+            },
+            cls=BetterEncoder,
+            sort_keys=True,
+        )
+    
+    def keys(self, project, metric, user_ids):
+        """
+        Returns
+            a dictionary of cache keys to the user ids they are for
+        """
+        parameters = sha1(self.parameters(metric)).hexdigest()
+        prefix = 'wikimetrics:metric:{0}:{1}:{2}'.format(
+            project, type(metric).__name__, parameters
+        )
+        return {
+            '{0}:{1}'.format(prefix, user_id): user_id
+            for user_id in user_ids
+        }
+    
+    def get_many(self, project, metric, user_ids):
+        """
+        Returns
+            dictionary of user ids to cached results, for the users that were found
+        """
+        keys = self.keys(project, metric, user_ids)
+        found = self.store.get_many(keys.keys())
+        return {
+            keys[key]: pickle.loads(value)
+            for key, value in found.items()
+        }
+    
+    def set_many(self, project, metric, results):
+        """
+        Parameters
+            results : dictionary of user ids to their metric results
+        """
+        keys = self.keys(project, metric, results.keys())
+        self.store.set_many({
+            key: pickle.dumps(results[user_id], pickle.HIGHEST_PROTOCOL)
+            for key, user_id in keys.items()
+        })
+
+
+metric_cache = None
+metric_cache_lock = RLock()
+
+
+def get_metric_cache(config):
+    """
+    Returns the MetricResultCache of this process, creating it from config the first
+    time, so that the local store is shared by all the reports this worker runs
+    
+    Parameters
+        config  : the queue configuration, see MetricResultCache.from_config
+    
+    Returns
+        a MetricResultCache, or None if caching is turned off
+    """
+    global metric_cache
+    with metric_cache_lock:
+        if metric_cache is None:
+            metric_cache = MetricResultCache.from_config(config) or False
+    return metric_cache or None
+
+
+revision_length_cache = None
+revision_length_cache_lock = RLock()
+
+
+def get_revision_length_cache(config):
+    """
+    Returns the LocalCacheStore of revision lengths of this process, creating it
+    from config the first time.  Revision lengths never change, so they don't expire.
+    
+    Parameters
+        config  : the database configuration, with REVISION_LENGTH_CACHE_SIZE
+    
+    Returns
+        a LocalCacheStore, or None if REVISION_LENGTH_CACHE_SIZE is not set or 0
+    """
+    global revision_length_cache
+    with revision_length_cache_lock:
+        if revision_length_cache is None:
+            size = config.get('REVISION_LENGTH_CACHE_SIZE')
+            revision_length_cache = size and LocalCacheStore(size, None) or False
+    return revision_length_cache or None
@@ -0,0 +1,86 @@
+import os
+import gzip
+import cPickle as pickle
+from tempfile import NamedTemporaryFile
+from wikimetrics.utils import ensure_dir
+
+
+__all__ = ['ReportResultStore']
+
+
+class ReportResultStore(object):
+    """
+    Keeps the results of finished reports on disk, keyed by the report's result_key,
+    so they outlive the celery result backend.  Each result is split in two gzipped
+    pickles: the individual results, and everything else (aggregates, failures),
+    so that callers that only need aggregates do not have to load every user.
+    """
+    
+    AGGREGATES = 'aggregates'
+    INDIVIDUAL = 'individual'
+    
+    def __init__(self, root_dir, individual_key):
+        """
+        Parameters
+            root_dir        : directory to keep the results in, created if needed
+            individual_key  : the key of the individual results in a report result
+        """
+        self.root_dir = root_dir
+        self.individual_key = individual_key
+    
+    def path(self, result_key, part):
+        return os.path.join(
+            self.root_dir,
+            result_key[:2],
+            '{0}.{1}.pickle.gz'.format(result_key, part),
+        )
+    
+    def write(self, result_key, result):
+        """
+        Parameters
+            result_key  : the PersistentReport.result_key of the report
+            result      : the dictionary the report computed
+        """
+        aggregates = dict(result)
+        individual = aggregates.pop(self.individual_key, None)
+        if individual is not None:
+            self.write_part(result_key, self.INDIVIDUAL, individual)
+        # written last, because its presence marks the result as complete
+        self.write_part(result_key, self.AGGREGATES, aggregates)
+    
+    def read(self, result_key, individual=True):
+        """
+        Parameters
+            result_key  : the PersistentReport.result_key of the report
+            individual  : whether to load the individual results too
+        
+        Returns
+            the result as it was written, without the individual results if
+            individual is False, or None if there is no result for result_key
+        """
+        result = self.read_part(result_key, self.AGGREGATES)
+        if result is None:
+            return None
+        
+        if individual:
+            individual_results = self.read_part(result_key, self.INDIVIDUAL)
+            if individual_results is not None:
+                result[self.individual_key] = individual_results
+        return result
+    
+    def write_part(self, result_key, part, value):
+        path = self.path(result_key, part)
+        directory = os.path.dirname(path)
+        ensure_dir(directory, '')
+        # write to a temporary file and rename it, so readers never see half a file
+        with NamedTemporaryFile(dir=directory, delete=False) as temporary:
+            with gzip.GzipFile(fileobj=temporary, mode='wb') as compressed:
+                pickle.dump(value, compressed, pickle.HIGHEST_PROTOCOL)
+        os.rename(temporary.name, path)
+    
+    def read_part(self, result_key, part):
+        try:
+            with gzip.open(self.path(result_key, part), 'rb') as compressed:
+                return pickle.load(compressed)
+        except IOError:
+            return None
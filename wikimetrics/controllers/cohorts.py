@@ -132,6 +132,16 @@ def populate_cohort_validation_status(cohort_dict):
     validation_task = ValidateCohort.task.AsyncResult(task_key)
     cohort_dict['validation_status'] = validation_task.status
     
+    # validation keeps these counts up to date on the cohort as it goes
+    if cohort_dict.get('validation_total') is not None:
+        cohort_dict['valid_count'] = cohort_dict['validation_valid']
+        cohort_dict['invalid_count'] = cohort_dict['validation_invalid']
+        cohort_dict['validated_count'] = cohort_dict['valid_count'] \
+            + cohort_dict['invalid_count']
+        cohort_dict['total_count'] = cohort_dict['validation_total']
+        return cohort_dict
+    
+    # cohorts validated before the counts were kept
     session = db.get_session()
     try:
         cohort_dict['invalid_count'] = session.query(func.count(WikiUser)) \
@@ -210,13 +220,19 @@ def validate_cohort_project_allowed():
 
 @app.route('/cohorts/validate/<int:cohort_id>', methods=['POST'])
 def validate_cohort(cohort_id):
+    """
+    Validates a cohort again.  With ?incremental=true, only the users that are not
+    valid, or that were validated long ago, are checked, and the cohort can still
+    be used for reports while that runs.
+    """
+    incremental = request.args.get('incremental') == 'true'
     name = None
     session = db.get_session()
     try:
         cohort = Cohort.get_safely(session, current_user.id, by_id=cohort_id)
         name = cohort.name
         # TODO we need some kind of global config that is not db specific
-        vc = ValidateCohort(cohort)
+        vc = ValidateCohort(cohort, incremental=incremental)
         vc.task.delay(vc)
         return json_response(message='Validating cohort "{0}"'.format(name))
     except Unauthorized:
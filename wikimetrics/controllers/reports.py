@@ -5,8 +5,10 @@ from sqlalchemy.orm.exc import NoResultFound
 from flask import render_template, request, redirect, url_for, Response, abort, g
 from flask.ext.login import current_user
 from sqlalchemy.exc import SQLAlchemyError
-from wikimetrics.configurables import app, db
-from wikimetrics.models import Report, RunReport, PersistentReport, WikiUser
+from wikimetrics.configurables import app, db, queue
+from wikimetrics.models import (
+    Report, RunReport, PersistentReport, WikiUser, queue_run_reports
+)
 from wikimetrics.metrics import TimeseriesChoices
 from wikimetrics.models.report_nodes import Aggregation
 from wikimetrics.utils import (
@@ -14,7 +16,7 @@ from wikimetrics.utils import (
     stringify
 )
 from wikimetrics.exceptions import UnauthorizedReportAccessError
-from wikimetrics.api import PublicReportFileManager
+from wikimetrics.api import PublicReportFileManager, ReportResultStore
 
 
 @app.before_request
@@ -84,13 +86,22 @@ def reports_request():
     else:
         desired_responses = json.loads(request.form['responses'])
         recurrent = json.loads(request.form.get('recurrent', 'false'))
+        incremental = json.loads(request.form.get('incremental', 'false'))
         public = json.loads(request.form.get('public', 'false'))
 
+        reports = []
         for parameters in desired_responses:
             parameters['recurrent'] = recurrent
+            parameters['incremental'] = recurrent and incremental
             parameters['public'] = public
-            jr = RunReport(parameters, user_id=current_user.id)
-            jr.task.delay(jr)
+            reports.append(RunReport(parameters, user_id=current_user.id))
+
+        # metrics that read the same revisions run together, scanning them once
+        for group in RunReport.fuse(reports):
+            if len(group) == 1:
+                group[0].task.delay(group[0])
+            else:
+                queue_run_reports.delay(group)
 
         return json_redirect(url_for('reports_index'))
 
@@ -110,12 +121,37 @@ def reports_list():
             report.update_status()
 
         # TODO fix json_response to deal with PersistentReport objects
-        reports_json = json_response(reports=[report._asdict() for report in reports])
+        # profiles can be large, they are only sent with each report's result
+        # and by report_profile
+        reports_json = json_response(reports=[
+            dict((k, v) for k, v in report._asdict().items() if k != 'profile')
+            for report in reports
+        ])
     finally:
         db_session.close()
     return reports_json
 
 
+@app.route('/reports/profile/<int:report_id>')
+def report_profile(report_id):
+    """
+    Returns the profile stored with one of the current user's reports: the phases
+    and slowest queries of each report in its tree, or None if it was not profiled
+    """
+    db_session = db.get_session()
+    try:
+        profile = db_session.query(PersistentReport.profile)\
+            .filter(PersistentReport.id == report_id)\
+            .filter(PersistentReport.user_id == current_user.id)\
+            .one()[0]
+    except NoResultFound:
+        return json_error('no report exists with id: {0}'.format(report_id))
+    finally:
+        db_session.close()
+    
+    return json_response(profile=json.loads(profile) if profile else None)
+
+
 def get_celery_task(result_key):
     """
     From a unique identifier, gets the celery task and database records associated.
@@ -153,6 +189,34 @@ def get_celery_task_result(celery_task, db_report):
         return {'failure': 'result not available'}
 
 
+def get_report_result(celery_task, db_report, aggregates_only=False):
+    """
+    Gets the result of a finished report, from the result store if it was stored
+    there, or else from celery.
+
+    Parameters
+        celery_task     : the celery task that ran the report
+        db_report       : the PersistentReport of the report
+        aggregates_only : if True, leave out the individual results
+
+    Returns
+        The report's result, or None if the report has not finished successfully
+    """
+    store = ReportResultStore(queue.conf.get('RESULT_STORE_DIRECTORY'), Aggregation.IND)
+    task_result = store.read(db_report.result_key, individual=not aggregates_only)
+    if task_result is not None:
+        return task_result
+
+    if not (celery_task.ready() and celery_task.successful()):
+        return None
+
+    task_result = get_celery_task_result(celery_task, db_report)
+    if aggregates_only and Aggregation.IND in task_result:
+        task_result = dict(task_result)
+        del task_result[Aggregation.IND]
+    return task_result
+
+
 def prettify_parameters(report):
     """
     TODO add tests for this method
@@ -186,8 +250,9 @@ def report_result_csv(result_key):
     if not celery_task:
         return json_error('no task exists with id: {0}'.format(result_key))
 
-    if celery_task.ready() and celery_task.successful():
-        task_result = get_celery_task_result(celery_task, pj)
+    aggregates_only = request.args.get('aggregates_only') == 'true'
+    task_result = get_report_result(celery_task, pj, aggregates_only)
+    if task_result is not None:
         p = prettify_parameters(pj)
 
         if 'Metric_timeseries' in p and p['Metric_timeseries'] != TimeseriesChoices.NONE:
@@ -216,6 +281,29 @@ def get_username_via_id(user_id):
     return ret[0][1]
 
 
+def aggregate_names(task_result):
+    """
+    Parameters
+        task_result : the result dictionary from Celery
+
+    Returns
+        The names of the aggregates in task_result, in the order they go in CSVs:
+        Sum, Average, Standard Deviation, Median, then percentiles, lowest first
+    """
+    names = [
+        name
+        for name in [Aggregation.SUM, Aggregation.AVG, Aggregation.STD, Aggregation.MED]
+        if name in task_result
+    ]
+    percentiles = [
+        name
+        for name in task_result.keys()
+        if name.startswith(Aggregation.PERCENTILE + ' ')
+    ]
+    percentiles.sort(key=lambda name: float(name.split(' ')[1]))
+    return names + percentiles
+
+
 def get_timeseries_csv(task_result, pj, parameters):
     """
     Parameters
@@ -230,14 +318,11 @@ def get_timeseries_csv(task_result, pj, parameters):
     if task_result:
         columns = []
 
+        aggregates = aggregate_names(task_result)
         if Aggregation.IND in task_result:
             columns = task_result[Aggregation.IND].values()[0].values()[0].keys()
-        elif Aggregation.SUM in task_result:
-            columns = task_result[Aggregation.SUM].values()[0].keys()
-        elif Aggregation.AVG in task_result:
-            columns = task_result[Aggregation.AVG].values()[0].keys()
-        elif Aggregation.STD in task_result:
-            columns = task_result[Aggregation.STD].values()[0].keys()
+        elif aggregates:
+            columns = task_result[aggregates[0]].values()[0].keys()
 
         # if task_result is not empty find header in first row
         fieldnames = ['user_id', 'user_name', 'submetric'] + sorted(columns)
@@ -260,27 +345,11 @@ def get_timeseries_csv(task_result, pj, parameters):
                 task_rows.append(task_row)
 
     # Aggregate Results
-    if Aggregation.SUM in task_result:
-        row = task_result[Aggregation.SUM]
+    for aggregate in aggregate_names(task_result):
+        row = task_result[aggregate]
         for subrow in row.keys():
             task_row = row[subrow].copy()
-            task_row['user_id'] = Aggregation.SUM
-            task_row['submetric'] = subrow
-            task_rows.append(task_row)
-
-    if Aggregation.AVG in task_result:
-        row = task_result[Aggregation.AVG]
-        for subrow in row.keys():
-            task_row = row[subrow].copy()
-            task_row['user_id'] = Aggregation.AVG
-            task_row['submetric'] = subrow
-            task_rows.append(task_row)
-
-    if Aggregation.STD in task_result:
-        row = task_result[Aggregation.STD]
-        for subrow in row.keys():
-            task_row = row[subrow].copy()
-            task_row['user_id'] = Aggregation.STD
+            task_row['user_id'] = aggregate
             task_row['submetric'] = subrow
             task_rows.append(task_row)
 
@@ -313,14 +382,11 @@ def get_simple_csv(task_result, pj, parameters):
     if task_result:
         columns = []
 
+        aggregates = aggregate_names(task_result)
         if Aggregation.IND in task_result:
             columns = task_result[Aggregation.IND].values()[0].keys()
-        elif Aggregation.SUM in task_result:
-            columns = task_result[Aggregation.SUM].keys()
-        elif Aggregation.AVG in task_result:
-            columns = task_result[Aggregation.AVG].keys()
-        elif Aggregation.STD in task_result:
-            columns = task_result[Aggregation.STD].keys()
+        elif aggregates:
+            columns = task_result[aggregates[0]].keys()
 
         # if task_result is not empty find header in first row
         fieldnames = ['user_id', 'user_name'] + columns
@@ -341,19 +407,9 @@ def get_simple_csv(task_result, pj, parameters):
             task_rows.append(task_row)
 
     # Aggregate Results
-    if Aggregation.SUM in task_result:
-        task_row = task_result[Aggregation.SUM].copy()
-        task_row['user_id'] = Aggregation.SUM
-        task_rows.append(task_row)
-
-    if Aggregation.AVG in task_result:
-        task_row = task_result[Aggregation.AVG].copy()
-        task_row['user_id'] = Aggregation.AVG
-        task_rows.append(task_row)
-
-    if Aggregation.STD in task_result:
-        task_row = task_result[Aggregation.STD].copy()
-        task_row['user_id'] = Aggregation.STD
+    for aggregate in aggregate_names(task_result):
+        task_row = task_result[aggregate].copy()
+        task_row['user_id'] = aggregate
         task_rows.append(task_row)
 
     # generate some empty rows to separate the result
@@ -376,12 +432,13 @@ def report_result_json(result_key):
     if not celery_task:
         return json_error('no task exists with id: {0}'.format(result_key))
 
-    if celery_task.ready() and celery_task.successful():
-        task_result = get_celery_task_result(celery_task, pj)
-
+    aggregates_only = request.args.get('aggregates_only') == 'true'
+    task_result = get_report_result(celery_task, pj, aggregates_only)
+    if task_result is not None:
         return json_response(
             result=task_result,
             parameters=prettify_parameters(pj),
+            profile=json.loads(pj.profile) if pj.profile else None,
         )
     else:
         return json_response(status=celery_task.status)
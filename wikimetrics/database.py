@@ -7,7 +7,9 @@ It uses Flask's handy config module to configure itself.
 import json
 import os
 
-from threading import Lock
+from time import time
+from threading import Lock, RLock, Condition, Event, local
+from multiprocessing.pool import ThreadPool
 from os.path import exists
 from urllib2 import urlopen
 
@@ -18,12 +20,49 @@ from sqlalchemy import exc
 from sqlalchemy import event
 from sqlalchemy.pool import Pool
 
+from wikimetrics.profiling import profile_queries
+
 __all__ = [
     'Database',
 ]
 
 
 lock = Lock()
+# guards the creation of mediawiki engines and session makers, which can happen
+# from several threads at once when reports run concurrently
+engine_lock = RLock()
+# AsyncResult.get without a timeout can not be interrupted by signals in python 2,
+# which would keep celery's soft time limit from ever firing, so we always wait
+# at most this long
+LONGEST_WAIT = 60 * 60 * 24 * 365
+
+
+class HostSlots(object):
+    """
+    Counts the threads of this process that are running work against a single
+    mediawiki database host, across every run_by_host call, so pools started
+    by work that already runs on a pool share the same cap
+    """
+    
+    def __init__(self):
+        self.condition = Condition()
+        self.in_use = 0
+    
+    def acquire(self, limit):
+        """
+        Waits until fewer than limit threads are running work against the host,
+        and then counts the calling thread as one of them
+        """
+        with self.condition:
+            while self.in_use >= limit:
+                # a timeout keeps the wait interruptible by signals in python 2
+                self.condition.wait(LONGEST_WAIT)
+            self.in_use += 1
+    
+    def release(self):
+        with self.condition:
+            self.in_use -= 1
+            self.condition.notify_all()
 
 
 class SerializableBase(object):
@@ -85,6 +124,12 @@ class Database(object):
         # we instantiate project_host_map lazily
         self._project_host_map = None
 
+        # HostSlots by host, shared by all the run_by_host calls of this process
+        self.host_slots = {}
+        self.host_slots_lock = Lock()
+        # the (host slots, limit) pairs held by the thread, innermost last
+        self.held_slots = local()
+
     def get_engine(self):
         """
         Create a sqlalchemy engine for the wikimetrics database.
@@ -97,6 +142,7 @@ class Database(object):
                 self.config['WIKIMETRICS_ENGINE_URL'],
                 echo=self.config['SQL_ECHO'],
             )
+            profile_queries(self.wikimetrics_engine, self.config)
 
         return self.wikimetrics_engine
 
@@ -131,23 +177,25 @@ class Database(object):
         """
         if project in self.mediawiki_sessionmakers:
             return self.mediawiki_sessionmakers[project]()
-        else:
-            import wikimetrics.models.mediawiki
-            engine = self.get_mw_engine(project)
-            if self.config['DEBUG']:
-                self.MediawikiBase.metadata.create_all(
-                    engine,
-                    checkfirst=True
-                )
-
-            # Assuming that we're not using the real mediawiki databases in debug mode,
-            # we have to create the tables
-            #if self.config['DEBUG']:
-                #self.MediawikiBase.metadata.create_all(engine, checkfirst=True)
-
-            project_sessionmaker = sessionmaker(engine)
-            self.mediawiki_sessionmakers[project] = project_sessionmaker
-            return project_sessionmaker()
+        
+        with engine_lock:
+            if project not in self.mediawiki_sessionmakers:
+                import wikimetrics.models.mediawiki
+                engine = self.get_mw_engine(project)
+                if self.config['DEBUG']:
+                    self.MediawikiBase.metadata.create_all(
+                        engine,
+                        checkfirst=True
+                    )
+
+                # Assuming that we're not using the real mediawiki databases in
+                # debug mode, we have to create the tables
+                #if self.config['DEBUG']:
+                    #self.MediawikiBase.metadata.create_all(engine, checkfirst=True)
+
+                project_sessionmaker = sessionmaker(engine)
+                self.mediawiki_sessionmakers[project] = project_sessionmaker
+            return self.mediawiki_sessionmakers[project]()
 
     def get_mw_engine(self, project):
         """
@@ -161,16 +209,19 @@ class Database(object):
         """
         if project in self.mediawiki_engines:
             return self.mediawiki_engines[project]
-        else:
-            engine_template = self.config['MEDIAWIKI_ENGINE_URL_TEMPLATE']
-
-            engine = create_engine(
-                engine_template.format(project),
-                echo=self.config['SQL_ECHO'],
-                convert_unicode=True
-            )
-            self.mediawiki_engines[project] = engine
-            return engine
+        
+        with engine_lock:
+            if project not in self.mediawiki_engines:
+                engine_template = self.config['MEDIAWIKI_ENGINE_URL_TEMPLATE']
+
+                engine = create_engine(
+                    engine_template.format(project),
+                    echo=self.config['SQL_ECHO'],
+                    convert_unicode=True
+                )
+                profile_queries(engine, self.config)
+                self.mediawiki_engines[project] = engine
+            return self.mediawiki_engines[project]
 
     def get_project_host_map(self, usecache=True):
         """
@@ -213,6 +264,91 @@ class Database(object):
 
                 self._project_host_map = project_host_map
             return self._project_host_map
+    
+    def run_by_host(self, work, threads_per_host, timeout=None):
+        """
+        Runs callables on a thread pool, making sure that no more than
+        threads_per_host threads of this process query the same mediawiki database
+        host at once.  Hosts are looked up in the project host map (s1 through s7
+        in production).
+        
+        The cap is shared with any other run_by_host call, including the ones
+        made by the callables themselves, like a MetricReport that splits its
+        users into chunks while running on the pool of its parent.  While the
+        calling thread waits for the pool, it gives up the hosts it holds, so
+        the callables it waits for can use them.
+        
+        On timeout, the callables that have not started are dropped, but the
+        ones that are already running can not be stopped: their threads finish
+        their queries in the background, holding their hosts until they are done,
+        and their results are thrown away.
+        
+        Parameters:
+            work                : list of tuples of the form (project, callable), where
+                                  project is the mediawiki project the callable queries
+            threads_per_host    : the maximum number of callables to run at the same
+                                  time against any one database host
+            timeout             : seconds to wait for all the work to finish, optional
+        
+        Returns:
+            list of the results of the callables, in the same order as work
+        
+        Raises:
+            multiprocessing.TimeoutError if the work is not done before timeout,
+            or the first exception raised by any of the callables
+        """
+        if not work:
+            return []
+        
+        project_host_map = self.get_project_host_map()
+        hosts = set(project_host_map.get(project) for project, function in work)
+        cancelled = Event()
+        
+        def run_on_host(project, function):
+            slots = self.get_host_slots(project_host_map.get(project))
+            slots.acquire(threads_per_host)
+            held = self.get_held_slots()
+            held.append((slots, threads_per_host))
+            try:
+                if not cancelled.is_set():
+                    return function()
+            finally:
+                held.pop()
+                slots.release()
+        
+        lent = self.get_held_slots()[:]
+        for slots, limit in lent:
+            slots.release()
+        pool = ThreadPool(min(len(work), threads_per_host * len(hosts)))
+        try:
+            pending = [pool.apply_async(run_on_host, w) for w in work]
+            deadline = time() + (timeout or LONGEST_WAIT)
+            return [p.get(max(deadline - time(), 0)) for p in pending]
+        finally:
+            # callables still waiting for their host return without running
+            cancelled.set()
+            pool.terminate()
+            for slots, limit in lent:
+                slots.acquire(limit)
+    
+    def get_host_slots(self, host):
+        """
+        Returns:
+            the HostSlots of a database host, shared by the whole process
+        """
+        with self.host_slots_lock:
+            if host not in self.host_slots:
+                self.host_slots[host] = HostSlots()
+            return self.host_slots[host]
+    
+    def get_held_slots(self):
+        """
+        Returns:
+            the list of (HostSlots, limit) pairs held by the calling thread
+        """
+        if not hasattr(self.held_slots, 'slots'):
+            self.held_slots.slots = []
+        return self.held_slots.slots
 
 
 @event.listens_for(Pool, "checkout")
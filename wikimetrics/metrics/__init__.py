@@ -1,5 +1,6 @@
 from metric import *
 from timeseries_metric import *
+from timeseries_results import *
 from dummy import *
 from namespace_edits import *
 from revert_rate import *
@@ -7,6 +8,7 @@ from bytes_added import *
 from pages_created import *
 from threshold import *
 from survival import *
+from fused_revision_scan import *
 
 # ignore flake8 because of F403 violation
 # flake8: noqa
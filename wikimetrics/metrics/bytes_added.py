@@ -1,5 +1,8 @@
+from collections import OrderedDict
 from ..utils import thirty_days_ago, today
-from ..models import Revision, Page
+from ..models import Revision, Page, in_user_ids, stream, raw_timestamp
+from ..configurables import db
+from ..api import get_revision_length_cache
 from timeseries_metric import TimeseriesMetric
 from form_fields import (
     BetterDateTimeField,
@@ -10,6 +13,11 @@ from wtforms.validators import Required
 from sqlalchemy import func, case, cast, Integer
 from sqlalchemy.sql.expression import label
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 
 __all__ = [
     'BytesAdded',
@@ -59,6 +67,12 @@ class BytesAdded(TimeseriesMetric):
                 AND revision.rev_timestamp BETWEEN '2013-06-18' AND '2013-07-18'
             ) AS anon_1
       GROUP BY anon_1.rev_user
+    
+    The derived table anon_2 spans the whole revision table, and MySQL may
+    materialize it, so by default the 'parent_lookup' engine is used instead.  It
+    fetches the cohort's revisions first, then only the lengths of their parents,
+    by rev_id, and sums the byte changes in Python.  Set BYTES_ADDED_ENGINE to
+    'derived_table' in the database config to use the query above.
     """
     show_in_ui  = True
     id          = 'bytes-added'
@@ -77,6 +91,9 @@ class BytesAdded(TimeseriesMetric):
     absolute_sum        = BetterBooleanField(default=True)
     net_sum             = BetterBooleanField(default=True)
     
+    # how many parent revisions to fetch in a single query
+    PARENT_BATCH_SIZE = 1000
+    
     def __call__(self, user_ids, session):
         """
         Parameters:
@@ -90,6 +107,126 @@ class BytesAdded(TimeseriesMetric):
                 * positive_only_sum : bytes added
                 * negative_only_sum : bytes removed
         """
+        if self.fused_scan is not None:
+            return self.fused_scan(self, user_ids, session)
+        
+        if db.config.get('BYTES_ADDED_ENGINE') == 'derived_table':
+            return self.derived_table(user_ids, session)
+        return self.parent_lookup(user_ids, session)
+    
+    def parent_lookup(self, user_ids, session):
+        """
+        Computes the same results as derived_table, without joining to the whole
+        revision table.  Parameters and Returns are like __call__
+        """
+        revisions = session\
+            .query(
+                Revision.rev_user,
+                raw_timestamp(Revision.rev_timestamp).label('rev_timestamp'),
+                Revision.rev_len,
+                Revision.rev_parent_id,
+            )\
+            .join(Page)\
+            .filter(Page.page_namespace.in_(self.namespaces.data))\
+            .filter(in_user_ids(Revision.rev_user, user_ids))\
+            .filter(Revision.rev_timestamp > self.start_date.data)\
+            .filter(Revision.rev_timestamp <= self.end_date.data)
+        
+        # each (user, time slice) is a group, and every revision adds to one group
+        groups = OrderedDict()
+        group_indexes = []
+        lengths = []
+        parent_ids = []
+        for rev in stream(revisions):
+            # like in the query, a revision without a length changes nothing
+            if rev.rev_len is None:
+                continue
+            key = (rev.rev_user, self.raw_date_slice(rev.rev_timestamp))
+            group_indexes.append(groups.setdefault(key, len(groups)))
+            lengths.append(rev.rev_len)
+            parent_ids.append(rev.rev_parent_id)
+        
+        byte_changes = self.byte_changes(session, lengths, parent_ids)
+        sums = sum_byte_changes(group_indexes, byte_changes, len(groups))
+        return self.results_from_groups(user_ids, groups, sums, self.submetrics())
+    
+    def submetrics(self):
+        """
+        Returns
+            the requested sums, as a list of tuples of the form (label, index, default)
+        """
+        submetrics = []
+        for name in ['net_sum', 'absolute_sum', 'positive_only_sum', 'negative_only_sum']:
+            if self[name].data:
+                submetrics.append((name, len(submetrics) + 1, 0))
+        return submetrics
+    
+    def byte_changes(self, session, lengths, parent_ids):
+        """
+        Parameters
+            session     : sqlalchemy session open on a mediawiki database
+            lengths     : list with the rev_len of each revision
+            parent_ids  : list with the rev_parent_id of each revision
+        
+        Returns
+            list with the number of bytes each revision changed
+        """
+        parent_lengths = self.parent_lengths(
+            session,
+            set(parent_id for parent_id in parent_ids if parent_id),
+        )
+        return [
+            int(length) - int(parent_lengths.get(parent_id) or 0)
+            for length, parent_id in zip(lengths, parent_ids)
+        ]
+    
+    def parent_lengths(self, session, parent_ids):
+        """
+        Fetches the lengths of parent revisions by primary key, in batches, using
+        and filling this process's revision length cache if it is configured
+        
+        Parameters
+            session     : sqlalchemy session open on a mediawiki database
+            parent_ids  : set of revision ids
+        
+        Returns
+            dictionary of revision ids to their rev_len, for the revisions found
+        """
+        lengths = dict()
+        cache = get_revision_length_cache(db.config)
+        if cache:
+            # revision ids are only unique within a wiki
+            database = session.bind.url.database
+            keys = {
+                '{0}:{1}'.format(database, rev_id): rev_id
+                for rev_id in parent_ids
+            }
+            for key, length in cache.get_many(keys.keys()).items():
+                lengths[keys[key]] = length
+        
+        missing = sorted(rev_id for rev_id in parent_ids if rev_id not in lengths)
+        fetched = dict()
+        for start in range(0, len(missing), self.PARENT_BATCH_SIZE):
+            batch = missing[start:start + self.PARENT_BATCH_SIZE]
+            fetched.update(
+                session.query(Revision.rev_id, Revision.rev_len)
+                .filter(Revision.rev_id.in_(batch))
+                .all()
+            )
+        
+        if cache and fetched:
+            cache.set_many({
+                '{0}:{1}'.format(database, rev_id): length
+                for rev_id, length in fetched.items()
+            })
+        lengths.update(fetched)
+        return lengths
+    
+    def derived_table(self, user_ids, session):
+        """
+        Computes the metric with the query in the class documentation.
+        Parameters and Returns are like __call__
+        """
         start_date = self.start_date.data
         end_date = self.end_date.data
         
@@ -109,7 +246,7 @@ class BytesAdded(TimeseriesMetric):
                 PreviousRevision,
                 Revision.rev_parent_id == PreviousRevision.c.rev_id)\
             .filter(Page.page_namespace.in_(self.namespaces.data))\
-            .filter(Revision.rev_user.in_(user_ids))\
+            .filter(in_user_ids(Revision.rev_user, user_ids))\
             .filter(Revision.rev_timestamp > start_date)\
             .filter(Revision.rev_timestamp <= end_date)\
             .subquery()
@@ -153,3 +290,46 @@ class BytesAdded(TimeseriesMetric):
         
         query = self.apply_timeseries(bytes_added_by_user, rev=BC.c)
         return self.results_by_user(user_ids, query, submetrics, date_index=index)
+
+
+def sum_byte_changes(group_indexes, byte_changes, group_count):
+    """
+    Parameters
+        group_indexes   : list with the group of each byte change
+        byte_changes    : list of byte changes
+        group_count     : how many groups there are
+    
+    Returns
+        a dictionary from each of the four submetrics to a list of their values
+        for each group
+    """
+    if numpy is not None and group_count:
+        indexes = numpy.array(group_indexes, dtype=numpy.int64)
+        changes = numpy.array(byte_changes, dtype=numpy.int64)
+        
+        def by_group(values):
+            # bincount sums in float64, which is exact for any realistic byte count
+            totals = numpy.bincount(indexes, weights=values, minlength=group_count)
+            return [int(total) for total in totals]
+        
+        return {
+            'net_sum'           : by_group(changes),
+            'absolute_sum'      : by_group(numpy.abs(changes)),
+            'positive_only_sum' : by_group(numpy.where(changes > 0, changes, 0)),
+            'negative_only_sum' : by_group(numpy.where(changes < 0, changes, 0)),
+        }
+    
+    sums = {
+        'net_sum'           : [0] * group_count,
+        'absolute_sum'      : [0] * group_count,
+        'positive_only_sum' : [0] * group_count,
+        'negative_only_sum' : [0] * group_count,
+    }
+    for group, change in zip(group_indexes, byte_changes):
+        sums['net_sum'][group] += change
+        sums['absolute_sum'][group] += abs(change)
+        if change > 0:
+            sums['positive_only_sum'][group] += change
+        else:
+            sums['negative_only_sum'][group] += change
+    return sums
@@ -0,0 +1,211 @@
+from threading import Lock, Event
+from collections import OrderedDict
+
+from wikimetrics.models import Page, Revision, in_user_ids, stream, raw_timestamp
+from namespace_edits import NamespaceEdits
+from pages_created import PagesCreated
+from bytes_added import BytesAdded, sum_byte_changes
+
+
+__all__ = ['FusedRevisionScan']
+
+
+class FusedRevisionScan(object):
+    """
+    Computes several metrics that read the same revision JOIN page rows with one
+    query instead of one query each.  NamespaceEdits, PagesCreated and BytesAdded
+    all filter revisions by user, namespace and date window, so when they run on
+    the same cohort with the same parameters for those filters, the revisions are
+    read once and every metric's submetrics are computed from them in Python.
+    
+    An instance is shared by the metrics it fuses, through their fused_scan
+    attribute, and those metrics then call it instead of running their own query.
+    The first metric to ask for a chunk of users on a database triggers the scan
+    for all the metrics, the others wait for it if they ask while it runs, and
+    their results are kept until they ask for the same chunk.  A metric asking for
+    a chunk nobody else asked for, for example because the metric cache already
+    had the other users, still gets a correct result from a scan of its own.
+    """
+    
+    FUSABLE = (NamespaceEdits, PagesCreated, BytesAdded)
+    
+    def __init__(self, metrics):
+        """
+        Parameters
+            metrics : list of Metric instances with the same fusion_key
+        """
+        self.metrics = list(metrics)
+        self.lock = Lock()
+        self.pending = dict()
+    
+    def __getstate__(self):
+        # celery pickles the reports, locks can not be pickled
+        state = self.__dict__.copy()
+        del state['lock']
+        state['pending'] = dict()
+        return state
+    
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = Lock()
+    
+    @classmethod
+    def fusion_key(cls, metric):
+        """
+        Parameters
+            metric  : a Metric instance
+        
+        Returns
+            None if the metric can not be fused, otherwise a key that is equal
+            for metrics that read the same revisions
+        """
+        if not isinstance(metric, cls.FUSABLE):
+            return None
+        return (
+            tuple(sorted(metric.namespaces.data)),
+            metric.start_date.data,
+            metric.end_date.data,
+            metric.timeseries.data,
+        )
+    
+    @classmethod
+    def fuse(cls, metrics):
+        """
+        Groups metrics that can share a scan, and gives each group of more than
+        one metric a FusedRevisionScan
+        
+        Parameters
+            metrics : list of Metric instances that run on the same cohort
+        
+        Returns
+            a list of the FusedRevisionScan instances created
+        """
+        groups = OrderedDict()
+        for metric in metrics:
+            key = cls.fusion_key(metric)
+            if key is not None:
+                groups.setdefault(key, []).append(metric)
+        
+        scans = []
+        for group in groups.values():
+            if len(group) > 1:
+                scan = cls(group)
+                for metric in group:
+                    metric.fused_scan = scan
+                scans.append(scan)
+        return scans
+    
+    def __call__(self, metric, user_ids, session):
+        """
+        Parameters
+            metric      : one of the metrics of this scan
+            user_ids    : list of mediawiki user ids to compute the metric for
+            session     : sqlalchemy session open on a mediawiki database
+        
+        Returns
+            the results the metric would have computed on its own
+        """
+        key = (session.bind.url.database, tuple(sorted(user_ids)))
+        # the lock only guards pending, scans of different chunks and projects
+        # run at the same time, and metrics of a chunk being scanned wait for it
+        with self.lock:
+            pending = self.pending.get(key)
+            scanning = pending is None or id(metric) not in pending.waiting
+            if scanning:
+                pending = PendingScan(self.metrics)
+                self.pending[key] = pending
+            pending.waiting.remove(id(metric))
+            if not pending.waiting:
+                del self.pending[key]
+        
+        if scanning:
+            try:
+                pending.results = self.scan(user_ids, session)
+            finally:
+                pending.done.set()
+        else:
+            pending.done.wait()
+        
+        if pending.results is None:
+            # the scan this metric waited for failed, it gets a chance of its own
+            return self.scan(user_ids, session)[id(metric)]
+        return pending.results.pop(id(metric))
+    
+    def scan(self, user_ids, session):
+        """
+        Reads the revisions once and computes the results of every metric
+        
+        Returns
+            dictionary of id(metric) to that metric's results
+        """
+        # all the metrics have the same fusion_key, so any of them has the filters
+        first = self.metrics[0]
+        revisions = session\
+            .query(
+                Revision.rev_user,
+                raw_timestamp(Revision.rev_timestamp).label('rev_timestamp'),
+                Revision.rev_len,
+                Revision.rev_parent_id,
+            )\
+            .join(Page)\
+            .filter(Page.page_namespace.in_(first.namespaces.data))\
+            .filter(in_user_ids(Revision.rev_user, user_ids))\
+            .filter(Revision.rev_timestamp > first.start_date.data)\
+            .filter(Revision.rev_timestamp <= first.end_date.data)
+        
+        bytes_added = [m for m in self.metrics if isinstance(m, BytesAdded)]
+        groups = OrderedDict()
+        edits = []
+        pages_created = []
+        # only kept for revisions with a length, and only if bytes are added up
+        length_groups = []
+        lengths = []
+        parent_ids = []
+        for rev in stream(revisions):
+            key = (rev.rev_user, first.raw_date_slice(rev.rev_timestamp))
+            group = groups.setdefault(key, len(groups))
+            if group == len(edits):
+                edits.append(0)
+                pages_created.append(0)
+            edits[group] += 1
+            if rev.rev_parent_id == 0:
+                pages_created[group] += 1
+            # like in BytesAdded, a revision without a length changes nothing
+            if bytes_added and rev.rev_len is not None:
+                length_groups.append(group)
+                lengths.append(rev.rev_len)
+                parent_ids.append(rev.rev_parent_id)
+        
+        byte_sums = None
+        if bytes_added:
+            byte_changes = bytes_added[0].byte_changes(session, lengths, parent_ids)
+            byte_sums = sum_byte_changes(length_groups, byte_changes, len(groups))
+        
+        results = dict()
+        for metric in self.metrics:
+            if isinstance(metric, NamespaceEdits):
+                values = {'edits': edits}
+                submetrics = [('edits', 1, 0)]
+            elif isinstance(metric, PagesCreated):
+                values = {'pages_created': pages_created}
+                submetrics = [('pages_created', 1, 0)]
+            else:
+                values = byte_sums
+                submetrics = metric.submetrics()
+            results[id(metric)] = metric.results_from_groups(
+                user_ids, groups, values, submetrics
+            )
+        return results
+
+
+class PendingScan(object):
+    """
+    The scan of one chunk of users on one database, with the metrics that have
+    not taken their results yet.  Metrics that ask for the chunk while it is
+    being scanned wait for done.
+    """
+    
+    def __init__(self, metrics):
+        self.waiting = set(id(metric) for metric in metrics)
+        self.done = Event()
+        self.results = None
@@ -20,6 +20,9 @@ class Metric(WikimetricsSecureForm):
     label       = None
     description = None  # basic description of what the metric does
     
+    # a FusedRevisionScan that computes this metric together with others, if any
+    fused_scan  = None
+    
     def __call__(self, user_ids, session):
         """
         This is the __call__ signature any child implementations should follow.
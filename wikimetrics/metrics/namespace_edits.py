@@ -3,7 +3,7 @@ from timeseries_metric import TimeseriesMetric, TimeseriesChoices
 from form_fields import CommaSeparatedIntegerListField
 from wtforms.validators import Required
 from wikimetrics.utils import thirty_days_ago, today
-from wikimetrics.models import Page, Revision
+from wikimetrics.models import Page, Revision, in_user_ids
 
 
 __all__ = [
@@ -53,6 +53,9 @@ class NamespaceEdits(TimeseriesMetric):
         Returns:
             dictionary from user ids to the number of edit found.
         """
+        if self.fused_scan is not None:
+            return self.fused_scan(self, user_ids, session)
+        
         start_date = self.start_date.data
         end_date = self.end_date.data
         
@@ -60,7 +63,7 @@ class NamespaceEdits(TimeseriesMetric):
             .query(Revision.rev_user, func.count(Revision.rev_id))\
             .join(Page)\
             .filter(Page.page_namespace.in_(self.namespaces.data))\
-            .filter(Revision.rev_user.in_(user_ids))\
+            .filter(in_user_ids(Revision.rev_user, user_ids))\
             .filter(Revision.rev_timestamp > start_date)\
             .filter(Revision.rev_timestamp <= end_date)\
             .group_by(Revision.rev_user)
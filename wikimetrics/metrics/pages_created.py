@@ -3,7 +3,7 @@ from sqlalchemy import func
 from timeseries_metric import TimeseriesMetric
 from form_fields import CommaSeparatedIntegerListField, BetterDateTimeField
 from wtforms.validators import Required
-from wikimetrics.models import Page, Revision
+from wikimetrics.models import Page, Revision, in_user_ids
 
 
 __all__ = ['PagesCreated']
@@ -50,6 +50,9 @@ class PagesCreated(TimeseriesMetric):
         Returns:
             dictionary from user ids to the number of edit found.
         """
+        if self.fused_scan is not None:
+            return self.fused_scan(self, user_ids, session)
+        
         # TODO: (low-priority) take into account cases where rev_deleted = 1
         start_date = self.start_date.data
         end_date = self.end_date.data
@@ -59,7 +62,7 @@ class PagesCreated(TimeseriesMetric):
             .join(Page)\
             .filter(Page.page_namespace.in_(self.namespaces.data))\
             .filter(Revision.rev_parent_id == 0)\
-            .filter(Revision.rev_user.in_(user_ids))\
+            .filter(in_user_ids(Revision.rev_user, user_ids))\
             .filter(Revision.rev_timestamp > start_date)\
             .filter(Revision.rev_timestamp <= end_date)\
             .group_by(Revision.rev_user)
@@ -0,0 +1,167 @@
+from calendar import timegm
+from datetime import timedelta
+from sqlalchemy.sql.expression import and_, or_
+
+from wikimetrics.models import Revision
+
+
+__all__ = ['RegistrationWindows']
+
+
+class RegistrationWindows(object):
+    """
+    The window relative to their registration that each user's revisions count in,
+    like
+
+        unix_timestamp(rev_timestamp) - unix_timestamp(user_registration)
+            BETWEEN <start_seconds> AND <end_seconds>
+    
+    but without computing that for every revision.  Users who registered close
+    to each other, within BUCKET_SECONDS, are grouped in a bucket, and each bucket
+    filters its users' revisions with one absolute rev_timestamp range, which
+    MySQL can look up in the (rev_user, rev_timestamp) index.  The range of a
+    bucket only exceeds the window of each of its users by the width of the
+    bucket, at either end, so:
+
+        filter  reads every revision in a window, and few others
+        inner   reads only revisions in the window of their user, so they can
+                be counted in SQL
+        edges   reads the rest of the revisions filter reads, which callers check
+                against their user's window with contains
+    """
+    
+    # users who registered within this many seconds share a rev_timestamp range
+    BUCKET_SECONDS = 86400
+    # buckets are made twice as wide until there are at most this many of them
+    MAX_BUCKETS = 100
+    
+    def __init__(self, registrations, start_seconds=None, end_seconds=None):
+        """
+        Parameters
+            registrations   : dictionary of user ids to their user_registration,
+                              users who registered on None have no window
+            start_seconds   : the start of the window, in seconds after registration,
+                              or None for no lower bound
+            end_seconds     : the end of the window, in seconds after registration,
+                              or None for no upper bound
+        """
+        self.windows = dict()
+        for user_id, registration in registrations.items():
+            if registration is None:
+                continue
+            start = end = None
+            if start_seconds is not None:
+                start = registration + timedelta(seconds=start_seconds)
+            if end_seconds is not None:
+                end = registration + timedelta(seconds=end_seconds)
+            self.windows[user_id] = (start, end)
+        
+        width = self.BUCKET_SECONDS
+        while True:
+            by_bucket = dict()
+            for user_id, registration in registrations.items():
+                if registration is not None:
+                    bucket = timegm(registration.timetuple()) // width
+                    by_bucket.setdefault(bucket, []).append(user_id)
+            if len(by_bucket) <= self.MAX_BUCKETS:
+                break
+            width *= 2
+        
+        # each bucket is its users, with the earliest and latest start and end
+        # of their windows, which are all None for an open ended window
+        self.buckets = []
+        for bucket in sorted(by_bucket):
+            user_ids = sorted(by_bucket[bucket])
+            starts = [self.windows[user_id][0] for user_id in user_ids]
+            ends = [self.windows[user_id][1] for user_id in user_ids]
+            self.buckets.append((
+                user_ids, min(starts), max(starts), min(ends), max(ends)
+            ))
+    
+    def __len__(self):
+        return len(self.windows)
+    
+    def filter(self):
+        """
+        Returns
+            a filter condition on Revision that every revision in a window meets,
+            or None if no user has a window
+        """
+        ranges = [
+            self.bucket_range(user_ids, first_start, last_end)
+            for user_ids, first_start, last_start, first_end, last_end in self.buckets
+        ]
+        return or_(*ranges) if ranges else None
+    
+    def inner(self):
+        """
+        Returns
+            a filter condition on Revision that only revisions in the window of
+            their user meet, or None if no revision can meet it
+        """
+        ranges = [
+            self.bucket_range(user_ids, last_start, first_end)
+            for user_ids, first_start, last_start, first_end, last_end in self.buckets
+            if not self.no_inner_range(last_start, first_end)
+        ]
+        return or_(*ranges) if ranges else None
+    
+    def edges(self):
+        """
+        Returns
+            a filter condition on Revision for the revisions that filter allows
+            and inner does not, or None if there are none
+        """
+        ranges = []
+        for user_ids, first_start, last_start, first_end, last_end in self.buckets:
+            if self.no_inner_range(last_start, first_end):
+                ranges.append(self.bucket_range(user_ids, first_start, last_end))
+                continue
+            
+            parts = []
+            if first_start != last_start:
+                parts.append(and_(
+                    Revision.rev_timestamp >= first_start,
+                    Revision.rev_timestamp < last_start,
+                ))
+            if first_end != last_end:
+                parts.append(and_(
+                    Revision.rev_timestamp > first_end,
+                    Revision.rev_timestamp <= last_end,
+                ))
+            if parts:
+                ranges.append(and_(Revision.rev_user.in_(user_ids), or_(*parts)))
+        return or_(*ranges) if ranges else None
+    
+    def contains(self, user_id, timestamp):
+        """
+        Returns
+            whether a revision the user made at timestamp is in their window
+        """
+        window = self.windows.get(user_id)
+        if window is None:
+            return False
+        start, end = window
+        return (start is None or timestamp >= start) and (end is None or timestamp <= end)
+    
+    def bucket_range(self, user_ids, start, end):
+        """
+        Returns
+            a filter condition on the revisions of user_ids from start to end,
+            either of which can be None for no bound
+        """
+        conditions = [Revision.rev_user.in_(user_ids)]
+        if start is not None:
+            conditions.append(Revision.rev_timestamp >= start)
+        if end is not None:
+            conditions.append(Revision.rev_timestamp <= end)
+        return and_(*conditions)
+    
+    def no_inner_range(self, last_start, first_end):
+        """
+        Returns
+            whether a bucket is wider than the windows, so no range of time is in
+            the window of all its users
+        """
+        return last_start is not None and first_end is not None \
+            and last_start > first_end
@@ -1,21 +1,29 @@
-from metric import Metric
-from ..utils import thirty_days_ago, today
-from form_fields import CommaSeparatedIntegerListField, BetterDateTimeField
+from decimal import Decimal
+from itertools import groupby
+from collections import deque
+from timeseries_metric import TimeseriesMetric, TimeseriesChoices
+from form_fields import CommaSeparatedIntegerListField
 from wtforms.validators import Required
+from wikimetrics.models import Page, Revision, in_user_ids, stream, raw_timestamp
+from wikimetrics.utils import r
 
 __all__ = [
     'RevertRate',
 ]
 
 
-class RevertRate(Metric):
+class RevertRate(TimeseriesMetric):
     """
     This class implements revert rate logic.
-    An instance of the class is callable and will compute the number of reverted
-    edits for each user in a passed-in list.
+    An instance of the class is callable and will compute the number of edits,
+    the number of reverted edits, and their ratio for each user in a passed-in list.
     
-    This sql query was used as a starting point for the sqlalchemy query:
+    An edit is reverted when a later revision of the same page restores the page
+    to the exact content it had before the edit, as shown by an identical rev_sha1.
+    All the revisions between the restored one and the restoring one are reverted.
     
+    This sql query was the first idea for finding reverts:
+     
      select r.rev_user, r.count(*)
        from revision r
       where r.rev_timestamp between [start] and [end]
@@ -31,15 +39,29 @@ class RevertRate(Metric):
                 and r2.rev_timestamp between r.rev_timestamp and [end]
             )
       group by rev_user
+    
+    but the correlated subquery is too expensive, so instead the revisions of every
+    page the cohort edited are streamed in page and timestamp order, and reverts
+    are detected by keeping the checksums of the last REVERT_RADIUS revisions of
+    the current page.  The pages are scanned PAGES_PER_QUERY at a time, so no
+    query carries an unbounded list of page ids.  Like the query above, only
+    revisions between start_date and end_date are considered, both as reverts
+    and as revisions reverted to.
     """
     
-    show_in_ui  = False
+    show_in_ui  = True
     id          = 'revert-rate'
     label       = 'Revert Rate'
-    description = 'Compute the number of reverted edits in a mediawiki project'
+    description = (
+        'Compute the number of edits, the number of those edits that were reverted,'
+        ' and the ratio of the two, in a specific namespace of a mediawiki project'
+    )
+    
+    # how many revisions back a revert can restore, the usual radius for wikis
+    REVERT_RADIUS = 15
+    # the most page ids each query for revisions lists in its IN clause
+    PAGES_PER_QUERY = 1000
     
-    start_date  = BetterDateTimeField(default=thirty_days_ago)
-    end_date    = BetterDateTimeField(default=today)
     namespaces  = CommaSeparatedIntegerListField(
         None,
         [Required()],
@@ -54,6 +76,106 @@ class RevertRate(Metric):
             session     : sqlalchemy session open on a mediawiki database
         
         Returns:
-            dictionary from user ids to the number of edit reverts found.
+            dictionary from user ids to a dictionary of the form:
+            {
+                'edits': the number of edits,
+                'reverts': the number of those edits that were reverted,
+                'revert_rate': reverts divided by edits, 0 if there were no edits
+            }
+            where each value is instead a dictionary by time slice if this
+            is a timeseries
+        """
+        start_date = self.start_date.data
+        end_date = self.end_date.data
+        
+        pages = session\
+            .query(Revision.rev_page)\
+            .join(Page)\
+            .filter(Page.page_namespace.in_(self.namespaces.data))\
+            .filter(in_user_ids(Revision.rev_user, user_ids))\
+            .filter(Revision.rev_timestamp > start_date)\
+            .filter(Revision.rev_timestamp <= end_date)\
+            .distinct()\
+            .all()
+        page_ids = sorted(page_id for (page_id,) in pages)
+        
+        edits = dict()
+        reverts = dict()
+        cohort = set(user_ids)
+        # a revert never crosses pages, so each chunk of pages is scanned on its own
+        for i in range(0, len(page_ids), self.PAGES_PER_QUERY):
+            revisions = session\
+                .query(
+                    Revision.rev_page,
+                    Revision.rev_user,
+                    raw_timestamp(Revision.rev_timestamp).label('rev_timestamp'),
+                    Revision.rev_sha1,
+                )\
+                .filter(Revision.rev_page.in_(page_ids[i:i + self.PAGES_PER_QUERY]))\
+                .filter(Revision.rev_timestamp > start_date)\
+                .filter(Revision.rev_timestamp <= end_date)\
+                .order_by(Revision.rev_page, Revision.rev_timestamp, Revision.rev_id)
+            
+            by_page = groupby(stream(revisions), lambda rev: rev.rev_page)
+            for page_id, page_revisions in by_page:
+                recent = deque(maxlen=self.REVERT_RADIUS + 1)
+                for revision in page_revisions:
+                    if revision.rev_user in cohort:
+                        self.count(edits, revision)
+                    for reverted in self.reverted_by(revision, recent):
+                        if reverted.rev_user in cohort:
+                            self.count(reverts, reverted)
+        
+        results = dict()
+        for user_id, user_edits in edits.items():
+            user_reverts = reverts.get(user_id, dict())
+            rates = dict(
+                (key, r(Decimal(user_reverts.get(key, 0)) / count))
+                for key, count in user_edits.items()
+            )
+            results[user_id] = dict(
+                edits=user_edits,
+                reverts=dict((key, user_reverts.get(key, 0)) for key in user_edits),
+                revert_rate=rates,
+            )
+            if self.timeseries.data == TimeseriesChoices.NONE:
+                for submetric, values in results[user_id].items():
+                    results[user_id][submetric] = values[None]
+        
+        return self.fill_results_by_user(
+            user_ids,
+            results,
+            [('edits', 1, 0), ('reverts', 2, 0), ('revert_rate', 3, r(0))],
+        )
+    
+    def count(self, counts, revision):
+        """
+        Adds a revision to the counts of its user, by time slice if this is a
+        timeseries, or else under the key None
+        """
+        key = self.raw_date_slice(revision.rev_timestamp)
+        user_counts = counts.setdefault(revision.rev_user, dict())
+        user_counts[key] = user_counts.get(key, 0) + 1
+    
+    def reverted_by(self, revision, recent):
+        """
+        Detects whether a revision is an identity revert, and adds it to the
+        recent revisions of its page
+        
+        Parameters
+            revision    : the next revision of a page, in chronological order
+            recent      : the latest revisions of the page, at most REVERT_RADIUS + 1,
+                          which is updated to remove the revisions that were reverted
+        
+        Returns
+            a list of the revisions that this revision reverted
         """
-        return {user: None for user in user_ids}
+        reverted = []
+        checksums = [rev.rev_sha1 for rev in recent]
+        if revision.rev_sha1 and revision.rev_sha1 in checksums:
+            # the most recent revision with the same content is the one restored
+            restored = len(checksums) - 1 - checksums[::-1].index(revision.rev_sha1)
+            while len(recent) - 1 > restored:
+                reverted.append(recent.pop())
+        recent.append(revision)
+        return reverted
@@ -4,9 +4,10 @@ import calendar
 from sqlalchemy import func, case, Integer
 from sqlalchemy.sql.expression import label, between, and_, or_
 
-from wikimetrics.models import Page, Revision, MediawikiUser
+from wikimetrics.models import Page, Revision, MediawikiUser, in_user_ids, stream
 from wikimetrics.utils import thirty_days_ago, today, CENSORED
 from form_fields import CommaSeparatedIntegerListField, BetterDateTimeField
+from registration_window import RegistrationWindows
 from wtforms.validators import Required
 from wtforms import BooleanField, IntegerField
 
@@ -91,79 +92,64 @@ class Survival(Metric):
         sunset_in_hours = int(self.sunset_in_hours.data)
         number_of_edits = int(self.number_of_edits.data)
         
-        revisions = session \
-            .query(
-                MediawikiUser.user_id,
-                label('rev_count', func.count())
-            ) \
-            .join(Revision) \
-            .join(Page) \
-            .group_by(MediawikiUser.user_id) \
-            .filter(MediawikiUser.user_id.in_(user_ids)) \
-            .filter(Page.page_namespace.in_(self.namespaces.data))
+        window_end = func.unix_timestamp(MediawikiUser.user_registration) \
+            + (survival_hours + sunset_in_hours) * 3600
         
-        # sunset_in_hours is zero, so we use the first case [T+t,today]
-        if sunset_in_hours == 0:
-            revisions = revisions.filter(
-                between(
-                    func.unix_timestamp(Revision.rev_timestamp) -
-                    func.unix_timestamp(MediawikiUser.user_registration)
-                    ,
-                    (survival_hours * 3600)
-                    ,
-                    func.unix_timestamp(func.now()) + 86400
-                )
-            )
-        # otherwise use the sunset_in_hours [T+t,T+t+s]
-        else:
-            revisions = revisions.filter(
-                between(
-                    func.unix_timestamp(Revision.rev_timestamp) -
-                    func.unix_timestamp(MediawikiUser.user_registration)
-                    ,
-                    (survival_hours * 3600)
-                    ,
-                    ((survival_hours + sunset_in_hours) * 3600)
-                )
-            )
-        
-        revisions = revisions.subquery()
-        revs = session.query(
+        # fetch the registrations first, so revisions can be filtered with absolute
+        # rev_timestamp ranges that MySQL can look up in the (rev_user, rev_timestamp)
+        # index, instead of computing unix_timestamp differences for every revision
+        users = session.query(
             MediawikiUser.user_id,
             MediawikiUser.user_registration,
-            label(
-                'rev_count',
-                func.coalesce(revisions.c.rev_count, 0)
-            )
+            label(CENSORED, func.IF(func.unix_timestamp(func.now()) < window_end, 1, 0))
         ) \
-            .outerjoin(revisions, MediawikiUser.user_id == revisions.c.user_id) \
-            .filter(MediawikiUser.user_id.in_(user_ids)) \
-            .subquery()
+            .filter(in_user_ids(MediawikiUser.user_id, user_ids))
+        registrations = {}
+        censored = {}
+        for user_id, registration, user_censored in stream(users):
+            registrations[user_id] = registration
+            censored[user_id] = user_censored
         
-        metric = session.query(
-            revs.c.user_id,
-            label(Survival.id, func.IF(revs.c.rev_count >= number_of_edits, 1, 0)),
-            label(CENSORED, func.IF(
-                revs.c.rev_count >= number_of_edits,
-                0,
-                func.IF(
-                    func.unix_timestamp(func.now()) <
-                    func.unix_timestamp(revs.c.user_registration) +
-                    (survival_hours + sunset_in_hours) * 3600,
-                    1, 0
-                )
-            ))
+        # if sunset_in_hours is zero, we use the first case [T+t,today]
+        # otherwise use the sunset_in_hours [T+t,T+t+s]
+        end_seconds = None
+        if sunset_in_hours != 0:
+            end_seconds = (survival_hours + sunset_in_hours) * 3600
+        windows = RegistrationWindows(
+            registrations,
+            start_seconds=survival_hours * 3600,
+            end_seconds=end_seconds,
         )
+        inner = windows.inner()
+        edges = windows.edges()
         
-        data = metric.all()
+        rev_counts = {}
+        if inner is not None:
+            rev_counts = dict(stream(
+                session.query(Revision.rev_user, func.count())
+                .join(Page)
+                .filter(Page.page_namespace.in_(self.namespaces.data))
+                .filter(inner)
+                .group_by(Revision.rev_user)
+            ))
+        if edges is not None:
+            # the ends of each bucket's range, where only some of its users' windows
+            # are, are checked against each revision's own user
+            revisions = session.query(Revision.rev_user, Revision.rev_timestamp)\
+                .join(Page)\
+                .filter(Page.page_namespace.in_(self.namespaces.data))\
+                .filter(edges)
+            for user_id, timestamp in stream(revisions):
+                if windows.contains(user_id, timestamp):
+                    rev_counts[user_id] = rev_counts.get(user_id, 0) + 1
         
-        metric_results = {
-            u.user_id: {
-                Survival.id : u.survived,
-                CENSORED    : u.censored,
+        metric_results = {}
+        for user_id in registrations:
+            survived = rev_counts.get(user_id, 0) >= number_of_edits
+            metric_results[user_id] = {
+                Survival.id : 1 if survived else 0,
+                CENSORED    : 0 if survived else censored[user_id],
             }
-            for u in data
-        }
         
         r = {
             uid: metric_results.get(uid, {
@@ -1,13 +1,17 @@
 from wikimetrics.metrics import Metric
 import datetime
 import calendar
+from decimal import Decimal
+from itertools import groupby
 from sqlalchemy import func, case, Integer
 from sqlalchemy.orm import aliased
 from sqlalchemy.sql.expression import label, between, and_, or_
 
-from wikimetrics.models import Page, Revision, MediawikiUser
-from wikimetrics.utils import thirty_days_ago, today, CENSORED
+from wikimetrics.configurables import db
+from wikimetrics.models import Page, Revision, MediawikiUser, in_user_ids, stream
+from wikimetrics.utils import thirty_days_ago, today, CENSORED, r
 from form_fields import CommaSeparatedIntegerListField, BetterDateTimeField
+from registration_window import RegistrationWindows
 from wtforms.validators import Required
 from wtforms import BooleanField, IntegerField
 
@@ -52,6 +56,11 @@ class Threshold(Metric):
         user            on user.user_id = ordered_revisions.rev_user
                         and ordered_revisions.number = <number_of_edits>
   WHERE user_id IN (<cohort>)
+    
+    The self join is quadratic in the number of edits each user made, so by default
+    the metric is computed by the 'stream' engine instead, which reads each user's
+    revisions in timestamp order and counts them in one pass.  Set THRESHOLD_ENGINE
+    to 'self_join' in the database config to use the query above.
     """
     
     show_in_ui              = True
@@ -75,6 +84,110 @@ class Threshold(Metric):
     
     def __call__(self, user_ids, session):
         """
+        Parameters:
+            user_ids    : list of mediawiki user ids to find edit for
+            session     : sqlalchemy session open on a mediawiki database
+        
+        Returns:
+            dictionary from user ids to a dictionary of the form:
+            {
+                'threshold': 1 for True, 0 for False,
+                'time_to_threshold': number in hours or None,
+                'censored': 1 for True, 0 for False
+            }
+        """
+        if db.config.get('THRESHOLD_ENGINE') == 'self_join':
+            return self.self_join(user_ids, session)
+        return self.stream(user_ids, session)
+    
+    def stream(self, user_ids, session):
+        """
+        Computes the same results as self_join, but in time linear in the number
+        of revisions.  The cohort's registrations are fetched first, so that each
+        user's revisions up to the end of their threshold window can be read with
+        the absolute rev_timestamp range of users who registered close to them,
+        see RegistrationWindows, ordered by timestamp, in one pass.  A user who
+        registered years before the others is not read past their own window.
+        The user reaches the threshold at the first timestamp where the running
+        count matches number_of_edits the way the self join counts it.
+        
+        Parameters and Returns are like __call__
+        """
+        threshold_secs  = int(self.threshold_hours.data) * 3600
+        number_of_edits = int(self.number_of_edits.data)
+        namespaces      = set(self.namespaces.data)
+        
+        window_end = func.unix_timestamp(MediawikiUser.user_registration) + threshold_secs
+        users = session \
+            .query(
+                MediawikiUser.user_id,
+                MediawikiUser.user_registration,
+                label(CENSORED, func.IF(
+                    window_end > func.unix_timestamp(func.now()), 1, 0
+                ))
+            ) \
+            .filter(in_user_ids(MediawikiUser.user_id, user_ids))
+        registrations = {}
+        censored = {}
+        for user_id, registration, user_censored in stream(users):
+            registrations[user_id] = registration
+            censored[user_id] = user_censored
+        
+        seconds_to_threshold = {}
+        windows = RegistrationWindows(registrations, end_seconds=threshold_secs)
+        in_windows = windows.filter()
+        if in_windows is not None:
+            revisions = session \
+                .query(Revision.rev_user, Revision.rev_timestamp, Page.page_namespace) \
+                .outerjoin(Page) \
+                .filter(in_windows) \
+                .order_by(Revision.rev_user, Revision.rev_timestamp)
+            
+            by_user = groupby(stream(revisions), lambda rev: rev.rev_user)
+            for user_id, user_revisions in by_user:
+                # the range of a bucket can end after the windows of some of its users
+                user_revisions = (
+                    rev for rev in user_revisions
+                    if windows.contains(user_id, rev.rev_timestamp)
+                )
+                # revisions made up to each timestamp, in any namespace, like r2 above
+                count = 0
+                for timestamp, same_time in groupby(
+                        user_revisions, lambda rev: rev.rev_timestamp):
+                    same_time = list(same_time)
+                    count += len(same_time)
+                    in_namespaces = len([
+                        rev for rev in same_time if rev.page_namespace in namespaces
+                    ])
+                    # the self join groups by timestamp, so it counts each revision
+                    # at or before this timestamp once for each one in the namespaces
+                    if in_namespaces and in_namespaces * count == number_of_edits:
+                        delta = timestamp - registrations[user_id]
+                        seconds_to_threshold[user_id] = delta.days * 86400 + delta.seconds
+                        break
+        
+        metric_results = {}
+        for user_id in registrations:
+            if user_id in seconds_to_threshold:
+                # MySQL divides integers into decimals with 4 places, rounding half up
+                hours = r(Decimal(seconds_to_threshold[user_id]) / 3600)
+                metric_results[user_id] = {
+                    Threshold.id                    : 1,
+                    Threshold.time_to_threshold_id  : hours,
+                    CENSORED                        : 0,
+                }
+            else:
+                metric_results[user_id] = {
+                    Threshold.id                    : 0,
+                    Threshold.time_to_threshold_id  : None,
+                    CENSORED                        : censored[user_id],
+                }
+        return metric_results
+    
+    def self_join(self, user_ids, session):
+        """
+        Computes the metric with the query in the class documentation.
+        
         Parameters:
             user_ids    : list of mediawiki user ids to find edit for
             session     : sqlalchemy session open on a mediawiki database
@@ -110,7 +223,7 @@ class Threshold(Metric):
             ) \
             .group_by(Revision.rev_user) \
             .group_by(Revision.rev_timestamp) \
-            .filter(Revision.rev_user.in_(user_ids)) \
+            .filter(in_user_ids(Revision.rev_user, user_ids)) \
             .filter(Page.page_namespace.in_(self.namespaces.data)) \
             .filter(
                 func.unix_timestamp(Revision.rev_timestamp) -
@@ -151,7 +264,7 @@ class Threshold(Metric):
                 and_(
                     MediawikiUser.user_id == o_r.c.rev_user,
                     o_r.c.number == number_of_edits)) \
-            .filter(MediawikiUser.user_id.in_(user_ids))
+            .filter(in_user_ids(MediawikiUser.user_id, user_ids, reference=1))
         
         return {
             u.user_id: {
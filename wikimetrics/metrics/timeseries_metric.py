@@ -4,9 +4,14 @@ from datetime import datetime
 from dateutil.relativedelta import relativedelta
 from wtforms import SelectField
 
-from wikimetrics.models import Revision
-from wikimetrics.utils import thirty_days_ago, today, format_pretty_date
+from wikimetrics.configurables import db
+from wikimetrics.models import Revision, stream
+from wikimetrics.profiling import phase
+from wikimetrics.utils import (
+    thirty_days_ago, today, format_pretty_date, format_date, parse_date,
+)
 from metric import Metric
+from timeseries_results import SliceIndex, TimeseriesColumn, TimeseriesView
 from form_fields import CommaSeparatedIntegerListField, BetterDateTimeField
 
 
@@ -17,10 +22,25 @@ class TimeseriesChoices(object):
     NONE = 'none'
     HOUR = 'hour'
     DAY = 'day'
+    WEEK = 'week'
     MONTH = 'month'
+    QUARTER = 'quarter'
     YEAR = 'year'
 
 
+# how many characters of a MediaWiki timestamp identify a slice
+TIMESTAMP_PREFIX_LENGTHS = {
+    TimeseriesChoices.YEAR  : 4,
+    TimeseriesChoices.MONTH : 6,
+    TimeseriesChoices.DAY   : 8,
+    TimeseriesChoices.HOUR  : 10,
+}
+# completes a timestamp prefix into the start of its slice
+TIMESTAMP_PREFIX_PADDING = '0101000000'
+# MySQL's TO_DAYS counts from year 0, Python's ordinals from year 1
+TO_DAYS_OFFSET = 365
+
+
 class TimeseriesMetric(Metric):
     """
     This class is the parent of Metric implementations which can return timeseries
@@ -37,7 +57,9 @@ class TimeseriesMetric(Metric):
             (TimeseriesChoices.NONE, TimeseriesChoices.NONE),
             (TimeseriesChoices.HOUR, TimeseriesChoices.HOUR),
             (TimeseriesChoices.DAY, TimeseriesChoices.DAY),
+            (TimeseriesChoices.WEEK, TimeseriesChoices.WEEK),
             (TimeseriesChoices.MONTH, TimeseriesChoices.MONTH),
+            (TimeseriesChoices.QUARTER, TimeseriesChoices.QUARTER),
             (TimeseriesChoices.YEAR, TimeseriesChoices.YEAR),
         ],
     )
@@ -46,6 +68,11 @@ class TimeseriesMetric(Metric):
         """
         Take a query and slice it up into equal time intervals
         
+        By default the query is grouped by a single bucket expression, see bucket.
+        If TIMESERIES_ENGINE is 'date_parts' in the database config, hours, days,
+        months and years are instead grouped by up to four columns: the year,
+        month, day and hour of the timestamp.
+        
         Parameters
             query   : a sql alchemy query
             rev     : defaults to Revision, specifies the object that
@@ -59,6 +86,10 @@ class TimeseriesMetric(Metric):
         if choice == TimeseriesChoices.NONE:
             return query
         
+        if self.uses_buckets():
+            bucket = self.bucket(rev.rev_timestamp)
+            return query.add_column(bucket).group_by(bucket)
+        
         query = query.add_column(func.year(rev.rev_timestamp))
         query = query.group_by(func.year(rev.rev_timestamp))
         
@@ -113,7 +144,51 @@ class TimeseriesMetric(Metric):
         """
         # get a dictionary of user_ids to their metric results
         results = self.submetrics_by_user(query, submetrics, date_index)
+        return self.fill_results_by_user(user_ids, results, submetrics)
+    
+    def results_from_groups(self, user_ids, groups, values, submetrics):
+        """
+        Builds results by user from values computed in Python for each
+        (user, time slice) group
+        
+        Parameters
+            user_ids            : list of integer ids to return results for
+            groups              : dictionary of (user_id, date_slice) to the index of
+                                  the group in values, date_slice being the output
+                                  of date_slice or raw_date_slice for its revisions
+            values              : dictionary of submetric labels to lists of their
+                                  value for each group
+            submetrics          : list of tuples of the form (label, index, default)
+        
+        Returns
+            A dictionary of user_ids to results, shaped like in results_by_user
+        """
+        results = OrderedDict()
+        for (user_id, date_slice), group in groups.items():
+            user_results = results.setdefault(user_id, OrderedDict())
+            for label, index, default in submetrics:
+                if date_slice is None:
+                    user_results[label] = values[label][group]
+                else:
+                    user_results.setdefault(label, dict())[date_slice] = \
+                        values[label][group]
+        
+        return self.fill_results_by_user(user_ids, results, submetrics)
+    
+    def fill_results_by_user(self, user_ids, results, submetrics):
+        """
+        Fills in results computed for some users, for metrics that don't get their
+        results from a single query
+        
+        Parameters
+            user_ids            : list of integer ids to return results for
+            results             : dictionary of user_ids to their results, shaped
+                                  like the output of submetrics_by_user
+            submetrics          : list of tuples of the form (label, index, default)
         
+        Returns
+            A dictionary of user_ids to results, shaped like in results_by_user
+        """
         # make a default return dictionary for users not found by the query
         submetric_defaults = dict()
         for label, index, default in submetrics:
@@ -129,7 +204,8 @@ class TimeseriesMetric(Metric):
         }
         
         # in timeseries results, fill in missing date-times
-        results = self.normalize_datetime_slices(results, submetrics)
+        with phase('normalize'):
+            results = self.normalize_datetime_slices(results, submetrics)
         return results
     
     def submetrics_by_user(self, query, submetrics, date_index=None):
@@ -137,21 +213,24 @@ class TimeseriesMetric(Metric):
         Same as results_by_user, except doesn't return results for users not found in
         the query_results list.
         """
-        query_results = query.all()
         results = OrderedDict()
+        timeseries = self.timeseries.data != TimeseriesChoices.NONE
+        slices = None
+        if timeseries and self.uses_buckets():
+            slices = self.slice_lookup()
         
-        # handle simple cases (no results or no timeseries)
-        if not query_results:
-            return results
-        
-        # get results by user and by date
-        for row in query_results:
+        # get results by user and by date, as the rows arrive
+        for row in stream(query):
             user_id = row[0]
             if user_id not in results:
                 results[user_id] = OrderedDict()
             
             date_slice = None
-            if self.timeseries.data != TimeseriesChoices.NONE:
+            if slices is not None:
+                date_slice = slices.get(row[date_index])
+                if date_slice is None:
+                    date_slice = format_pretty_date(self.bucket_start(row[date_index]))
+            elif timeseries:
                 date_slice = self.get_date_from_tuple(row, date_index, len(row))
             
             for label, index, default in submetrics:
@@ -171,6 +250,10 @@ class TimeseriesMetric(Metric):
         first timeseries slice is >= self.start_date.
         If self.timeseries is NONE, this is a simple identity function.
         
+        The values of each submetric are stored in one TimeseriesColumn of users by
+        slices, filled with the default up front, and each user's submetric becomes
+        a read only dictionary view over its row of that column.
+        
         Parameters
             results_by_user : dictionary of submetrics dictionaries by user
             submetrics      : list of tuples of the form (label, index, default)
@@ -181,36 +264,46 @@ class TimeseriesMetric(Metric):
         if self.timeseries.data == TimeseriesChoices.NONE:
             return results_by_user
         
+        index = self.slice_index()
+        columns = dict()
+        for row, user_submetrics in enumerate(results_by_user.itervalues()):
+            for label, i, default in submetrics:
+                if not label or not user_submetrics or label not in user_submetrics:
+                    continue
+                if label not in columns:
+                    columns[label] = TimeseriesColumn(
+                        index, len(results_by_user), default
+                    )
+                column = columns[label]
+                # users not found by the query share one dictionary of defaults,
+                # which already holds a view after the first of them
+                if not isinstance(user_submetrics[label], TimeseriesView):
+                    for key, value in user_submetrics[label].iteritems():
+                        column.set(row, key, value)
+                user_submetrics[label] = column.view(row)
+        
+        return results_by_user
+    
+    def slice_index(self):
+        """
+        Returns
+            a SliceIndex with the keys of every slice from start_date to end_date,
+            where the first slice is keyed by start_date itself, and values
+            for the slice start_date falls in are stored under that key
+        """
         slice_delta = self.get_delta_from_choice()
-        timeseries_slices = OrderedDict()
         start_slice_key = format_pretty_date(self.start_date.data)
-        timeseries_slices[start_slice_key] = None
+        keys = [start_slice_key]
         
         first_slice = self.get_first_slice()
         first_slice_key = format_pretty_date(first_slice)
-        slice_to_default = first_slice
+        slice_to_default = first_slice + slice_delta
         while slice_to_default < self.end_date.data:
-            date_key = format_pretty_date(slice_to_default)
-            timeseries_slices[date_key] = None
+            keys.append(format_pretty_date(slice_to_default))
             slice_to_default += slice_delta
         
-        for user_id, user_submetrics in results_by_user.iteritems():
-            for label, i, default in submetrics:
-                if not label or not user_submetrics or label not in user_submetrics:
-                    continue
-                defaults = timeseries_slices.copy()
-                defaults.update(user_submetrics[label])
-                for k, v in defaults.iteritems():
-                    if not v:
-                        defaults[k] = default
-                
-                if start_slice_key != first_slice_key:
-                    # coerce the first datetime slice to be self.start_date
-                    defaults[start_slice_key] = defaults.pop(first_slice_key)
-                
-                user_submetrics[label] = defaults
-        
-        return results_by_user
+        # coerce the first datetime slice to be self.start_date
+        return SliceIndex(keys, {first_slice_key: 0})
     
     def get_first_slice(self):
         """
@@ -220,16 +313,64 @@ class TimeseriesMetric(Metric):
         if self.timeseries.data == TimeseriesChoices.NONE:
             return None
         
-        d = self.start_date.data
+        return self.truncate_to_slice(self.start_date.data)
+    
+    def truncate_to_slice(self, d):
+        """
+        Returns
+            the start of the timeseries interval that the datetime d falls in
+        """
+        if self.timeseries.data == TimeseriesChoices.NONE:
+            return None
+        
         if self.timeseries.data == TimeseriesChoices.HOUR:
             return datetime(d.year, d.month, d.day, d.hour)
         if self.timeseries.data == TimeseriesChoices.DAY:
             return datetime(d.year, d.month, d.day, 0)
+        if self.timeseries.data == TimeseriesChoices.WEEK:
+            return datetime.fromordinal(d.toordinal() - d.weekday())
         if self.timeseries.data == TimeseriesChoices.MONTH:
             return datetime(d.year, d.month, 1, 0)
+        if self.timeseries.data == TimeseriesChoices.QUARTER:
+            return datetime(d.year, d.month - (d.month - 1) % 3, 1, 0)
         if self.timeseries.data == TimeseriesChoices.YEAR:
             return datetime(d.year, 1, 1, 0)
     
+    def date_slice(self, d):
+        """
+        Returns
+            the key of the timeseries slice that the datetime d falls in, formatted
+            like the slices of results_by_user, or None if this is not a timeseries
+        """
+        slice_start = self.truncate_to_slice(d)
+        if slice_start is None:
+            return None
+        return format_pretty_date(slice_start)
+    
+    def raw_date_slice(self, timestamp):
+        """
+        Same as date_slice, for a timestamp selected as an integer with
+        raw_timestamp.  Hours, days, months and years are found with an integer
+        division and a lookup table, without creating a datetime.
+        """
+        length = TIMESTAMP_PREFIX_LENGTHS.get(self.timeseries.data)
+        if length is None:
+            if self.timeseries.data == TimeseriesChoices.NONE:
+                return None
+            return self.date_slice(parse_date(str(timestamp)))
+        
+        prefixes = getattr(self, 'raw_slices', None)
+        if prefixes is None:
+            prefixes = self.raw_slices = dict(
+                (int(bucket), key) for bucket, key in self.slice_lookup().items()
+            )
+        
+        prefix = timestamp // 10 ** (14 - length)
+        date_slice = prefixes.get(prefix)
+        if date_slice is None:
+            date_slice = format_pretty_date(self.bucket_start(prefix))
+        return date_slice
+    
     def get_delta_from_choice(self):
         """
         Given a user's choice of timeseries grouping,
@@ -241,11 +382,83 @@ class TimeseriesMetric(Metric):
             return relativedelta(hours=1)
         if self.timeseries.data == TimeseriesChoices.DAY:
             return relativedelta(days=1)
+        if self.timeseries.data == TimeseriesChoices.WEEK:
+            return relativedelta(weeks=1)
         if self.timeseries.data == TimeseriesChoices.MONTH:
             return relativedelta(months=1)
+        if self.timeseries.data == TimeseriesChoices.QUARTER:
+            return relativedelta(months=3)
         if self.timeseries.data == TimeseriesChoices.YEAR:
             return relativedelta(years=1)
     
+    def uses_buckets(self):
+        """
+        Returns
+            True if apply_timeseries groups by a single bucket expression
+        """
+        return self.timeseries.data not in TIMESTAMP_PREFIX_LENGTHS\
+            or db.config.get('TIMESERIES_ENGINE') != 'date_parts'
+    
+    def bucket(self, rev_timestamp):
+        """
+        Parameters
+            rev_timestamp   : a column holding MediaWiki timestamps
+        
+        Returns
+            a sql expression that is the same for all the timestamps of a slice:
+            a prefix of the timestamp for hours, days, months and years, the
+            TO_DAYS of the monday starting a week, or the number of quarters
+            since year 0
+        """
+        choice = self.timeseries.data
+        if choice == TimeseriesChoices.WEEK:
+            return func.to_days(rev_timestamp) - func.weekday(rev_timestamp)
+        if choice == TimeseriesChoices.QUARTER:
+            return func.year(rev_timestamp) * 4 + func.quarter(rev_timestamp) - 1
+        return func.substr(rev_timestamp, 1, TIMESTAMP_PREFIX_LENGTHS[choice])
+    
+    def bucket_of(self, d):
+        """
+        Returns
+            the value the bucket expression has for the datetime d
+        """
+        choice = self.timeseries.data
+        if choice == TimeseriesChoices.WEEK:
+            return d.toordinal() + TO_DAYS_OFFSET - d.weekday()
+        if choice == TimeseriesChoices.QUARTER:
+            return d.year * 4 + (d.month - 1) // 3
+        return format_date(d)[:TIMESTAMP_PREFIX_LENGTHS[choice]]
+    
+    def bucket_start(self, bucket):
+        """
+        Returns
+            the start of the slice of a value of the bucket expression
+        """
+        choice = self.timeseries.data
+        if choice == TimeseriesChoices.WEEK:
+            return datetime.fromordinal(int(bucket) - TO_DAYS_OFFSET)
+        if choice == TimeseriesChoices.QUARTER:
+            bucket = int(bucket)
+            return datetime(bucket // 4, bucket % 4 * 3 + 1, 1)
+        prefix = str(bucket)
+        return parse_date(prefix + TIMESTAMP_PREFIX_PADDING[len(prefix) - 4:])
+    
+    def slice_lookup(self):
+        """
+        Returns
+            dictionary of the values of the bucket expression to the keys of their
+            slices, for every slice from start_date up to and including the slice
+            of end_date, so query results can be keyed without parsing or
+            formatting a date for each row
+        """
+        slices = dict()
+        slice_start = self.get_first_slice()
+        slice_delta = self.get_delta_from_choice()
+        while slice_start <= self.end_date.data:
+            slices[self.bucket_of(slice_start)] = format_pretty_date(slice_start)
+            slice_start += slice_delta
+        return slices
+    
     def get_date_from_tuple(self, row_tuple, start_index, stop_index):
         """
         Suppose you have a tuple like this:
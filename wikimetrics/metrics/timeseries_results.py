@@ -0,0 +1,121 @@
+from array import array
+from collections import Mapping, OrderedDict
+
+
+__all__ = [
+    'SliceIndex',
+    'TimeseriesColumn',
+    'TimeseriesView',
+]
+
+
+class SliceIndex(object):
+    """
+    The ordered keys of the time slices of a timeseries, shared by all the
+    users and submetrics of a result, with the position of each key.
+    """
+    
+    def __init__(self, keys, aliases=None):
+        """
+        Parameters
+            keys    : list of formatted slice keys, in chronological order
+            aliases : dictionary of other keys that values can be stored under,
+                      to the position they go to
+        """
+        self.keys = keys
+        self.positions = dict((key, position) for position, key in enumerate(keys))
+        self.write_positions = dict(self.positions)
+        self.write_positions.update(aliases or {})
+    
+    def __len__(self):
+        return len(self.keys)
+
+
+class TimeseriesColumn(object):
+    """
+    The values of one submetric for many users, as one dense array of users by
+    slices that starts out filled with the submetric's default.  Integers are
+    kept in a typed array, and the column switches to a list the first time it
+    is given any other kind of value.  Values for keys outside the index, which
+    queries can return for the slice at end_date, are kept aside for each user.
+    """
+    
+    def __init__(self, index, rows, default):
+        """
+        Parameters
+            index   : the SliceIndex of the timeseries
+            rows    : how many users the column holds values for
+            default : the value of every slice that is not set
+        """
+        self.index = index
+        self.width = len(index)
+        self.default = default
+        self.extras = dict()
+        size = rows * self.width
+        if type(default) in (int, long):
+            self.values = array('l', [default]) * size
+        else:
+            self.values = [default] * size
+    
+    def set(self, row, key, value):
+        """
+        Stores the value of one slice for one user, replacing false values like 0
+        and None with the default
+        """
+        if not value:
+            value = self.default
+        
+        position = self.index.write_positions.get(key)
+        if position is None:
+            self.extras.setdefault(row, OrderedDict())[key] = value
+            return
+        
+        i = row * self.width + position
+        if isinstance(self.values, array) and type(value) not in (int, long):
+            self.values = list(self.values)
+        try:
+            self.values[i] = value
+        except OverflowError:
+            self.values = list(self.values)
+            self.values[i] = value
+    
+    def view(self, row):
+        return TimeseriesView(self, row)
+
+
+class TimeseriesView(Mapping):
+    """
+    A read only dictionary of slice keys to values over one user's row of a
+    TimeseriesColumn.  It iterates in slice order, like the OrderedDict results
+    it stands in for, and it pickles as an OrderedDict, so results that leave
+    the worker, through celery, the result store or the metric cache, do not
+    carry the whole column along.
+    """
+    
+    def __init__(self, column, row):
+        self.column = column
+        self.row = row
+    
+    def __getitem__(self, key):
+        position = self.column.index.positions.get(key)
+        if position is None:
+            return self.column.extras.get(self.row, {})[key]
+        return self.column.values[self.row * self.column.width + position]
+    
+    def __iter__(self):
+        for key in self.column.index.keys:
+            yield key
+        for key in self.column.extras.get(self.row, {}):
+            yield key
+    
+    def __len__(self):
+        return self.column.width + len(self.column.extras.get(self.row, {}))
+    
+    def copy(self):
+        return OrderedDict(self.iteritems())
+    
+    def __reduce__(self):
+        return (OrderedDict, (self.items(),))
+    
+    def __repr__(self):
+        return repr(self.copy())
@@ -2,9 +2,11 @@ from mediawiki import *
 from report_nodes import *
 
 from cohort import *
+from cohort_snapshot import *
 from cohort_user import *
 from cohort_wikiuser import *
 from persistent_report import *
+from partial_aggregate import *
 from user import *
 from wikiuser import *
 from validate_cohort import *
@@ -1,17 +1,24 @@
-import itertools
-from operator import itemgetter
+from array import array
 from sqlalchemy import Column, Integer, Boolean, DateTime, String, func
 from wikimetrics.exceptions import Unauthorized
 from wikimetrics.configurables import db
+from mediawiki import stream
 from wikiuser import WikiUser
 from cohort_wikiuser import CohortWikiUser
 from cohort_user import CohortUser, CohortUserRole
 from user import User
+from cohort_snapshot import CohortSnapshot
 
 
 __all__ = ['Cohort']
 
 
+# snapshots of the cohorts used recently, by (id, changed, validated)
+snapshots = {}
+# long enough for the user ids of any project, MySQL lowers it to its own maximum
+GROUP_CONCAT_MAX_LEN = 2 ** 32 - 1
+
+
 class Cohort(db.WikimetricsBase):
     """
     This class represents a list of users along with the project
@@ -38,41 +45,30 @@ class Cohort(db.WikimetricsBase):
     validated               = Column(Boolean, default=False)
     validate_as_user_ids    = Column(Boolean, default=True)
     validation_queue_key    = Column(String(50))
+    # the progress of the last validation: how many records it has to validate,
+    # and how many of them it found valid and invalid so far
+    validation_total        = Column(Integer)
+    validation_valid        = Column(Integer)
+    validation_invalid      = Column(Integer)
     
     def __repr__(self):
         return '<Cohort("{0}")>'.format(self.id)
     
-    # TODO: that weird bug that makes "None" show up in metric results
-    # starts with iterating Cohorts here
     def __iter__(self):
         """ returns list of user_ids """
-        db_session = db.get_session()
-        try:
-            wikiusers = self.filter_wikiuser_query(
-                db_session.query(WikiUser.mediawiki_userid)
-            ).all()
-        finally:
-            db_session.close()
-        return (r.mediawiki_userid for r in wikiusers)
+        return iter(self.snapshot())
     
     def __len__(self):
         """
         NOTE: this can be different than the length of the result of __iter__,
-        because database changes might occur in between calls.  So any code that
-        depends on that not being the case *may* fail in unexpected and wild ways.
+        because a cohort that is not validated has a length but no users.  It can
+        also change between calls, because database changes might occur in between.
+        Code that needs several of these answers to agree should ask one snapshot.
         
         Returns:
             the number of users in this cohort
         """
-        db_session = db.get_session()
-        try:
-            return db_session.query(func.count(CohortWikiUser.id)) \
-                .join(WikiUser) \
-                .filter(CohortWikiUser.cohort_id == self.id) \
-                .filter(WikiUser.valid) \
-                .one()[0]
-        finally:
-            db_session.close()
+        return len(self.snapshot())
     
     def group_by_project(self):
         """
@@ -88,21 +84,78 @@ class Cohort(db.WikimetricsBase):
         into a set of project-homogenous cohorts, which can be
         analyzed using a single database connection
         """
+        return self.snapshot().group_by_project()
+    
+    def snapshot(self):
+        """
+        Loads the valid members of this cohort with a single query, which groups
+        them by project in the database and packs each project's user ids into one
+        string with GROUP_CONCAT, so only one row per project is transferred.  If
+        COHORT_SNAPSHOT_CACHE_SIZE is configured, snapshots are kept by cohort id,
+        changed and validated, so cohorts that did not change since their last
+        snapshot do not go to the database.  Validation sets changed.
+        
+        Returns:
+            a CohortSnapshot of this cohort
+        """
+        key = (self.id, self.changed, bool(self.validated))
+        cache_size = db.config.get('COHORT_SNAPSHOT_CACHE_SIZE')
+        if cache_size and key in snapshots:
+            return snapshots[key]
+        
         db_session = db.get_session()
         try:
-            user_id_projects = self.filter_wikiuser_query(
-                db_session.query(WikiUser.mediawiki_userid, WikiUser.project)
-            ).order_by(WikiUser.project).all()
+            # the default of 1024 bytes would truncate the user ids of most projects
+            db_session.execute(
+                'SET SESSION group_concat_max_len = {0}'.format(GROUP_CONCAT_MAX_LEN)
+            )
+            projects = self.filter_members(db_session.query(
+                WikiUser.project,
+                func.count(WikiUser.mediawiki_userid),
+                func.group_concat(WikiUser.mediawiki_userid),
+            ))\
+                .group_by(WikiUser.project)\
+                .order_by(WikiUser.project)
+            
+            groups = []
+            for project, count, packed in projects.all():
+                if packed and packed.count(',') + 1 == count:
+                    user_ids = array('l', map(int, packed.split(',')))
+                else:
+                    # truncated to group_concat_max_len, possibly in the middle of
+                    # a user id, so none of it is parsed and the project is read
+                    # row by row
+                    unpacked = self.filter_members(
+                        db_session.query(WikiUser.mediawiki_userid)
+                    ).filter(WikiUser.project == project)
+                    user_ids = array('l', (u for (u,) in stream(unpacked)))
+                groups.append((project, user_ids))
+            snapshot = CohortSnapshot(self.validated, self.default_project, groups)
         finally:
             db_session.close()
-        # TODO: push this logic into sqlalchemy.  The solution
-        # includes subquery(), but I can't seem to get anything working
-        groups = itertools.groupby(user_id_projects, key=itemgetter(1))
         
-        return (
-            (project or self.default_project, (r[0] for r in users))
-            for project, users in groups
-        )
+        if cache_size:
+            if len(snapshots) >= cache_size:
+                snapshots.clear()
+            snapshots[key] = snapshot
+        return snapshot
+    
+    def filter_members(self, wikiusers_query):
+        """
+        Parameters:
+            wikiusers_query : a sqlalchemy query object asking for one or more
+                                properties of WikiUser
+        
+        Return:
+            the query object passed in, restricted to the valid members of this
+            cohort that have a user id, whether or not the cohort is validated.
+            Members without a user id used to show up as None in metric results
+        """
+        return wikiusers_query\
+            .join(CohortWikiUser)\
+            .filter(CohortWikiUser.cohort_id == self.id)\
+            .filter(WikiUser.valid)\
+            .filter(WikiUser.mediawiki_userid != None)
     
     def filter_wikiuser_query(self, wikiusers_query):
         """
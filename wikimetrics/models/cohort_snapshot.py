@@ -0,0 +1,59 @@
+from array import array
+
+
+__all__ = ['CohortSnapshot']
+
+
+class CohortSnapshot(object):
+    """
+    The members of a cohort as they were at one moment, loaded with one query by
+    Cohort.snapshot.  It answers the same questions as the Cohort, its size, its
+    user ids and their grouping by project, without going back to the database,
+    so all the reports built for one run see the same users.
+    
+    The user ids of all the projects are kept in one array, ordered by project,
+    with the position where each project's user ids start, and group_by_project
+    hands out each project's user ids as an array, which MetricReport keeps as is.
+    """
+    
+    def __init__(self, validated, default_project, groups):
+        """
+        Parameters
+            validated       : whether the cohort was validated, the members of a
+                              cohort that is not are counted but not iterated
+            default_project : the project of members that have none
+            groups          : list of (project, user_ids) tuples, one per project,
+                              where user_ids is an array of the valid members'
+                              mediawiki user ids
+        """
+        self.validated = validated
+        self.default_project = default_project
+        self.user_ids = array('l')
+        self.projects = []
+        self.starts = []
+        for project, user_ids in groups:
+            self.projects.append(project)
+            self.starts.append(len(self.user_ids))
+            self.user_ids.extend(user_ids)
+    
+    def __len__(self):
+        return len(self.user_ids)
+    
+    def __iter__(self):
+        if not self.validated:
+            return iter([])
+        return iter(self.user_ids)
+    
+    def group_by_project(self):
+        """
+        Returns
+            iterable of tuples of the form (project, <iterable_of_user_ids>),
+            like Cohort.group_by_project
+        """
+        if not self.validated:
+            return iter([])
+        ends = self.starts[1:] + [len(self.user_ids)]
+        return (
+            (project or self.default_project, self.user_ids[start:end])
+            for project, start, end in zip(self.projects, self.starts, ends)
+        )
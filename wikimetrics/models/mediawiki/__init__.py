@@ -4,6 +4,8 @@ from revision import *
 from page import *
 from user import *
 from logging import *
+from bound_user_ids import *
+from stream import *
 
 # ignore flake8 because of F403 violation
 # flake8: noqa
@@ -0,0 +1,140 @@
+from sqlalchemy import Table, Column, Integer, MetaData, select
+from sqlalchemy.exc import SQLAlchemyError
+
+__all__ = ['BoundUserIds', 'in_user_ids']
+
+
+# temporary tables live in their own metadata so that create_all never makes them
+temporary_metadata = MetaData()
+TEMPORARY_TABLE_NAME = 'wikimetrics_user_ids'
+INSERT_BATCH_SIZE = 10000
+
+
+def temporary_table(name):
+    if name not in temporary_metadata.tables:
+        Table(
+            name,
+            temporary_metadata,
+            Column('user_id', Integer, primary_key=True, autoincrement=False),
+            prefixes=['TEMPORARY'],
+        )
+    return temporary_metadata.tables[name]
+
+
+class BoundUserIds(list):
+    """
+    A list of mediawiki user ids that is also loaded into a temporary table on the
+    connection of a mediawiki session.  Metrics that filter with in_user_ids then
+    join against that table instead of sending the whole list as an IN clause, and
+    the same table can serve any number of metrics that run on the session.
+    
+    MySQL does not allow a temporary table to be referenced twice in the same
+    statement, so queries that need the user ids in two places ask for a different
+    reference, which is a copy of the table made on the server.
+    
+    Use as a context manager, or call release when done, because temporary tables
+    stay around on pooled connections after the session is closed.
+    """
+    
+    def __init__(self, user_ids, session):
+        """
+        Parameters
+            user_ids    : the mediawiki user ids to bind
+            session     : sqlalchemy session open on a mediawiki database
+        """
+        super(BoundUserIds, self).__init__(user_ids)
+        self.session = session
+        self.tables = []
+        
+        table = self.create_table(0)
+        distinct_ids = list(set(u for u in self if u is not None))
+        for i in range(0, len(distinct_ids), INSERT_BATCH_SIZE):
+            session.execute(table.insert(), [
+                {'user_id': user_id}
+                for user_id in distinct_ids[i:i + INSERT_BATCH_SIZE]
+            ])
+    
+    @classmethod
+    def bind(cls, session, user_ids):
+        """
+        Tries to bind user_ids to session, falling back to the plain list of
+        user_ids when the database can not create temporary tables
+        
+        Returns
+            a BoundUserIds instance, or user_ids if binding failed
+        """
+        if session.bind.name != 'mysql':
+            return user_ids
+        try:
+            return cls(user_ids, session)
+        except SQLAlchemyError:
+            return user_ids
+    
+    def table(self, reference=0):
+        """
+        Parameters
+            reference   : which copy of the user id table to use, one per
+                          place in a statement that filters on the user ids
+        
+        Returns
+            the temporary sqlalchemy Table holding the user ids
+        """
+        while len(self.tables) <= reference:
+            copy = self.create_table(len(self.tables))
+            self.session.execute('INSERT INTO {0} SELECT user_id FROM {1}'.format(
+                copy.name, self.tables[0].name
+            ))
+        return self.tables[reference]
+    
+    def create_table(self, reference):
+        name = TEMPORARY_TABLE_NAME
+        if reference:
+            name = '{0}_{1}'.format(name, reference)
+        self.session.execute('DROP TEMPORARY TABLE IF EXISTS {0}'.format(name))
+        table = temporary_table(name)
+        table.create(bind=self.session.connection())
+        self.tables.append(table)
+        return table
+    
+    def filter(self, column, reference=0):
+        """
+        Returns
+            a clause restricting column to the bound user ids
+        """
+        return column.in_(select([self.table(reference).c.user_id]))
+    
+    def release(self):
+        """
+        Drops all the temporary tables created for these user ids
+        """
+        for table in self.tables:
+            self.session.execute('DROP TEMPORARY TABLE IF EXISTS {0}'.format(
+                table.name
+            ))
+        self.tables = []
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+
+def in_user_ids(column, user_ids, reference=0):
+    """
+    Restricts a column to a list of user ids, whether it's a plain list
+    or a BoundUserIds list
+    
+    Parameters
+        column      : the sqlalchemy column holding mediawiki user ids
+        user_ids    : list of mediawiki user ids, possibly a BoundUserIds instance
+        reference   : for BoundUserIds, which copy of the user id table to use.
+                      Each place a single statement filters on user ids should
+                      use a different reference
+    
+    Returns
+        a sqlalchemy clause that can be passed to query.filter
+    """
+    if isinstance(user_ids, BoundUserIds):
+        return user_ids.filter(column, reference)
+    return column.in_(user_ids)
@@ -1,8 +1,33 @@
 from sqlalchemy import TypeDecorator, Unicode, Interval
+from sqlalchemy.sql.expression import type_coerce
 from datetime import datetime
 from wikimetrics.utils import parse_date, format_date, UNICODE_NULL
 
-__all__ = ['MediawikiTimestamp']
+__all__ = ['MediawikiTimestamp', 'RawMediawikiTimestamp', 'raw_timestamp']
+
+
+# how many decoded timestamps each process remembers
+DECODED_TIMESTAMPS_SIZE = 100000
+decoded_timestamps = {}
+
+
+def decode_timestamp(value):
+    """
+    Parses a MediaWiki timestamp, remembering the datetimes of recent values,
+    because the same timestamps come back in many rows and many queries
+    
+    Parameters
+        value   : a 14 character MediaWiki timestamp
+    
+    Returns
+        the datetime of value
+    """
+    decoded = decoded_timestamps.get(value)
+    if decoded is None:
+        if len(decoded_timestamps) >= DECODED_TIMESTAMPS_SIZE:
+            decoded_timestamps.clear()
+        decoded = decoded_timestamps[value] = parse_date(value)
+    return decoded
 
 
 class MediawikiTimestamp(TypeDecorator):
@@ -34,4 +59,27 @@ class MediawikiTimestamp(TypeDecorator):
         """
         if not value or value == UNICODE_NULL * 14:
             return None
-        return parse_date(value)
+        return decode_timestamp(value)
+
+
+class RawMediawikiTimestamp(MediawikiTimestamp):
+    """
+    Reads MediaWiki timestamps as integers like 20130101000000, for metrics that
+    only compare timestamps or slice them by prefix, so no datetime is created
+    """
+    
+    def process_result_value(self, value, dialect=None):
+        if not value or value == UNICODE_NULL * 14:
+            return None
+        return int(value)
+
+
+def raw_timestamp(column):
+    """
+    Parameters
+        column  : a MediawikiTimestamp column, like Revision.rev_timestamp
+    
+    Returns
+        the column, to be selected as an integer instead of a datetime
+    """
+    return type_coerce(column, RawMediawikiTimestamp)
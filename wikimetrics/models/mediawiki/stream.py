@@ -0,0 +1,55 @@
+from MySQLdb.cursors import SSCursor
+from wikimetrics.configurables import db
+from wikimetrics.profiling import profile_streamed_query
+
+
+__all__ = ['stream']
+
+
+def stream(query):
+    """
+    Runs a query on an unbuffered server side cursor, so its rows are read from
+    MySQL a few at a time, instead of being fetched into memory before the first
+    row is processed.  Callers should fold rows into their own structures as
+    they arrive, and read all of them before running another query on the same
+    connection, because MySQL can not run a statement while another one is
+    still sending rows.
+    
+    SQLAlchemy only asks MySQLdb for a server side cursor from version 1.1, and
+    stream_results is ignored before that, so the cursor class of the session's
+    connection is switched to SSCursor while the query executes.
+    
+    Parameters
+        query   : a sqlalchemy query
+    
+    Returns
+        an iterator over the rows of the query, fetched QUERY_YIELD_PER at a time
+    """
+    query = query\
+        .yield_per(db.config.get('QUERY_YIELD_PER') or 1000)\
+        .execution_options(stream_results=True)
+    connection = query.session.connection()
+    dbapi_connection = connection.connection.connection
+    cursorclass = dbapi_connection.cursorclass
+    dbapi_connection.cursorclass = SSCursor
+    try:
+        rows = iter(query)
+    finally:
+        dbapi_connection.cursorclass = cursorclass
+    return streamed_rows(connection, rows)
+
+
+def streamed_rows(connection, rows):
+    """
+    Yields the rows of a streamed query, and adds the query to the active
+    Profile once they were all read, or the caller stopped reading them
+    """
+    count = 0
+    drained = False
+    try:
+        for row in rows:
+            count += 1
+            yield row
+        drained = True
+    finally:
+        profile_streamed_query(connection, count, drained)
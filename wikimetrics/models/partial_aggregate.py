@@ -0,0 +1,85 @@
+from sqlalchemy import Column, Integer, String, DateTime, Numeric, ForeignKey
+from sqlalchemy.schema import UniqueConstraint
+from wikimetrics.configurables import db
+
+__all__ = ['PartialAggregate']
+
+
+class PartialAggregate(db.WikimetricsBase):
+    """
+    Stores the count, sum and sum of squares of one submetric over a cohort,
+    for one time slice of a recurrent report.  Averages and standard deviations
+    can be computed from these, so new runs of the report only need to compute
+    the newest slices and merge them with what's stored here.
+    """
+    __tablename__ = 'report_partial_aggregate'
+    __table_args__ = (
+        UniqueConstraint('report_id', 'submetric', 'slice', name='uix_partial_aggregate'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    # the report that owns the series, the recurrent parent for scheduled runs
+    report_id = Column(Integer, ForeignKey('report.id'), nullable=False)
+    submetric = Column(String(255), nullable=False)
+    slice = Column(DateTime, nullable=False)
+    count = Column(Integer, nullable=False)
+    sum = Column(Numeric(40, 10), nullable=False)
+    sum_of_squares = Column(Numeric(40, 10), nullable=False)
+
+    @staticmethod
+    def replace(report_id, partials):
+        """
+        Stores partial aggregates for a report, replacing any stored
+        for the same submetric and slice
+
+        Parameters:
+            report_id   : the id of the PersistentReport that owns the series
+            partials    : dictionary of (submetric, slice) to (count, sum, sum_of_squares)
+        """
+        if not partials:
+            return
+
+        session = db.get_session()
+        try:
+            slices = set(s for submetric, s in partials.keys())
+            stored = session.query(PartialAggregate)\
+                .filter(PartialAggregate.report_id == report_id)\
+                .filter(PartialAggregate.slice.in_(slices))\
+                .all()
+            for partial in stored:
+                if (partial.submetric, partial.slice) in partials:
+                    session.delete(partial)
+            session.flush()
+
+            session.add_all([
+                PartialAggregate(
+                    report_id=report_id,
+                    submetric=submetric,
+                    slice=s,
+                    count=count,
+                    sum=total,
+                    sum_of_squares=sum_of_squares,
+                )
+                for (submetric, s), (count, total, sum_of_squares) in partials.items()
+            ])
+            session.commit()
+        finally:
+            session.close()
+
+    @staticmethod
+    def for_report(report_id):
+        """
+        Returns:
+            all the partial aggregates of a report, ordered by slice
+        """
+        session = db.get_session()
+        try:
+            return session.query(PartialAggregate)\
+                .filter(PartialAggregate.report_id == report_id)\
+                .order_by(PartialAggregate.slice)\
+                .all()
+        finally:
+            session.close()
+
+    def __repr__(self):
+        return '<PartialAggregate("{0}")>'.format(self.id)
@@ -1,5 +1,7 @@
 import celery
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, func, ForeignKey
+from sqlalchemy import (
+    Column, Integer, String, Text, DateTime, Boolean, func, ForeignKey
+)
 from sqlalchemy.orm import Session
 from sqlalchemy.schema import UniqueConstraint
 from sqlalchemy.sql.expression import and_
@@ -31,6 +33,10 @@ class PersistentReport(db.WikimetricsBase):
     public = Column(Boolean)
     recurrent = Column(Boolean, default=False, nullable=False)
     recurrent_parent_id = Column(Integer, ForeignKey('report.id'))
+    cache_hits = Column(Integer)
+    cache_misses = Column(Integer)
+    # json timings of the report's phases and queries, see wikimetrics.profiling
+    profile = Column(Text(length=2 ** 24 - 1))
 
     UniqueConstraint('recurrent_parent_id', 'created', name='uix_report')
 
@@ -3,6 +3,7 @@ from metric_report import *
 from multi_project_metric_report import *
 from report import *
 from run_report import *
+from status_journal import *
 
 # ignore flake8 because of F403 violation
 # flake8: noqa
@@ -1,11 +1,17 @@
 from math import sqrt
 from decimal import Decimal
-from collections import OrderedDict
+from collections import OrderedDict, Mapping
 from celery.utils.log import get_task_logger
 
-from wikimetrics.utils import stringify, CENSORED, r
+from wikimetrics.utils import (
+    stringify, CENSORED, r, parse_pretty_date, format_pretty_date,
+)
+from wikimetrics.metrics import TimeseriesMetric, TimeseriesChoices
+from ..partial_aggregate import PartialAggregate
 from report import ReportNode
 from multi_project_metric_report import MultiProjectMetricReport
+from vector_aggregation import vector_aggregation_available, aggregate_vectors
+from quantile_sketch import ResultSketches
 
 
 __all__ = ['AggregateReport', 'Aggregation']
@@ -18,34 +24,59 @@ class Aggregation(object):
     SUM = 'Sum'
     AVG = 'Average'
     STD = 'Standard Deviation'
+    MED = 'Median'
+    PERCENTILE = 'Percentile'
+    
+    @staticmethod
+    def percentile(percent):
+        """
+        Returns
+            the name of the aggregate for a percentile, like Percentile 90
+        """
+        return '{0} {1:g}'.format(Aggregation.PERCENTILE, percent)
 
 
 class AggregateReport(ReportNode):
     """
     Represents the output-shaping node that looks at a
     single metric's results over a cohort and returns any combination of:
-    
+        
         * individual results
         * a sum of the individual results
         * an average over the individual results
         * the standard deviation over the individual results
+        * the median and any percentiles of the individual results
     
     Whether or not to return these is controlled by parameters passed to the constructor.
+    
+    If series_id is set, the aggregates are computed incrementally: the count, sum and
+    sum of squares of each time slice are stored as PartialAggregate rows owned by the
+    report with that id, and the aggregates cover every slice stored so far.
+    Individual results still only cover the slices computed by this run.
+    The median and percentiles can't be computed from partial aggregates, so
+    they are left out of incremental results.  Otherwise, each MetricReport below
+    this report sketches the quantiles of its own results, and the sketches are
+    merged instead of going over the individual results again.
     """
     
     show_in_ui = False
+    # the id of the PersistentReport whose partial aggregates this report adds to
+    series_id = None
     
     def __init__(self, metric, cohort, options, *args, **kwargs):
         """
         Parameters:
             metric  : an instance of a Metric class
-            cohort  : a cohort fetched from the database
+            cohort  : a cohort fetched from the database, or a CohortSnapshot of it
             options : a dictionary including the following booleans:
                 individualResults
                 aggregateResults
                 aggregateSum
                 aggregateAverage
                 aggregateStandardDeviation
+                aggregateMedian
+              and optionally aggregatePercentiles, a list of percentiles
+              or a string of them separated by commas, like "90, 99"
         """
         super(AggregateReport, self).__init__(
             *args,
@@ -57,41 +88,145 @@ class AggregateReport(ReportNode):
         self.aggregate_sum = options.get('aggregateSum', True)
         self.aggregate_average = options.get('aggregateAverage', False)
         self.aggregate_std_deviation = options.get('aggregateStandardDeviation', False)
+        self.aggregate_median = options.get('aggregateMedian', False)
+        self.percentiles = parse_percentiles(options.get('aggregatePercentiles'))
         
         self.children = [MultiProjectMetricReport(cohort, metric, *args, **kwargs)]
+        if self.aggregate and self.quantile_names_and_fractions():
+            for report in self.children[0].tree():
+                report.sketch_quantiles = True
+    
+    @staticmethod
+    def can_be_incremental(metric):
+        """
+        Only hourly and daily timeseries can be aggregated incrementally, because
+        each of their slices is computed completely by a single daily run.
+        """
+        return isinstance(metric, TimeseriesMetric) and metric.timeseries.data in (
+            TimeseriesChoices.HOUR, TimeseriesChoices.DAY,
+        )
     
     def finish(self, child_results):
         aggregated_results = dict()
         task_logger.info(str(child_results))
         results_by_user = child_results[0]
         
-        if self.aggregate:
-            if self.aggregate_sum:
-                aggregated_results[Aggregation.SUM] = self.calculate(
-                    results_by_user,
-                    Aggregation.SUM
-                )
-            if self.aggregate_average:
-                aggregated_results[Aggregation.AVG] = self.calculate(
-                    results_by_user,
-                    Aggregation.AVG
-                )
-            if self.aggregate_std_deviation:
-                if Aggregation.AVG not in aggregated_results:
-                    average = self.calculate(results_by_user, Aggregation.AVG)
-                else:
-                    average = aggregated_results[Aggregation.AVG]
-                aggregated_results[Aggregation.STD] = self.calculate(
-                    results_by_user,
-                    Aggregation.STD,
-                    average=average
-                )
+        if self.aggregate and self.series_id is not None:
+            aggregated_results = self.calculate_incremental(results_by_user)
+        elif self.aggregate:
+            aggregated_results = self.calculate_all(results_by_user)
+            sketches = self.children[0].sketches
+            if sketches is None:
+                # the children were not run, like when finish is called directly
+                sketches = ResultSketches()
+                sketches.add_results(results_by_user)
+            aggregated_results.update(self.calculate_quantiles(sketches))
         
         if self.individual:
             aggregated_results[Aggregation.IND] = results_by_user
         
         return aggregated_results
     
+    def calculate_all(self, results_by_user):
+        """
+        Computes the requested aggregates, in a single pass over numpy arrays if
+        numpy is available, or else with one call to calculate per aggregate
+        
+        Returns
+            A dictionary of the requested aggregates
+        """
+        aggregated_results = dict()
+        if vector_aggregation_available():
+            try:
+                sums, averages, std_deviations = aggregate_vectors(
+                    results_by_user, want_std=self.aggregate_std_deviation
+                )
+                if self.aggregate_sum:
+                    aggregated_results[Aggregation.SUM] = sums
+                if self.aggregate_average:
+                    aggregated_results[Aggregation.AVG] = averages
+                if self.aggregate_std_deviation:
+                    aggregated_results[Aggregation.STD] = std_deviations
+                return aggregated_results
+            except ValueError, e:
+                task_logger.warn('Aggregating without numpy: {0}'.format(e))
+        
+        if self.aggregate_sum:
+            aggregated_results[Aggregation.SUM] = self.calculate(
+                results_by_user,
+                Aggregation.SUM
+            )
+        if self.aggregate_average:
+            aggregated_results[Aggregation.AVG] = self.calculate(
+                results_by_user,
+                Aggregation.AVG
+            )
+        if self.aggregate_std_deviation:
+            if Aggregation.AVG not in aggregated_results:
+                average = self.calculate(results_by_user, Aggregation.AVG)
+            else:
+                average = aggregated_results[Aggregation.AVG]
+            aggregated_results[Aggregation.STD] = self.calculate(
+                results_by_user,
+                Aggregation.STD,
+                average=average
+            )
+        
+        return aggregated_results
+    
+    def quantile_names_and_fractions(self):
+        """
+        Returns
+            a list of the name and fraction of each requested quantile aggregate
+        """
+        names_and_fractions = [
+            (Aggregation.percentile(percent), percent / 100.0)
+            for percent in self.percentiles
+        ]
+        if self.aggregate_median:
+            names_and_fractions.insert(0, (Aggregation.MED, 0.5))
+        return names_and_fractions
+    
+    def calculate_quantiles(self, sketches):
+        """
+        Computes the requested median and percentiles from the ResultSketches of
+        the results, which the MetricReports below this report build as they
+        finish and their MultiProjectMetricReport merges, so the values of a cell
+        are never all held in memory at once.  The median of an even number of
+        values is the average of the two in the middle, and percentiles are
+        interpolated the same way.
+        
+        Parameters
+            sketches    : the ResultSketches of the individual results
+        
+        Returns
+            A dictionary of the requested quantile aggregates, each shaped like
+            the individual results of a single user.  Cells without any values
+            are None
+        """
+        names_and_fractions = self.quantile_names_and_fractions()
+        if not names_and_fractions:
+            return dict()
+        
+        fractions = [fraction for name, fraction in names_and_fractions]
+        aggregated_results = dict(
+            (name, dict()) for name, fraction in names_and_fractions
+        )
+        for key, sketch in sketches.sketches.items():
+            if isinstance(sketch, Mapping):
+                for name, fraction in names_and_fractions:
+                    aggregated_results[name][key] = OrderedDict()
+                for subkey, subsketch in sketch.items():
+                    quantiles = subsketch.quantiles(fractions)
+                    for (name, fraction), quantile in zip(names_and_fractions, quantiles):
+                        aggregated_results[name][key][subkey] = round_quantile(quantile)
+            else:
+                quantiles = sketch.quantiles(fractions)
+                for (name, fraction), quantile in zip(names_and_fractions, quantiles):
+                    aggregated_results[name][key] = round_quantile(quantile)
+        
+        return aggregated_results
+    
     def calculate(self, results_by_user, type_of_aggregate, average=None):
         # TODO: terrible redo this
         """
@@ -121,7 +256,7 @@ class AggregateReport(ReportNode):
                     or results_by_user[user_id][CENSORED] != 1
                 
                 # handle timeseries aggregation
-                if isinstance(value, dict):
+                if isinstance(value, Mapping):
                     if key not in aggregation:
                         aggregation[key] = OrderedDict()
                         helper[key] = dict()
@@ -187,6 +322,74 @@ class AggregateReport(ReportNode):
         
         return aggregation
     
+    def calculate_incremental(self, results_by_user):
+        """
+        Stores the partial aggregates of results_by_user and computes the requested
+        aggregates over all the partial aggregates stored for self.series_id
+        
+        Parameters
+            results_by_user : timeseries results of this run, by user
+        
+        Returns
+            A dictionary of the requested aggregates, each of the form
+            {submetric: {slice: value}}
+        """
+        PartialAggregate.replace(self.series_id, self.partial_aggregates(results_by_user))
+        
+        aggregated_results = dict()
+        for partial in PartialAggregate.for_report(self.series_id):
+            s = format_pretty_date(partial.slice)
+            count = Decimal(partial.count or 0)
+            # the mean is only rounded for output: squaring a rounded mean is off by
+            # up to its rounding error times twice the mean, which swamps the
+            # variance of large values that are close to each other
+            average = Decimal(partial.sum) / count if count else Decimal(0)
+            values = dict()
+            if self.aggregate_sum:
+                values[Aggregation.SUM] = r(partial.sum)
+            if self.aggregate_average:
+                values[Aggregation.AVG] = r(average)
+            if self.aggregate_std_deviation:
+                variance = Decimal(0)
+                if count:
+                    variance = Decimal(partial.sum_of_squares) / count\
+                        - average * average
+                values[Aggregation.STD] = r(max(variance, Decimal(0)).sqrt())
+            
+            for aggregate, value in values.items():
+                aggregation = aggregated_results.setdefault(aggregate, dict())
+                aggregation.setdefault(partial.submetric, OrderedDict())[s] = value
+        
+        return aggregated_results
+    
+    def partial_aggregates(self, results_by_user):
+        """
+        Parameters
+            results_by_user : timeseries results by user
+        
+        Returns
+            dictionary of (submetric, slice) to (count, sum, sum of squares),
+            ignoring censored and missing values like calculate does
+        """
+        helper = dict()
+        for user_id, results in results_by_user.items():
+            value_is_not_censored = results.get(CENSORED) != 1
+            for key, value in results.items():
+                if key == CENSORED or not isinstance(value, Mapping):
+                    continue
+                
+                for subkey, subvalue in value.items():
+                    partial = helper.setdefault(
+                        (key, parse_pretty_date(subkey)),
+                        [0, Decimal(0), Decimal(0)],
+                    )
+                    if value_is_not_censored and subvalue is not None:
+                        partial[0] += 1
+                        partial[1] += Decimal(subvalue)
+                        partial[2] += Decimal(subvalue) * Decimal(subvalue)
+        
+        return {key: tuple(partial) for key, partial in helper.items()}
+    
     def __repr__(self):
         return '<AggregateReport("{0}")>'.format(self.persistent_id)
 
@@ -196,3 +399,37 @@ def safe_average(cummulative_sum, count):
         return r(cummulative_sum / count)
     else:
         return 0
+
+
+def round_quantile(quantile):
+    if quantile is None:
+        return None
+    return r(quantile)
+
+
+def parse_percentiles(percentiles):
+    """
+    Parameters
+        percentiles : a list of percentiles, or a string of them separated by
+                      commas, or None
+    
+    Returns
+        a sorted list of the distinct percentiles strictly between 0 and 100,
+        leaving out anything else with a warning
+    """
+    if not percentiles:
+        return []
+    if isinstance(percentiles, basestring):
+        percentiles = percentiles.split(',')
+    
+    parsed = set()
+    for percent in percentiles:
+        try:
+            percent = float(percent)
+        except (TypeError, ValueError):
+            percent = None
+        if percent is None or not 0 < percent < 100:
+            task_logger.warn('Ignoring invalid percentile: {0}'.format(percent))
+            continue
+        parsed.add(percent)
+    return sorted(parsed)
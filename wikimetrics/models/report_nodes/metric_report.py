@@ -1,5 +1,11 @@
-from wikimetrics.configurables import db
+from array import array
+from functools import partial
+from wikimetrics.configurables import db, queue
+from wikimetrics.api import get_metric_cache
+from wikimetrics.models.mediawiki import BoundUserIds
+from wikimetrics.profiling import Profile
 from report import ReportLeaf
+from quantile_sketch import ResultSketches
 
 
 __all__ = ['MetricReport']
@@ -10,21 +16,171 @@ class MetricReport(ReportLeaf):
     Report type responsbile for running a single metric on a project-
     homogenous list of user_ids.  Like all reports, the database session
     is constructed within MetricReport.run()
+    
+    Large lists of user_ids are split into chunks of at most chunk_size users,
+    and the metric runs once per chunk, so no single query has to deal with the
+    whole cohort.  The per-user results of each chunk are merged as they come in.
+    
+    If METRIC_CACHE is configured, users whose results are already cached for the
+    same metric parameters are not sent to the database at all.
+    
+    Each run is profiled: the queries the metric runs, with their durations and
+    row counts, the time spent in the metric and in the cache, and the phases the
+    metric times itself, like normalizing timeseries.
+    
+    If sketch_quantiles is set, the results are also added to a ResultSketches,
+    which the AggregateReport above merges to compute medians and percentiles.
     """
     
     def __init__(self, metric, user_ids, project, *args, **kwargs):
+        """
+        Parameters:
+            metric      : an instance of a Metric class
+            user_ids    : the mediawiki user ids to run the metric on
+            project     : the mediawiki project the user ids belong to
+            chunk_size  : optional keyword argument, the largest number of user ids
+                          to pass to the metric at once.  Defaults to
+                          METRIC_REPORT_CHUNK_SIZE, and 0 means no chunking
+        """
+        self.chunk_size = kwargs.pop('chunk_size', None)
         super(MetricReport, self).__init__(*args, **kwargs)
         self.metric = metric
-        self.user_ids = list(user_ids)
+        # arrays, like the ones a CohortSnapshot groups by project, are not copied
+        if not isinstance(user_ids, array):
+            user_ids = list(user_ids)
+        self.user_ids = user_ids
         self.project = project
-
+    
     def run(self):
+        self.profile = Profile(repr(self))
+        try:
+            result = self.run_cached()
+            if self.sketch_quantiles:
+                with self.profile.phase('sketch'):
+                    self.sketches = ResultSketches()
+                    self.sketches.add_results(result)
+            return result
+        finally:
+            # in a tree, the profile is stored by the root
+            if self.journal is None:
+                self.write_profile()
+    
+    def run_cached(self):
+        """
+        Runs the metric on the users whose results are not in the METRIC_CACHE
+        
+        Returns:
+            the metric results for all of self.user_ids
+        """
+        cache = get_metric_cache(queue.conf)
+        if not cache or not cache.cacheable(self.metric):
+            return self.run_users(self.user_ids)
+        
+        with self.profile.phase('cache'):
+            result = cache.get_many(self.project, self.metric, self.user_ids)
+        misses = [user_id for user_id in self.user_ids if user_id not in result]
+        self.write(cache_hits=len(result), cache_misses=len(misses))
+        if misses:
+            computed = self.run_users(misses)
+            with self.profile.phase('cache'):
+                cache.set_many(self.project, self.metric, computed)
+            result.update(computed)
+        return result
+    
+    def run_users(self, user_ids):
+        """
+        Runs the metric on user_ids, in chunks
+        
+        Parameters:
+            user_ids    : a non-empty list of user ids
+        
+        Returns:
+            the metric results for all the users
+        """
+        chunks = self.chunks(user_ids)
+        threads = queue.conf.get('METRIC_REPORT_CHUNK_THREADS')
+        if len(chunks) > 1 and threads > 1:
+            chunk_results = db.run_by_host(
+                [(self.project, partial(self.run_chunks, [c])) for c in chunks],
+                threads,
+            )
+            result = {}
+            for chunk_result in chunk_results:
+                result.update(chunk_result)
+            return result
+        
+        return self.run_chunks(chunks)
+    
+    def run_chunks(self, chunks):
+        """
+        Runs the metric on each chunk of user ids, one after the other,
+        using a single database session
+        
+        Parameters:
+            chunks  : a non-empty list of lists of user ids
+        
+        Returns:
+            the metric results for all the users in all the chunks
+        """
         session = db.get_mw_session(self.project)
         try:
-            result = self.metric(self.user_ids, session)
+            result = None
+            for chunk in chunks:
+                with self.profile.active(), self.profile.phase('metric'):
+                    user_ids = self.bind_user_ids(session, chunk)
+                    try:
+                        chunk_result = self.metric(user_ids, session)
+                    finally:
+                        if isinstance(user_ids, BoundUserIds):
+                            user_ids.release()
+                
+                if result is None:
+                    result = chunk_result
+                else:
+                    result.update(chunk_result)
             return result
         finally:
             session.close()
     
+    def bind_user_ids(self, session, user_ids):
+        """
+        Loads user_ids into a temporary table on the session's connection if
+        there are at least COHORT_TABLE_MIN_SIZE of them, so the metric queries
+        join against the table instead of carrying a long IN list
+        
+        Parameters:
+            session     : the mediawiki session the metric will run on
+            user_ids    : a chunk of user ids
+        
+        Returns:
+            a BoundUserIds instance, or user_ids if they were not bound
+        """
+        min_size = db.config.get('COHORT_TABLE_MIN_SIZE')
+        if not min_size or len(user_ids) < min_size:
+            return user_ids
+        return BoundUserIds.bind(session, user_ids)
+    
+    def chunks(self, user_ids=None):
+        """
+        Parameters:
+            user_ids    : the user ids to split, defaults to self.user_ids
+        
+        Returns:
+            user_ids split into lists of at most chunk_size user ids
+        """
+        if user_ids is None:
+            user_ids = self.user_ids
+        chunk_size = self.chunk_size
+        if chunk_size is None:
+            chunk_size = queue.conf.get('METRIC_REPORT_CHUNK_SIZE')
+        
+        if not chunk_size or len(user_ids) <= chunk_size:
+            return [user_ids]
+        
+        return [
+            user_ids[i:i + chunk_size]
+            for i in range(0, len(user_ids), chunk_size)
+        ]
+    
     def __repr__(self):
         return '<MetricReport("{0}")>'.format(self.persistent_id)
@@ -1,6 +1,7 @@
 from celery.utils.log import get_task_logger
 from report import ReportNode
 from metric_report import MetricReport
+from quantile_sketch import ResultSketches
 
 
 __all__ = ['MultiProjectMetricReport']
@@ -13,9 +14,12 @@ class MultiProjectMetricReport(ReportNode):
     A node responsbile for running a single metric on a potentially
     project-heterogenous cohort. This just abstracts away the task
     of grouping the cohort by project and calling a MetricReport on
-    each project-homogenous list of user_ids.
+    each project-homogenous list of user_ids.  If REPORT_CHILDREN_PER_HOST
+    is configured, the MetricReports run concurrently.  If sketch_quantiles is
+    set, the ResultSketches of the MetricReports are merged into sketches.
     """
     show_in_ui = False
+    run_children_concurrently = True
     
     def __init__(self, cohort, metric, *args, **kwargs):
         super(MultiProjectMetricReport, self).__init__(
@@ -36,6 +40,12 @@ class MultiProjectMetricReport(ReportNode):
         for res in metric_results:
             merged_individual_results.update(res)
         
+        if self.sketch_quantiles:
+            self.sketches = ResultSketches()
+            for child in self.children:
+                if child.sketches is not None:
+                    self.sketches.merge(child.sketches)
+        
         return merged_individual_results
     
     def __repr__(self):
@@ -0,0 +1,212 @@
+from math import ceil
+from decimal import Decimal
+from collections import OrderedDict, Mapping
+from wikimetrics.utils import CENSORED
+
+
+__all__ = ['QuantileSketch', 'ResultSketches']
+
+
+class QuantileSketch(object):
+    """
+    Estimates quantiles of a stream of values in bounded memory, following the
+    KLL sketch (Karnin, Lang, Liberty 2016).  Values are kept in a stack of
+    compactors, where each value kept at level h stands for 2 ** h values of
+    the stream.  When a level fills up it is sorted and every other value is
+    promoted to the level above, so the sketch keeps O(k log(n / k)) values and
+    its rank error is about 1 / k with high probability.
+
+    Compactions alternate between keeping the odd and the even values of each
+    level instead of choosing at random, so the same stream always gives the
+    same answers.  Two sketches built with the same k can be merged, which gives
+    the same guarantees as a single sketch over both streams.
+
+    As long as fewer than k values were added, nothing is compacted and the
+    quantiles are exact.
+    """
+
+    # each level is this much smaller than the one above it
+    SHRINK = 2.0 / 3.0
+    MIN_CAPACITY = 2
+
+    def __init__(self, k=200):
+        """
+        Parameters
+            k   : the capacity of the top level, larger is more accurate
+        """
+        self.k = k
+        self.count = 0
+        self.compactors = [[]]
+        self.offsets = [0]
+
+    def __len__(self):
+        return self.count
+
+    def capacity(self, level):
+        depth = len(self.compactors) - level - 1
+        return max(int(ceil(self.k * self.SHRINK ** depth)), self.MIN_CAPACITY)
+
+    def size(self):
+        return sum(len(compactor) for compactor in self.compactors)
+
+    def max_size(self):
+        return sum(self.capacity(level) for level in range(len(self.compactors)))
+
+    def add(self, value):
+        """
+        Parameters
+            value   : a number to add to the stream, None is ignored
+        """
+        if value is None:
+            return
+        self.compactors[0].append(value)
+        self.count += 1
+        if len(self.compactors[0]) >= self.capacity(0):
+            self.compress()
+
+    def merge(self, other):
+        """
+        Adds all the values seen by another sketch to this one
+
+        Parameters
+            other   : a QuantileSketch with the same k
+        """
+        while len(self.compactors) < len(other.compactors):
+            self.grow()
+        for level, compactor in enumerate(other.compactors):
+            self.compactors[level].extend(compactor)
+        self.count += other.count
+        self.compress()
+
+    def grow(self):
+        self.compactors.append([])
+        self.offsets.append(0)
+
+    def compress(self):
+        while self.size() >= self.max_size():
+            for level, compactor in enumerate(self.compactors):
+                if len(compactor) >= self.capacity(level):
+                    if level + 1 == len(self.compactors):
+                        self.grow()
+                    self.compact(level)
+                    break
+
+    def compact(self, level):
+        compactor = sorted(self.compactors[level])
+        # an odd value out stays at this level, the rest are halved
+        leftover = compactor[len(compactor) - len(compactor) % 2:]
+        compactor = compactor[:len(compactor) - len(leftover)]
+
+        offset = self.offsets[level]
+        self.offsets[level] = 1 - offset
+        self.compactors[level + 1].extend(compactor[offset::2])
+        self.compactors[level] = leftover
+
+    def weighted_values(self):
+        """
+        Returns
+            the values kept, sorted, each paired with how many values it stands for
+        """
+        return sorted(
+            (value, 2 ** level)
+            for level, compactor in enumerate(self.compactors)
+            for value in compactor
+        )
+
+    def quantiles(self, fractions):
+        """
+        Parameters
+            fractions   : list of fractions between 0 and 1, like 0.5 for the median
+
+        Returns
+            a list with the estimated value at each fraction, or None for each
+            fraction if no values were added.  Like numpy's default percentile,
+            the value at fraction f of n values is at rank f * (n - 1), and
+            interpolated linearly between the values on either side of it when
+            that rank is not whole, so the median of [1, 2, 3, 4] is 2.5.
+            Interpolated values are Decimals
+        """
+        weighted = self.weighted_values()
+        if not weighted:
+            return [None for fraction in fractions]
+
+        total = sum(weight for value, weight in weighted)
+        results = []
+        for fraction in fractions:
+            rank = Decimal(repr(fraction)) * (total - 1)
+            lower_rank = int(rank)
+            lower = self.value_at(weighted, lower_rank)
+            if rank == lower_rank:
+                results.append(lower)
+                continue
+            upper = self.value_at(weighted, lower_rank + 1)
+            if upper == lower:
+                results.append(lower)
+                continue
+            results.append(
+                Decimal(lower) + (Decimal(upper) - Decimal(lower)) * (rank - lower_rank)
+            )
+        return results
+
+    def value_at(self, weighted, rank):
+        """
+        Returns
+            the value at a 0 based rank of the stream, from its weighted_values
+        """
+        cumulative = 0
+        for value, weight in weighted:
+            cumulative += weight
+            if cumulative > rank:
+                return value
+        return weighted[-1][0]
+
+    def quantile(self, fraction):
+        return self.quantiles([fraction])[0]
+
+
+class ResultSketches(object):
+    """
+    A QuantileSketch of each submetric of a report's results by user, or of each
+    submetric and time slice of timeseries results.  Censored and missing values
+    are left out.  The ResultSketches of reports that ran on different users can
+    be merged, so the quantiles over a whole cohort don't need another pass over
+    the results of all its users.
+    """
+
+    def __init__(self):
+        # submetric to a QuantileSketch, or to an OrderedDict of time slice to one
+        self.sketches = OrderedDict()
+
+    def add_results(self, results_by_user):
+        """
+        Parameters
+            results_by_user : the results of a metric, by user
+        """
+        for user_id, results in results_by_user.items():
+            value_is_not_censored = results.get(CENSORED) != 1
+            for key, value in results.items():
+                if key == CENSORED:
+                    continue
+
+                if isinstance(value, Mapping):
+                    cells = self.sketches.setdefault(key, OrderedDict())
+                    for subkey, subvalue in value.items():
+                        sketch = cells.setdefault(subkey, QuantileSketch())
+                        if value_is_not_censored:
+                            sketch.add(subvalue)
+                else:
+                    sketch = self.sketches.setdefault(key, QuantileSketch())
+                    if value_is_not_censored:
+                        sketch.add(value)
+
+    def merge(self, other):
+        """
+        Adds the sketches of another ResultSketches to these
+        """
+        for key, sketch in other.sketches.items():
+            if isinstance(sketch, Mapping):
+                cells = self.sketches.setdefault(key, OrderedDict())
+                for subkey, subsketch in sketch.items():
+                    cells.setdefault(subkey, QuantileSketch()).merge(subsketch)
+            else:
+                self.sketches.setdefault(key, QuantileSketch()).merge(sketch)
@@ -1,7 +1,9 @@
+import json
 import celery
 from uuid import uuid4
 from celery import current_task
 from datetime import datetime
+from multiprocessing import TimeoutError
 # AsyncResult shows up as un-needed but actually is (for celery.states to work)
 from celery.result import AsyncResult
 from celery.exceptions import SoftTimeLimitExceeded
@@ -10,8 +12,10 @@ from celery.utils.log import get_task_logger
 # from celery.contrib.methods import task_method
 from flask.ext.login import current_user
 from wikimetrics.configurables import db, queue
-from wikimetrics.utils import stringify
+from wikimetrics.utils import stringify, BetterEncoder
+from wikimetrics.profiling import Profile
 from ..persistent_report import PersistentReport
+from status_journal import StatusJournal
 
 
 __all__ = [
@@ -55,6 +59,15 @@ class Report(object):
     
     show_in_ui = False
     task = queue_task
+    # the mediawiki project this report queries, if it queries only one
+    project = None
+    # the StatusJournal buffering database changes while this report's tree runs
+    journal = None
+    # the Profile of this report's last run
+    profile = None
+    # when True, the report keeps a ResultSketches of its results in sketches
+    sketch_quantiles = False
+    sketches = None
     
     def __init__(self,
                  user_id=None,
@@ -66,7 +79,14 @@ class Report(object):
                  parameters={},
                  recurrent=False,
                  recurrent_parent_id=None,
-                 created=None):
+                 created=None,
+                 store=True):
+        """
+        Parameters
+            store   : if False, the PersistentReport for this report is only built
+                      in memory, and persistent_id stays None until store is called
+                      on this report or on one of its ancestors
+        """
         
         if children is None:
             children = []
@@ -86,7 +106,7 @@ class Report(object):
         self.children = children
         self.public = public
         
-        # store report to database
+        # build the database row for this report
         # note that queue_result_key is always empty at this stage
         pj = PersistentReport(user_id=self.user_id,
                               status=self.status,
@@ -96,36 +116,83 @@ class Report(object):
                               recurrent=recurrent,
                               recurrent_parent_id=recurrent_parent_id,
                               created=created or datetime.now())
+        self.persistent_id = None
+        self.created = pj.created
+        self.unstored_report = pj
+        if store:
+            self.store()
+    
+    def tree(self):
+        """
+        Returns
+            a list with this report and all the reports below it
+        """
+        reports = [self]
+        for child in self.children:
+            reports.extend(child.tree())
+        return reports
+    
+    def store(self):
+        """
+        Inserts the PersistentReport rows of this report and of all the reports
+        below it that have not been stored yet, in a single transaction.
+        Names default to str(report), so they are set once the ids are known.
+        """
+        reports = [r for r in self.tree() if r.persistent_id is None]
+        if not reports:
+            return
+        
         session = db.get_session()
         try:
-            session.add(pj)
-            session.commit()
-            self.persistent_id = pj.id
-            self.created = pj.created
-            pj.name = self.name or str(self)
+            session.add_all([r.unstored_report for r in reports])
+            session.flush()
+            for report in reports:
+                pj = report.unstored_report
+                report.persistent_id = pj.id
+                report.created = pj.created
+                pj.name = report.name or str(report)
             session.commit()
         finally:
             session.close()
+        
+        for report in reports:
+            del report.unstored_report
     
     def __repr__(self):
         return '<Report("{0}")>'.format(self.persistent_id)
     
-    # TODO if this function needs to use the db session it should be passed on
-    # on method params not retrieved from a singleton
     def set_status(self, status, task_id=None):
         """
         helper function for updating database status after celery
-        task has been started
+        task has been started.  Failures are written right away, other
+        statuses may wait in the journal until the tree flushes it
         """
-        session = db.get_session()
-        try:
-            pj = session.query(PersistentReport).get(self.persistent_id)
-            pj.status = status
-            if task_id:
-                pj.queue_result_key = task_id
-            session.commit()
-        finally:
-            session.close()
+        values = {'status': status}
+        if task_id:
+            values['queue_result_key'] = task_id
+        self.write(flush=(status == celery.states.FAILURE), **values)
+    
+    def write(self, flush=False, **values):
+        """
+        Changes columns of this report's PersistentReport row.  If the report is
+        running as part of a tree, the change goes through the tree's journal.
+        
+        Parameters
+            flush   : write the change and anything else pending in the journal now
+            values  : new values keyed by PersistentReport column name
+        """
+        journal = self.journal or StatusJournal()
+        journal.record(self.persistent_id, **values)
+        if flush or journal is not self.journal:
+            journal.flush()
+    
+    def write_profile(self):
+        """
+        Stores the profile of this report's run, with the profiles of the reports
+        below it, if PROFILE_REPORTS is configured
+        """
+        if self.profile is not None and queue.conf.get('PROFILE_REPORTS'):
+            self.write(profile=json.dumps(self.profile.as_dict(), cls=BetterEncoder))
     
     def run(self):
         """
@@ -136,6 +203,10 @@ class Report(object):
 
 class ReportNode(Report):
     
+    # when True, and REPORT_CHILDREN_PER_HOST is configured, the ReportLeaf children
+    # of this node run on a thread pool instead of one after the other
+    run_children_concurrently = False
+    
     def run(self):
         """
         This specialized version of run first runs all the children, then
@@ -146,23 +217,91 @@ class ReportNode(Report):
         So now this just runs all the children's run methods, collects the results,
         and passes them to the finish method.  Deadlocking and celery worker starvation
         are *much* less likely now.  Thank you Ori :)
+        
+        The node at the root of the tree shares a StatusJournal with all the reports
+        below it, and flushes it when it starts and when it's done, so the status
+        changes of the rest of the tree are written together.
+        
+        Running the children and finishing are timed as phases of this node's
+        Profile, and the root stores the profiles of the whole tree when it's done.
         """
-        self.set_status(celery.states.STARTED, task_id=current_task.request.id)
-        results = []
+        is_root = self.journal is None
+        if is_root:
+            journal = StatusJournal()
+            for report in self.tree():
+                report.journal = journal
+        self.profile = Profile(repr(self))
         
-        if self.children:
-            try:
-                child_results = [child.run() for child in self.children]
-                results = self.finish(child_results)
-            except SoftTimeLimitExceeded:
-                self.set_status(celery.states.FAILURE)
-                task_logger.error('timeout exceeded for {0}'.format(
-                    current_task.request.id
-                ))
-                raise
-        
-        self.set_status(celery.states.SUCCESS)
-        return results
+        try:
+            self.set_status(celery.states.STARTED, task_id=current_task.request.id)
+            if is_root:
+                self.journal.flush()
+            results = []
+            
+            if self.children:
+                try:
+                    with self.profile.phase('children'):
+                        child_results = self.run_children()
+                    with self.profile.active(), self.profile.phase('finish'):
+                        results = self.finish(child_results)
+                except SoftTimeLimitExceeded:
+                    self.set_status(celery.states.FAILURE)
+                    task_logger.error('timeout exceeded for {0}'.format(
+                        current_task.request.id
+                    ))
+                    raise
+            
+            self.set_status(celery.states.SUCCESS)
+            return results
+        finally:
+            self.profile.children = [
+                child.profile for child in self.children if child.profile is not None
+            ]
+            if is_root:
+                # the profiles of the whole tree are stored with the root
+                self.write_profile()
+                self.journal.flush()
+                for report in self.tree():
+                    report.journal = None
+    
+    def run_children(self):
+        """
+        Runs all the children of this node and collects their results.
+        If this node runs its children concurrently, ReportLeaf children run on a
+        thread pool that lets at most REPORT_CHILDREN_PER_HOST of them query the same
+        database host at once, and that gives up after CELERYD_TASK_SOFT_TIME_LIMIT.
+        ReportNode children always run on this thread, because they need current_task.
+        
+        Returns
+            a list with the result of each child, in the same order as self.children
+        
+        Raises
+            SoftTimeLimitExceeded if concurrent children do not finish in time
+        """
+        threads_per_host = queue.conf.get('REPORT_CHILDREN_PER_HOST')
+        if not self.run_children_concurrently or not threads_per_host:
+            return [child.run() for child in self.children]
+        
+        leaves = [
+            (index, child) for index, child in enumerate(self.children)
+            if isinstance(child, ReportLeaf)
+        ]
+        try:
+            leaf_results = db.run_by_host(
+                [(child.project, child.run) for index, child in leaves],
+                threads_per_host,
+                timeout=queue.conf.get('CELERYD_TASK_SOFT_TIME_LIMIT'),
+            )
+        except TimeoutError:
+            raise SoftTimeLimitExceeded()
+        
+        child_results = [None] * len(self.children)
+        for (index, child), result in zip(leaves, leaf_results):
+            child_results[index] = result
+        for index, child in enumerate(self.children):
+            if not isinstance(child, ReportLeaf):
+                child_results[index] = child.run()
+        return child_results
     
     def finish(self, results):
         """
@@ -192,14 +331,7 @@ class ReportNode(Report):
             child_results = []
         
         self.result_key = str(uuid4())
-        db_session = db.get_session()
-        try:
-            pj = db_session.query(PersistentReport).get(self.persistent_id)
-            pj.result_key = self.result_key
-            db_session.add(pj)
-            db_session.commit()
-        finally:
-            db_session.close()
+        self.write(result_key=self.result_key)
         
         merged = {self.result_key: results}
         for child_result in child_results:
@@ -4,24 +4,64 @@ from celery.utils.log import get_task_logger
 from copy import deepcopy
 from sqlalchemy.orm.exc import NoResultFound
 from datetime import timedelta
+from collections import OrderedDict
+from celery import current_task
+from celery.exceptions import SoftTimeLimitExceeded
 
-from wikimetrics.configurables import db
+from wikimetrics.configurables import db, queue
+from wikimetrics.api import ReportResultStore
 from wikimetrics.models.cohort import Cohort
 from wikimetrics.models.persistent_report import PersistentReport
-from wikimetrics.metrics import metric_classes, TimeseriesChoices
+from wikimetrics.metrics import metric_classes, TimeseriesChoices, FusedRevisionScan
 from wikimetrics.utils import (
     diff_datewise, timestamps_to_now, strip_time, to_datetime, thirty_days_ago,
 )
 from report import ReportNode
-from aggregate_report import AggregateReport
+from aggregate_report import AggregateReport, Aggregation
 from validate_report import ValidateReport
 from metric_report import MetricReport
 
 
-__all__ = ['RunReport']
+__all__ = ['RunReport', 'queue_run_reports']
 task_logger = get_task_logger(__name__)
 
 
+@queue.task()
+def queue_run_reports(reports):
+    """
+    Runs several reports in one task, so they can share the work that
+    RunReport.fuse set up between them.  A report that fails is marked as
+    failed without stopping the others.  If the task runs out of time, the
+    report that was running and all the ones after it are marked as failed.
+    
+    Parameters
+        reports : list of RunReport instances
+    
+    Returns
+        the results of all the reports that finished, merged into one
+        dictionary keyed by their result_key
+    """
+    task_logger.info('running {0} on celery as {1}'.format(
+        reports,
+        current_task.request.id,
+    ))
+    results = {}
+    for position, report in enumerate(reports):
+        try:
+            results.update(report.run())
+        except SoftTimeLimitExceeded:
+            # this report and the ones not started yet would stay pending forever
+            for unfinished in reports[position:]:
+                unfinished.set_status(
+                    celery.states.FAILURE, task_id=current_task.request.id
+                )
+            raise
+        except Exception, e:
+            task_logger.error('Problem running {0}: {1}'.format(report, e))
+            report.set_status(celery.states.FAILURE, task_id=current_task.request.id)
+    return results
+
+
 class RunReport(ReportNode):
     """
     Represents a batch of cohort-metric reports created by the
@@ -41,6 +81,9 @@ class RunReport(ReportNode):
                 metric          : dictionary defining the metric, has keys:
                     name        : the name of the python class to instantiate
                 recurrent       : whether to rerun this daily
+                incremental     : whether daily reruns of an hourly or daily
+                                  timeseries should add to the aggregates of
+                                  earlier runs instead of starting over
                 public          : whether to expose results publicly
             user_id             : the user wishing to run this report
             recurrent_parent_id : the parent PersistentReport.id for a recurrent run
@@ -57,11 +100,15 @@ class RunReport(ReportNode):
         finally:
             session.close()
         
-        parameters['cohort']['size'] = len(cohort)
+        # the members are loaded once, and every report below sees the same ones
+        snapshot = cohort.snapshot()
+        parameters['cohort']['size'] = len(snapshot)
         
         # construct metric
         metric_dict = parameters['metric']
         metric = metric_classes[metric_dict['name']](**metric_dict)
+        self.metric = metric
+        self.cohort_id = cohort.id
         
         # if this is a recurrent run, don't show it in the UI
         if recurrent_parent_id is not None:
@@ -75,25 +122,74 @@ class RunReport(ReportNode):
             recurrent=parameters.get('recurrent', False),
             recurrent_parent_id=recurrent_parent_id,
             created=created,
+            store=False,
         )
         
+        # the whole tree is built in memory and stored in one transaction below
         validate_report = ValidateReport(
-            metric, cohort, recurrent_parent_id is None, user_id=user_id
+            metric, cohort, recurrent_parent_id is None, user_id=user_id, store=False
         )
         if validate_report.valid():
             self.children = [AggregateReport(
-                metric, cohort, metric_dict, parameters=parameters, user_id=user_id
+                metric, snapshot, metric_dict,
+                parameters=parameters, user_id=user_id, store=False
             )]
         else:
             self.children = [validate_report]
+        
+        self.store()
+        
+        incremental = parameters.get('incremental') and (
+            parameters.get('recurrent') or recurrent_parent_id is not None
+        )
+        if incremental and validate_report.valid():
+            if AggregateReport.can_be_incremental(metric):
+                # the partial aggregates of the whole series belong to the parent
+                self.children[0].series_id = recurrent_parent_id or self.persistent_id
     
     def finish(self, aggregated_results):
         result = self.report_result(aggregated_results[0])
+        try:
+            ReportResultStore(
+                queue.conf.get('RESULT_STORE_DIRECTORY'), Aggregation.IND
+            ).write(self.result_key, aggregated_results[0])
+        except (IOError, OSError), e:
+            # the result is still available from celery until it expires
+            task_logger.error('Could not store result of {0}: {1}'.format(self, e))
         return result
     
     def __repr__(self):
         return '<RunReport("{0}")>'.format(self.persistent_id)
     
+    @classmethod
+    def fuse(cls, reports):
+        """
+        Lets the reports on the same cohort whose metrics read the same revisions
+        share one FusedRevisionScan, see wikimetrics.metrics.fused_revision_scan.
+        Reports that share a scan have to run in the same task, with
+        queue_run_reports, because the scan lives in that task's memory.
+        
+        Parameters
+            reports : list of RunReport instances from the same request
+        
+        Returns
+            the reports as a list of lists, each list holding either one report
+            or all the reports that share a scan, in the order they were passed
+        """
+        by_cohort = OrderedDict()
+        for report in reports:
+            if isinstance(report.children[0], AggregateReport):
+                by_cohort.setdefault(report.cohort_id, []).append(report.metric)
+        for metrics in by_cohort.values():
+            FusedRevisionScan.fuse(metrics)
+        
+        groups = OrderedDict()
+        for report in reports:
+            scan = report.metric.fused_scan
+            key = id(report) if scan is None else id(scan)
+            groups.setdefault(key, []).append(report)
+        return groups.values()
+    
     @classmethod
     def create_reports_for_missed_days(cls, report, session):
         """
@@ -0,0 +1,66 @@
+from threading import RLock
+from collections import OrderedDict
+from sqlalchemy import case
+from wikimetrics.configurables import db
+from ..persistent_report import PersistentReport
+
+
+__all__ = ['StatusJournal']
+
+
+class StatusJournal(object):
+    """
+    Buffers the changes that running reports make to their PersistentReport rows,
+    like status, queue_result_key and result_key, so that a whole tree of reports
+    can write them in one UPDATE instead of one transaction per change.
+    Later changes to the same column of the same report replace earlier ones.
+    
+    A journal is shared by all the reports in a tree while it runs, and it can be
+    written to from the threads that run ReportLeaf children concurrently.
+    """
+    
+    def __init__(self):
+        self.lock = RLock()
+        self.pending = OrderedDict()
+    
+    def record(self, persistent_id, **values):
+        """
+        Parameters
+            persistent_id   : the id of the PersistentReport to change
+            values          : new values keyed by PersistentReport column name
+        """
+        with self.lock:
+            self.pending.setdefault(persistent_id, {}).update(values)
+    
+    def flush(self):
+        """
+        Writes all the pending changes with a single UPDATE ... CASE statement
+        """
+        with self.lock:
+            if not self.pending:
+                return
+            
+            changes_by_column = OrderedDict()
+            for persistent_id, values in self.pending.items():
+                for column, value in values.items():
+                    changes_by_column.setdefault(column, []).append(
+                        (persistent_id, value)
+                    )
+            
+            update = {}
+            for column, changes in changes_by_column.items():
+                update[column] = case(
+                    changes,
+                    value=PersistentReport.id,
+                    else_=getattr(PersistentReport, column),
+                )
+            
+            session = db.get_session()
+            try:
+                session.query(PersistentReport)\
+                    .filter(PersistentReport.id.in_(self.pending.keys()))\
+                    .update(update, synchronize_session=False)
+                session.commit()
+            finally:
+                session.close()
+            self.pending = OrderedDict()
@@ -3,7 +3,6 @@ from report import ReportLeaf
 from celery import current_task
 
 from wikimetrics.utils import stringify
-from wikimetrics.configurables import db
 
 
 class ValidateReport(ReportLeaf):
@@ -39,18 +38,14 @@ class ValidateReport(ReportLeaf):
         failures should happen unless the user tries to hack the system.
         """
         self.set_status(celery.states.STARTED, task_id=current_task.request.id)
-        session = db.get_session()
-        try:
-            from wikimetrics.models import PersistentReport
-            pj = session.query(PersistentReport).get(self.persistent_id)
-            pj.name = '{0} - {1} (failed validation)'.format(
+        self.write(
+            flush=True,
+            name='{0} - {1} (failed validation)'.format(
                 self.metric_label,
                 self.cohort_name,
-            )
-            pj.status = celery.states.FAILURE
-            session.commit()
-        finally:
-            session.close()
+            ),
+            status=celery.states.FAILURE,
+        )
         
         message = ''
         if not self.cohort_valid:
@@ -0,0 +1,161 @@
+from math import sqrt
+from decimal import Decimal
+from collections import OrderedDict, Mapping
+from wikimetrics.utils import CENSORED, r
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+__all__ = ['vector_aggregation_available', 'aggregate_vectors']
+
+
+# results are rounded to 4 places, so values are scaled to at least this
+MIN_SCALE_PLACES = 4
+MAX_SCALE_PLACES = 8
+# beyond this, sums could overflow int64 and Python integers are used instead
+INT64_SAFE = 2 ** 62
+
+
+def vector_aggregation_available():
+    return numpy is not None
+
+
+def aggregate_vectors(results_by_user, want_std=True):
+    """
+    Computes the sum, average and standard deviation of individual results in a
+    single pass, by loading them into a users x cells array where a cell is either a
+    submetric or a (submetric, time slice) pair.  Censored users and missing values
+    are masked out.  The output has the same shape and rounding as
+    AggregateReport.calculate.
+    
+    Values are scaled to integers (cents of cents, usually) so that the sums are
+    exact like the Decimal sums in AggregateReport.calculate, and the results match
+    it even when an average falls exactly halfway between two rounded values.
+    
+    Parameters
+        results_by_user : dictionary of user ids to their individual results
+        want_std        : whether to compute the standard deviation
+    
+    Returns
+        A tuple of (sums, averages, standard deviations), each shaped like the
+        individual results of a single user.  The standard deviations are None
+        if want_std is False
+    
+    Raises
+        ValueError if the results can't be aggregated exactly this way: when a
+        submetric is a timeseries for some users and not others, or when values
+        are floats or have too many decimal places
+    """
+    is_timeseries = OrderedDict()
+    cells = OrderedDict()
+    rows = []
+    columns = []
+    values = []
+    censored_rows = []
+    places = MIN_SCALE_PLACES
+    
+    def add(row, column, value):
+        """
+        Returns
+            the number of decimal places needed so far, including this value
+        """
+        if isinstance(value, float):
+            raise ValueError('float values can not be aggregated exactly')
+        rows.append(row)
+        columns.append(column)
+        values.append(value)
+        if isinstance(value, Decimal):
+            return max(places, -value.as_tuple().exponent)
+        return places
+    
+    for row, user_results in enumerate(results_by_user.values()):
+        if user_results.get(CENSORED) == 1:
+            censored_rows.append(row)
+        
+        for key, value in user_results.items():
+            if key == CENSORED:
+                continue
+            
+            timeseries = isinstance(value, Mapping)
+            if is_timeseries.setdefault(key, timeseries) != timeseries:
+                raise ValueError('{0} is not consistently a timeseries'.format(key))
+            
+            if timeseries:
+                for subkey, subvalue in value.items():
+                    column = cells.setdefault((key, subkey), len(cells))
+                    if subvalue is not None:
+                        places = add(row, column, subvalue)
+            else:
+                column = cells.setdefault((key, None), len(cells))
+                if value is not None:
+                    places = add(row, column, value)
+    
+    if places > MAX_SCALE_PLACES:
+        raise ValueError('values have more than {0} decimal places'.format(
+            MAX_SCALE_PLACES
+        ))
+    
+    scale = 10 ** places
+    scaled = [int(v * scale) for v in values]
+    largest = max([abs(v) for v in scaled] or [0])
+    
+    shape = (len(results_by_user), len(cells))
+    present = numpy.zeros(shape, dtype=bool)
+    present[rows, columns] = True
+    present[censored_rows, :] = False
+    counts = present.sum(axis=0)
+    
+    matrix = numpy.zeros(shape, dtype=safe_dtype(largest, shape[0]))
+    matrix[rows, columns] = scaled
+    matrix[~present] = 0
+    sums = matrix.sum(axis=0)
+    
+    sum_cells = [r(Decimal(int(s)) / scale) for s in sums]
+    average_cells = [
+        r(Decimal(int(s)) / (scale * int(c))) if c else r(0)
+        for s, c in zip(sums, counts)
+    ]
+    
+    std_cells = None
+    if want_std:
+        # like calculate, deviations are taken from the rounded average
+        averages = [int(a * scale) for a in average_cells]
+        largest_deviation = largest + max([abs(a) for a in averages] or [0])
+        dtype = safe_dtype(largest_deviation ** 2, shape[0])
+        deviations = matrix.astype(dtype) - numpy.array(averages, dtype=dtype)
+        deviations[~present] = 0
+        square_diffs = (deviations * deviations).sum(axis=0)
+        std_cells = [
+            r(sqrt(r(Decimal(int(d)) / (scale * scale * int(c))))) if c else r(0)
+            for d, c in zip(square_diffs, counts)
+        ]
+    
+    def shaped(cell_values):
+        if cell_values is None:
+            return None
+        result = dict()
+        for key, timeseries in is_timeseries.items():
+            if timeseries:
+                result[key] = OrderedDict()
+        for (key, subkey), column in cells.items():
+            if subkey is None:
+                result[key] = cell_values[column]
+            else:
+                result[key][subkey] = cell_values[column]
+        return result
+    
+    return shaped(sum_cells), shaped(average_cells), shaped(std_cells)
+
+
+def safe_dtype(largest, count):
+    """
+    Returns
+        int64 if count values as large as largest can be summed without
+        overflowing it, or else object, to sum them as Python integers
+    """
+    if largest * max(count, 1) < INT64_SAFE:
+        return numpy.int64
+    return object
@@ -1,11 +1,15 @@
 import celery
+from datetime import datetime, timedelta
+from functools import partial
 from celery import current_task
 from celery.utils.log import get_task_logger
 from flask.ext.login import current_user
 from wikimetrics.configurables import app, db, queue
 from sqlalchemy.orm.exc import NoResultFound, MultipleResultsFound
-from sqlalchemy.sql.expression import label, between, and_, or_
-from wikimetrics.utils import deduplicate_by_key
+from sqlalchemy import func
+from sqlalchemy.sql.expression import (
+    label, between, and_, or_, not_, select, bindparam,
+)
 from wikimetrics.controllers.forms.cohort_upload import parse_username
 from wikimetrics.models import (
     MediawikiUser, Cohort, CohortUser, CohortUserRole, WikiUser, CohortWikiUser
@@ -13,6 +17,28 @@ from wikimetrics.models import (
 
 
 task_logger = get_task_logger(__name__)
+# how many wiki_user records are validated, and written back, at a time
+VALIDATE_CHUNK_SIZE = 5000
+# writes the result of validating one wiki_user record, executed with many at once
+UPDATE_VALIDATION = WikiUser.__table__.update().where(
+    WikiUser.__table__.c.id == bindparam('wiki_user_id')
+).values(
+    valid=bindparam('new_valid'),
+    reason_invalid=bindparam('new_reason'),
+    mediawiki_username=bindparam('new_username'),
+    mediawiki_userid=bindparam('new_userid'),
+    last_validated=func.now(),
+)
+# stages the same result, for an incremental validation to apply when it's done
+STAGE_VALIDATION = WikiUser.__table__.update().where(
+    WikiUser.__table__.c.id == bindparam('wiki_user_id')
+).values(
+    pending_valid=bindparam('new_valid'),
+    pending_reason=bindparam('new_reason'),
+    pending_username=bindparam('new_username'),
+    pending_userid=bindparam('new_userid'),
+    pending_project=bindparam('new_project'),
+)
 
 
 @queue.task()
@@ -31,12 +57,15 @@ class ValidateCohort(object):
     * Updating the cohort to validated == True once all users have been validated
     """
     task = async_validate
+    incremental = False
     
-    def __init__(self, cohort):
+    def __init__(self, cohort, incremental=False):
         """
         Parameters:
-            cohort  : an existing cohort
-            config  : global config, we need to know
+            cohort      : an existing cohort
+            incremental : if True, only validate records that are not valid or
+                          that were validated long ago, see validate_records
+            config      : global config, we need to know
                 if we are on dev or testing to validate project name
         
         Instantiates with these properties:
@@ -46,6 +75,7 @@ class ValidateCohort(object):
         """
         self.cohort_id = cohort.id
         self.validate_as_user_ids = cohort.validate_as_user_ids
+        self.incremental = incremental
     
     @classmethod
     def from_upload(cls, cohort_upload, owner_user_id):
@@ -118,87 +148,160 @@ class ValidateCohort(object):
         Then, it finishes filling in the data model by inserting corresponding
         records into the cohort_wiki_users table.
         
+        The work is done with set based statements, so no WikiUser instances are
+        loaded: projects are normalized with one UPDATE per distinct project,
+        duplicates are deleted with one DELETE, and the remaining records are
+        read and validated in chunks of VALIDATE_CHUNK_SIZE, each written back
+        with a single executemany UPDATE.  Memory stays bounded by the chunk size
+        however large the cohort is, and each chunk is committed so the progress
+        shows in the UI.
+        
+        An incremental validation only validates the records that are not valid
+        yet, or that were last validated more than REVALIDATE_AFTER_DAYS ago.  Its
+        results are staged in the pending columns of wiki_user, and copied over
+        the live ones in the same transaction that writes the new cohort_wiki_user
+        rows, at the end.  Until then the cohort stays validated, and reports on
+        it see its members exactly as they were before.
+        
+        If VALIDATE_PROJECTS_PER_HOST is configured, projects are validated on a
+        thread pool that lets at most that many of them query the same database
+        host at once.  Each chunk adds its valid and invalid counts to the cohort
+        row, so the progress of all the projects can be read from there.
+        
         This is meant to execute asynchronously on celery
         
         Parameters
             session : an active wikimetrics db session to use
             cohort  : the cohort to validate; must belong to session
         """
-        # reset the cohort validation status so it can't be used for reports
-        cohort.validated = False
-        session.execute(
-            WikiUser.__table__.update().values(valid=None).where(
-                WikiUser.validating_cohort == cohort.id
-            )
+        wikiusers = WikiUser.__table__.update().where(
+            WikiUser.validating_cohort == cohort.id
         )
-        session.execute(CohortWikiUser.__table__.delete().where(
-            CohortWikiUser.cohort_id == cohort.id
-        ))
+        # results staged by an earlier incremental validation that did not finish
+        session.execute(wikiusers.values(pending_valid=None))
+        if not self.incremental:
+            # reset the cohort validation status so it can't be used for reports
+            cohort.validated = False
+            cohort.changed = datetime.now()
+            session.execute(wikiusers.values(valid=None))
+            session.execute(CohortWikiUser.__table__.delete().where(
+                CohortWikiUser.cohort_id == cohort.id
+            ))
         session.commit()
         
-        wikiusers = session.query(WikiUser) \
-            .filter(WikiUser.validating_cohort == cohort.id) \
-            .all()
-        
-        deduplicated = deduplicate_by_key(
-            wikiusers,
-            lambda r: (r.mediawiki_username, r.project)
-        )
+        projects = normalize_projects(session, cohort.id, staged=self.incremental)
+        delete_duplicates(session, cohort.id)
         
-        wikiusers_by_project = {}
-        for wu in deduplicated:
-            try:
-                normalized_project = normalize_project(wu.project)
-                if normalized_project is None:
-                    wu.reason_invalid = 'invalid project: {0}'.format(wu.project)
-                    wu.valid = False
-                    continue
-                
-                wu.project = normalized_project
-                if wu.project not in wikiusers_by_project:
-                    wikiusers_by_project[wu.project] = []
-                wikiusers_by_project[wu.project].append(wu)
-                
-                # validate bunches of records to update the UI but not kill performance
-                if len(wikiusers_by_project[wu.project]) > 999:
-                    validate_users(
-                        wikiusers_by_project[wu.project],
-                        wu.project,
-                        self.validate_as_user_ids
-                    )
-                    session.commit()
-                    wikiusers_by_project[wu.project] = []
-            except:
-                continue
+        if self.incremental:
+            revalidate_after = timedelta(days=queue.conf.get('REVALIDATE_AFTER_DAYS'))
+            stale = or_(
+                WikiUser.valid == None,
+                WikiUser.valid.in_([False]),
+                WikiUser.last_validated == None,
+                WikiUser.last_validated < datetime.now() - revalidate_after,
+            )
+        else:
+            stale = WikiUser.valid == None
         
-        # validate anything that wasn't big enough for a batch
-        for project, wikiusers in wikiusers_by_project.iteritems():
-            if len(wikiusers) > 0:
-                validate_users(wikiusers, project, self.validate_as_user_ids)
+        # the counts start from the records that are not validated again, those of
+        # unknown projects are invalid, and each chunk adds the records it validates
+        records = session.query(func.count(WikiUser.id))\
+            .filter(WikiUser.validating_cohort == cohort.id)
+        total = records.one()[0]
+        to_validate = valid = 0
+        if projects:
+            known = records.filter(
+                WikiUser.project.in_([project for project, normalized in projects])
+            )
+            to_validate = known.filter(stale).one()[0]
+            valid = known.filter(not_(stale)).filter(WikiUser.valid).one()[0]
+        cohort.validation_total = total
+        cohort.validation_valid = valid
+        cohort.validation_invalid = total - to_validate - valid
         session.commit()
         
-        unique_and_validated = deduplicate_by_key(
-            deduplicated,
-            lambda r: (r.mediawiki_username, r.project)
-        )
+        work = [
+            (normalized, partial(self.validate_project, project, normalized, stale))
+            for project, normalized in projects
+        ]
+        threads_per_host = queue.conf.get('VALIDATE_PROJECTS_PER_HOST')
+        if threads_per_host:
+            db.run_by_host(
+                work,
+                threads_per_host,
+                timeout=queue.conf.get('CELERYD_TASK_SOFT_TIME_LIMIT'),
+            )
+        else:
+            for project, validate_project in work:
+                validate_project()
         
-        session.execute(
-            CohortWikiUser.__table__.insert(), [
+        # the staged results and the new members replace the old ones in a single
+        # transaction, so reports see either the old members or the new ones
+        if self.incremental:
+            staged = wikiusers.where(WikiUser.pending_valid != None)
+            session.execute(staged.values(
+                valid=WikiUser.pending_valid,
+                reason_invalid=WikiUser.pending_reason,
+                mediawiki_username=WikiUser.pending_username,
+                mediawiki_userid=WikiUser.pending_userid,
+                project=WikiUser.pending_project,
+                last_validated=func.now(),
+            ))
+            session.execute(staged.values(pending_valid=None))
+        session.execute(CohortWikiUser.__table__.delete().where(
+            CohortWikiUser.cohort_id == cohort.id
+        ))
+        members = session.query(WikiUser.id)\
+            .filter(WikiUser.validating_cohort == cohort.id)
+        for chunk in in_chunks(members, WikiUser.id):
+            session.execute(CohortWikiUser.__table__.insert(), [
                 {
                     'cohort_id'     : cohort.id,
-                    'wiki_user_id'  : wu.id,
-                } for wu in unique_and_validated
-            ]
-        )
+                    'wiki_user_id'  : wiki_user_id,
+                } for (wiki_user_id,) in chunk
+            ])
         
-        # clean up any duplicate wiki_user records
-        session.execute(WikiUser.__table__.delete().where(and_(
-            WikiUser.validating_cohort == cohort.id,
-            WikiUser.id.notin_([wu.id for wu in unique_and_validated])
-        )))
         cohort.validated = True
+        cohort.changed = datetime.now()
         session.commit()
     
+    def validate_project(self, project, normalized, stale):
+        """
+        Validates the records of one project that need it, in chunks, with a
+        wikimetrics session of its own so it can run on any thread.  The results
+        are written to the records, or staged in an incremental validation.
+        
+        Parameters
+            project     : the project of the records to validate, as it's stored
+            normalized  : the normalized name of that project
+            stale       : a condition on WikiUser that the records to validate meet
+        """
+        session = db.get_session()
+        try:
+            unvalidated = session.query(WikiUser.id, WikiUser.mediawiki_username)\
+                .filter(WikiUser.validating_cohort == self.cohort_id)\
+                .filter(WikiUser.project == project)\
+                .filter(stale)
+            for chunk in in_chunks(unvalidated, WikiUser.id):
+                updates = validate_users(chunk, normalized, self.validate_as_user_ids)
+                if self.incremental:
+                    for update in updates:
+                        update['new_project'] = normalized
+                    session.execute(STAGE_VALIDATION, updates)
+                else:
+                    session.execute(UPDATE_VALIDATION, updates)
+                valid = len([u for u in updates if u['new_valid']])
+                # added in the database, other projects are counting at the same time
+                session.execute(Cohort.__table__.update().where(
+                    Cohort.id == self.cohort_id
+                ).values(
+                    validation_valid=Cohort.validation_valid + valid,
+                    validation_invalid=Cohort.validation_invalid + len(updates) - valid,
+                ))
+                session.commit()
+        finally:
+            session.close()
+    
     def __repr__(self):
         return '<ValidateCohort("{0}")>'.format(self.cohort_id)
 
@@ -223,50 +326,170 @@ def normalize_project(project):
             return new_proj
 
 
+def normalize_projects(session, cohort_id, staged=False):
+    """
+    Replaces the project of each of a cohort's wiki_user records with its
+    normalized name, and marks the records of unknown projects invalid.
+    Each distinct project is normalized once and written with one UPDATE.
+    
+    Parameters
+        session     : an active wikimetrics db session to use
+        cohort_id   : the cohort whose wiki_user records are being validated
+        staged      : if True, the records of unknown projects are only marked
+                      invalid in their pending columns, and the others keep their
+                      project until the validation of each record is applied
+    
+    Returns
+        a list of (project, normalized) for each known project, with the project
+        its records have after this, and its normalized name
+    """
+    projects = session.query(WikiUser.project)\
+        .filter(WikiUser.validating_cohort == cohort_id)\
+        .distinct()\
+        .all()
+    known = []
+    for (project,) in projects:
+        normalized = normalize_project(project) if project else None
+        records = WikiUser.__table__.update().where(and_(
+            WikiUser.validating_cohort == cohort_id,
+            WikiUser.project == project,
+        ))
+        if normalized is None and staged:
+            session.execute(records.values(
+                pending_valid=False,
+                pending_reason='invalid project: {0}'.format(project),
+                pending_username=WikiUser.mediawiki_username,
+                pending_userid=WikiUser.mediawiki_userid,
+                pending_project=WikiUser.project,
+            ))
+        elif normalized is None:
+            session.execute(records.values(
+                valid=False,
+                reason_invalid='invalid project: {0}'.format(project),
+            ))
+        elif staged:
+            known.append((project, normalized))
+        else:
+            # written even when equal, a case insensitive collation can match
+            # other spellings of the project that distinct did not return
+            session.execute(records.values(project=normalized))
+            if (normalized, normalized) not in known:
+                known.append((normalized, normalized))
+    return known
+
+
+def delete_duplicates(session, cohort_id):
+    """
+    Deletes all but the first of a cohort's wiki_user records that have the same
+    mediawiki_username and project, with a single DELETE.  The ids to keep are
+    selected through a derived table, which MySQL materializes, because it can
+    not otherwise delete from a table it selects from.  Records that are already
+    members of the cohort, which only happens in incremental validation, are kept.
+    
+    Parameters
+        session     : an active wikimetrics db session to use
+        cohort_id   : the cohort whose wiki_user records are being validated
+    """
+    wikiusers = WikiUser.__table__
+    keep = select([func.min(wikiusers.c.id).label('id')])\
+        .where(wikiusers.c.validating_cohort == cohort_id)\
+        .group_by(wikiusers.c.mediawiki_username, wikiusers.c.project)\
+        .alias('keep')
+    session.execute(wikiusers.delete().where(and_(
+        wikiusers.c.validating_cohort == cohort_id,
+        wikiusers.c.id.notin_(select([keep.c.id])),
+        wikiusers.c.id.notin_(
+            select([CohortWikiUser.wiki_user_id])
+            .where(CohortWikiUser.cohort_id == cohort_id)
+        ),
+    )))
+
+
+def in_chunks(query, id_column, chunk_size=None):
+    """
+    Reads the rows of a query in chunks, each with its own query that starts after
+    the last id of the previous chunk, so at most chunk_size rows are held at once
+    
+    Parameters
+        query       : a sqlalchemy query whose rows start with id_column
+        id_column   : the column to order and page the rows by
+        chunk_size  : the most rows in a chunk, defaults to VALIDATE_CHUNK_SIZE
+    
+    Returns
+        a generator of lists of rows
+    """
+    chunk_size = chunk_size or VALIDATE_CHUNK_SIZE
+    last_id = None
+    while True:
+        chunk_query = query
+        if last_id is not None:
+            chunk_query = chunk_query.filter(id_column > last_id)
+        chunk = chunk_query.order_by(id_column).limit(chunk_size).all()
+        if not chunk:
+            return
+        yield chunk
+        last_id = chunk[-1][0]
+
+
 def validate_users(wikiusers, project, validate_as_user_ids):
     """
     Parameters
-        wikiusers               : the wikiusers with a candidate mediawiki_username
+        wikiusers               : list of (id, mediawiki_username) tuples of the
+                                  wiki_user records to validate
         project                 : the project these wikiusers should belong to
         validate_as_user_ids    : if True, records will be checked against user_id
                                   if False, records are checked against user_name
+    
+    Returns
+        a list with the parameters of UPDATE_VALIDATION for each wiki_user record
     """
-    session = db.get_mw_session(project)
-    users_dict = {wu.mediawiki_username: wu for wu in wikiusers}
+    ids_by_key = {}
+    for wiki_user_id, username in wikiusers:
+        ids_by_key.setdefault(username, []).append(wiki_user_id)
     
+    session = db.get_mw_session(project)
     try:
         # validate
         if validate_as_user_ids:
-            keys_as_ints = [int(k) for k in users_dict.keys() if k.isdigit()]
+            keys_as_ints = [int(k) for k in ids_by_key.keys() if k.isdigit()]
             clause = MediawikiUser.user_id.in_(keys_as_ints)
         else:
-            clause = MediawikiUser.user_name.in_(users_dict.keys())
+            clause = MediawikiUser.user_name.in_(ids_by_key.keys())
         
-        matches = session.query(MediawikiUser).filter(clause).all()
-        # update results
-        for match in matches:
-            if validate_as_user_ids:
-                key = str(match.user_id)
-            else:
-                key = parse_username(match.user_name)
-            users_dict[key].mediawiki_username = match.user_name
-            users_dict[key].mediawiki_userid = match.user_id
-            users_dict[key].valid = True
-            users_dict[key].reason_invalid = None
-            # remove valid matches
-            users_dict.pop(key)
-        
-        # mark the rest invalid
-        for key in users_dict.keys():
-            if validate_as_user_ids:
-                users_dict[key].reason_invalid = 'invalid user_id: {0}'.format(key)
-            else:
-                users_dict[key].reason_invalid = 'invalid user_name: {0}'.format(key)
-            users_dict[key].valid = False
-    except Exception, e:
-        # clear out the dictionary in case of an exception, and raise the exception
-        for key in users_dict.keys():
-            users_dict.pop(key)
-        raise e
+        matches = session.query(MediawikiUser.user_id, MediawikiUser.user_name)\
+            .filter(clause)\
+            .all()
     finally:
         session.close()
+    
+    updates = []
+    for user_id, user_name in matches:
+        if validate_as_user_ids:
+            key = str(user_id)
+        else:
+            key = parse_username(user_name)
+        # remove valid matches
+        for wiki_user_id in ids_by_key.pop(key, []):
+            updates.append({
+                'wiki_user_id'      : wiki_user_id,
+                'new_valid'         : True,
+                'new_reason'        : None,
+                'new_username'      : user_name,
+                'new_userid'        : user_id,
+            })
+    
+    # mark the rest invalid
+    for key, wiki_user_ids in ids_by_key.items():
+        if validate_as_user_ids:
+            reason = 'invalid user_id: {0}'.format(key)
+        else:
+            reason = 'invalid user_name: {0}'.format(key)
+        for wiki_user_id in wiki_user_ids:
+            updates.append({
+                'wiki_user_id'      : wiki_user_id,
+                'new_valid'         : False,
+                'new_reason'        : reason,
+                'new_username'      : key,
+                'new_userid'        : None,
+            })
+    return updates
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean
+from sqlalchemy import Column, Integer, String, Boolean, DateTime
 from wikimetrics.configurables import db
 
 __all__ = [
@@ -28,6 +28,15 @@ class WikiUser(db.WikimetricsBase):
     reason_invalid      = Column(String(200))
     # The cohort id that this wikiuser is being validated for
     validating_cohort   = Column(Integer)
+    # when valid was last set by validation
+    last_validated      = Column(DateTime)
+    # the result of an incremental validation, copied to the columns above when
+    # it finishes, pending_valid = None means no result is pending
+    pending_valid       = Column(Boolean, default=None)
+    pending_reason      = Column(String(200))
+    pending_username    = Column(String(255))
+    pending_userid      = Column(Integer)
+    pending_project     = Column(String(45))
 
     def __repr__(self):
         return '<WikiUser("{0}")>'.format(self.id)
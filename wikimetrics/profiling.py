@@ -0,0 +1,274 @@
+"""
+This module profiles the work reports do, so a slow report can be traced to its
+replica queries, to the python work on their rows, or to aggregation.
+
+A Profile is made active on the thread doing the work, and the listeners that
+profile_queries installs on database engines add every query run on that thread
+to it, with its duration, its row count and, for slow queries, its EXPLAIN plan.
+Phases of the work are timed with the phase context manager.
+"""
+import re
+from time import time
+from threading import Lock, local
+from contextlib import contextmanager
+from collections import OrderedDict
+
+from sqlalchemy import event
+
+
+__all__ = [
+    'Profile',
+    'current_profile',
+    'phase',
+    'profile_queries',
+    'profile_streamed_query',
+]
+
+
+# the profiles active on each thread, innermost last
+active_profiles = local()
+# only these statements can be EXPLAINed on the MySQL versions we run on
+EXPLAINABLE = re.compile(r'^\s*SELECT\b', re.IGNORECASE)
+# MySQLdb reports the row count of an unbuffered cursor as (my_ulonglong) -1
+UNKNOWN_ROWS = 2 ** 63
+
+
+class Profile(object):
+    """
+    The timings of one report's work: the seconds spent in each phase, totals for
+    the queries it ran, the slowest of those queries, and the profiles of the
+    reports below it.  Queries and phases can be added from several threads at
+    once, like the chunks of a MetricReport that run on a thread pool, in which
+    case the seconds of a phase are summed over the threads.
+    """
+    
+    # the number of slowest queries kept, each with its sql, seconds and rows
+    SLOWEST_QUERIES = 20
+    # the longest sql kept for each query, a cohort's IN list can be much longer
+    SQL_LENGTH = 2000
+    
+    def __init__(self, name=None):
+        """
+        Parameters
+            name    : what the profile is of, like the repr of a report
+        """
+        self.name = name
+        self.lock = Lock()
+        self.phases = OrderedDict()
+        self.query_count = 0
+        self.query_seconds = 0
+        self.query_rows = 0
+        self.queries = []
+        self.children = []
+    
+    def __getstate__(self):
+        # reports are pickled by celery, locks can not be pickled
+        state = self.__dict__.copy()
+        del state['lock']
+        return state
+    
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = Lock()
+    
+    @contextmanager
+    def active(self):
+        """
+        Adds the queries run on this thread to this profile, until the block ends
+        """
+        stack = getattr(active_profiles, 'stack', None)
+        if stack is None:
+            stack = active_profiles.stack = []
+        stack.append(self)
+        try:
+            yield self
+        finally:
+            stack.pop()
+    
+    @contextmanager
+    def phase(self, name):
+        """
+        Adds the seconds the block takes to the named phase
+        """
+        start = time()
+        try:
+            yield
+        finally:
+            seconds = time() - start
+            with self.lock:
+                self.phases[name] = self.phases.get(name, 0) + seconds
+    
+    def query(self, database, sql, seconds, rows, explain=None):
+        """
+        Parameters
+            database    : the name of the database the query ran on
+            sql         : the statement, without its parameters
+            seconds     : how long the database took to execute it
+            rows        : the number of rows it returned or changed, -1 if unknown
+            explain     : the EXPLAIN plan of the query, as a list of dictionaries
+        """
+        with self.lock:
+            self.query_count += 1
+            self.query_seconds += seconds
+            if rows > 0:
+                self.query_rows += rows
+            
+            if len(self.queries) >= self.SLOWEST_QUERIES:
+                fastest = min(self.queries, key=lambda q: q['seconds'])
+                if fastest['seconds'] >= seconds:
+                    return
+                self.queries.remove(fastest)
+            
+            query = OrderedDict([
+                ('database', database),
+                ('sql', sql[:self.SQL_LENGTH]),
+                ('seconds', seconds),
+                ('rows', rows),
+            ])
+            if explain is not None:
+                query['explain'] = explain
+            self.queries.append(query)
+    
+    def as_dict(self):
+        """
+        Returns
+            this profile and the profiles of its children as plain dictionaries,
+            with the slowest queries first
+        """
+        with self.lock:
+            return OrderedDict([
+                ('name', self.name),
+                ('phases', OrderedDict(
+                    (name, round(seconds, 6)) for name, seconds in self.phases.items()
+                )),
+                ('query_count', self.query_count),
+                ('query_seconds', round(self.query_seconds, 6)),
+                ('query_rows', self.query_rows),
+                ('queries', sorted(
+                    self.queries, key=lambda q: q['seconds'], reverse=True
+                )),
+                ('children', [child.as_dict() for child in self.children]),
+            ])
+
+
+def current_profile():
+    """
+    Returns
+        the innermost Profile active on this thread, or None
+    """
+    stack = getattr(active_profiles, 'stack', None)
+    if stack:
+        return stack[-1]
+    return None
+
+
+@contextmanager
+def phase(name):
+    """
+    Times the block as a phase of the Profile active on this thread, if any
+    """
+    profile = current_profile()
+    if profile is None:
+        yield
+    else:
+        with profile.phase(name):
+            yield
+
+
+def profile_queries(engine, config):
+    """
+    Installs listeners on engine that add each query run while a Profile is
+    active on the same thread to that Profile
+    
+    Queries that stream their rows from a server side cursor are only added by
+    profile_streamed_query, once their rows are read, because until then their
+    duration leaves out the fetching, their row count is unknown, and EXPLAIN
+    can not run on the connection.
+    
+    Parameters
+        engine  : a sqlalchemy engine
+        config  : the database config.  SELECT queries that take at least
+                  QUERY_EXPLAIN_SECONDS are run again with EXPLAIN, on the same
+                  connection, and the plan is kept with the query.  If it is not
+                  set, or 0, EXPLAIN never runs
+    """
+    
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context,
+                              executemany):
+        if current_profile() is not None:
+            conn.info.setdefault('query_start', []).append(time())
+    
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context,
+                             executemany):
+        profile = current_profile()
+        starts = conn.info.get('query_start')
+        if profile is None or not starts:
+            return
+        start = starts.pop()
+        explain_seconds = config.get('QUERY_EXPLAIN_SECONDS')
+        
+        if context is not None and context.execution_options.get('stream_results'):
+            conn.info['streamed_query'] = (start, statement, parameters, explain_seconds)
+            return
+        
+        rows = cursor.rowcount
+        if rows >= UNKNOWN_ROWS:
+            rows = -1
+        add_query(profile, conn, start, statement, parameters, rows, explain_seconds)
+
+
+def profile_streamed_query(conn, rows, drained):
+    """
+    Adds the last query that streamed its rows on a connection to the Profile
+    active on this thread, if any, with the time it took to read the rows
+    
+    Parameters
+        conn    : the sqlalchemy connection the query ran on
+        rows    : the number of rows that were read
+        drained : whether all the rows were read.  If not, MySQL is still sending
+                  the others, so EXPLAIN can not run
+    """
+    streamed = conn.info.pop('streamed_query', None)
+    profile = current_profile()
+    if profile is None or streamed is None:
+        return
+    start, statement, parameters, explain_seconds = streamed
+    if not drained:
+        explain_seconds = None
+    add_query(profile, conn, start, statement, parameters, rows, explain_seconds)
+
+
+def add_query(profile, conn, start, statement, parameters, rows, explain_seconds):
+    """
+    Adds a query that started at start and just finished to profile, with its
+    EXPLAIN plan if it is a SELECT that took at least explain_seconds
+    """
+    seconds = time() - start
+    explain = None
+    if explain_seconds and seconds >= explain_seconds \
+            and EXPLAINABLE.match(statement):
+        explain = explain_query(conn, statement, parameters)
+    
+    profile.query(conn.engine.url.database, statement, seconds, rows, explain)
+
+
+def explain_query(conn, statement, parameters):
+    """
+    Runs EXPLAIN for a statement on a new cursor of the same DBAPI connection,
+    so it sees the same temporary tables, like the one BoundUserIds creates.
+    
+    Returns
+        a list of dictionaries, one per row of the plan, or None if the plan
+        could not be read, which never keeps the query itself from succeeding
+    """
+    cursor = conn.connection.cursor()
+    try:
+        cursor.execute('EXPLAIN ' + statement, parameters)
+        columns = [column[0] for column in cursor.description]
+        return [OrderedDict(zip(columns, row)) for row in cursor.fetchall()]
+    except Exception:
+        return None
+    finally:
+        cursor.close()
@@ -80,10 +80,11 @@ $(document).ready(function(){
                 delete response.metric.tabIdSelector;
                 delete response.metric.selected;
                 delete response.metric.description;
+                delete response.metric.percentileList;
             });
             data = JSON.stringify(data);
             
-            $.ajax({ type: 'post', url: form.attr('action'), data: {responses: data, recurrent: vm.request().recurrent()} })
+            $.ajax({ type: 'post', url: form.attr('action'), data: {responses: data, recurrent: vm.request().recurrent(), incremental: vm.request().incremental()} })
                 .done(site.handleWith(function(response){
                     // should redirect to the reports page, so show an error otherwise
                     site.showWarning('Unexpected: ' + JSON.stringify(response));
@@ -141,6 +142,7 @@ $(document).ready(function(){
     // computed pieces of the viewModel
     viewModel.request = ko.observable({
         recurrent: ko.observable(false),
+        incremental: ko.observable(false),
         
         cohorts: ko.computed(function(){
             return this.cohorts().filter(function(cohort){
@@ -208,8 +210,16 @@ $(document).ready(function(){
             item.aggregateSum = ko.observable(true);
             item.aggregateAverage = ko.observable(false);
             item.aggregateStandardDeviation = ko.observable(false);
+            item.aggregateMedian = ko.observable(false);
+            item.aggregatePercentiles = ko.observable('');
+            item.percentileList = ko.computed(function(){
+                return ko.utils.arrayFilter(
+                    ko.utils.arrayMap(this.aggregatePercentiles().split(','), $.trim),
+                    function(percentile){ return percentile.length; }
+                );
+            }, item);
             item.outputConfigured = ko.computed(function(){
-                return this.individualResults() || (this.aggregateResults() && (this.aggregateSum() || this.aggregateAverage() || this.aggregateStandardDeviation()));
+                return this.individualResults() || (this.aggregateResults() && (this.aggregateSum() || this.aggregateAverage() || this.aggregateStandardDeviation() || this.aggregateMedian() || this.percentileList().length));
             }, item);
         });
     }
@@ -25,6 +25,56 @@ $(document).ready(function(){
                     });
             }
             return true;
+        },
+        
+        toggleProfile: function(report) {
+            if (report.profile()) {
+                report.profile(null);
+                return;
+            }
+            $.get('/reports/profile/' + report.id)
+                .done(site.handleWith(function(data){
+                    report.profile(viewModel.summarizeProfile(data.profile));
+                }))
+                .fail(site.failure);
+        },
+        
+        // flattens the profiles of a report's tree into its phases, one row per
+        // report and phase, and the slowest queries of the whole tree
+        summarizeProfile: function(profile) {
+            var summary = {
+                recorded: !!profile,
+                phases: [],
+                queries: [],
+                queryCount: 0,
+                querySeconds: 0
+            };
+            var visit = function(node, depth) {
+                for (var phase in node.phases) {
+                    summary.phases.push({
+                        name: node.name,
+                        depth: depth,
+                        phase: phase,
+                        seconds: node.phases[phase]
+                    });
+                }
+                node.queries.forEach(function(query){
+                    summary.queries.push(query);
+                });
+                summary.queryCount += node.query_count;
+                summary.querySeconds += node.query_seconds;
+                node.children.forEach(function(child){
+                    visit(child, depth + 1);
+                });
+            };
+            if (profile) {
+                visit(profile, 0);
+            }
+            summary.queries.sort(function(query1, query2) {
+                return query2.seconds - query1.seconds;
+            });
+            summary.queries = summary.queries.slice(0, 10);
+            return summary;
         }
     };
 
@@ -127,6 +127,7 @@ var site = {
                         report.public = ko.observable(report.public);
                         report.success = report.status === 'SUCCESS';
                         report.publicResult = '/static/public/' + report.id + '.json';
+                        report.profile = ko.observable(null);
                     });
                     viewModel.reports(data.reports);
                 }
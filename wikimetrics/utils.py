@@ -2,6 +2,7 @@ import json
 import os
 import os.path
 
+from collections import Mapping, OrderedDict
 from decimal import Decimal, ROUND_HALF_UP
 from datetime import datetime, timedelta, date
 from flask import Response
@@ -19,6 +20,19 @@ UNICODE_NULL = u'\x00'
 
 
 def parse_date(date_string):
+    """
+    Parses a MediaWiki timestamp like strptime with MEDIAWIKI_TIMESTAMP, but
+    reads the fields of the usual 14 digit form by slicing, which is much faster
+    """
+    if len(date_string) == 14 and date_string.isdigit():
+        return datetime(
+            int(date_string[0:4]),
+            int(date_string[4:6]),
+            int(date_string[6:8]),
+            int(date_string[8:10]),
+            int(date_string[10:12]),
+            int(date_string[12:14]),
+        )
     return datetime.strptime(date_string, MEDIAWIKI_TIMESTAMP)
 
 
@@ -85,6 +99,10 @@ class BetterEncoder(json.JSONEncoder):
         if isinstance(obj, Decimal):
             return float(obj)
         
+        # read only views, like the timeseries of metric results
+        if isinstance(obj, Mapping):
+            return OrderedDict(obj.iteritems())
+        
         return json.JSONEncoder.default(self, obj)
 
 